@@ -0,0 +1,118 @@
+"""Chunked conversion of text columns to typed values
+
+Migration 0010 uses it to move ItemParamDet.Date, D3 and D4 from text to
+DATE and DECIMAL columns: rows are read in primary key order, chunk_size
+at a time, parsed into the new columns and written back with
+bulk_update(). Values that cannot be parsed are collected in a
+ConversionReport instead of being silently dropped.
+"""
+import datetime
+from decimal import Decimal, InvalidOperation
+
+DATE_FORMATS = (
+    '%Y-%m-%d', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S',
+    '%Y/%m/%d', '%d-%m-%Y', '%d/%m/%Y', '%d.%m.%Y',
+)
+PRICE_PLACES = Decimal('0.01')
+
+# Bad values listed individually by a report; the rest are only counted
+REPORTED_BAD_VALUES = 50
+
+
+def parse_date(value):
+    """Return value as a date (None when blank); raise ValueError if unparseable"""
+    if value is None or isinstance(value, datetime.date):
+        return value.date() if isinstance(value, datetime.datetime) else value
+    text = str(value).strip()
+    if not text:
+        return None
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(text, date_format).date()
+        except ValueError:
+            continue
+    raise ValueError(f"Unrecognized date {value!r}")
+
+
+def parse_decimal(value):
+    """Return value as a Decimal rounded to cents (None when blank); raise ValueError if unparseable"""
+    if value is None:
+        return None
+    text = str(value).strip().replace(',', '')
+    if not text:
+        return None
+    try:
+        number = Decimal(text)
+    except InvalidOperation:
+        raise ValueError(f"Unrecognized number {value!r}") from None
+    if not number.is_finite():
+        raise ValueError(f"Unrecognized number {value!r}")
+    return number.quantize(PRICE_PLACES)
+
+
+def format_date(value):
+    return value.isoformat() if value else ''
+
+
+def format_decimal(value):
+    return '' if value is None else str(value)
+
+
+class ConversionReport:
+    """Rows converted and values that could not be parsed"""
+
+    def __init__(self):
+        self.rows = 0
+        self.bad_count = 0
+        self.bad_values = []    # (pk, field, value), up to REPORTED_BAD_VALUES
+
+    def add_bad(self, pk, field, value):
+        self.bad_count += 1
+        if len(self.bad_values) < REPORTED_BAD_VALUES:
+            self.bad_values.append((pk, field, value))
+
+    @property
+    def ok(self):
+        return self.bad_count == 0
+
+    def __str__(self):
+        lines = [f"Converted {self.rows} rows, {self.bad_count} bad values"]
+        lines.extend(f"  pk={pk} {field}={value!r}" for pk, field, value in self.bad_values)
+        if self.bad_count > len(self.bad_values):
+            lines.append(f"  ... and {self.bad_count - len(self.bad_values)} more")
+        return '\n'.join(lines)
+
+
+def convert_in_chunks(queryset, conversions, chunk_size=5000, report=None):
+    """Fill typed fields from source fields across a queryset
+
+    Args:
+        conversions: Dict mapping source field name to (target field name,
+            parser); a parser raising ValueError marks the value as bad and
+            leaves the target None
+        chunk_size: Rows read and updated per round trip
+
+    Returns:
+        The ConversionReport (report, if given)
+    """
+    report = report if report is not None else ConversionReport()
+    targets = [target for target, _ in conversions.values()]
+    queryset = queryset.order_by('pk').only('pk', *conversions, *targets)
+    last_pk = None
+    while True:
+        chunk = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+        rows = list(chunk[:chunk_size])
+        if not rows:
+            break
+        for row in rows:
+            for source, (target, parse) in conversions.items():
+                raw = getattr(row, source)
+                try:
+                    setattr(row, target, parse(raw))
+                except ValueError:
+                    setattr(row, target, None)
+                    report.add_bad(row.pk, source, raw)
+        queryset.model._base_manager.db_manager(queryset.db).bulk_update(rows, targets, batch_size=chunk_size)
+        report.rows += len(rows)
+        last_pk = rows[-1].pk
+    return report
@@ -0,0 +1,35 @@
+from pathlib import Path
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+
+from core import tenants
+from core.models import UserProfile
+
+
+class Command(BaseCommand):
+    help = "Create or update the database of every company (or of the given profiles)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'companies', nargs='*', type=int,
+            help="UserProfile pks; all profiles when omitted",
+        )
+
+    def handle(self, *args, **options):
+        if not tenants.enabled():
+            raise CommandError("REPORT_TENANTS['DATABASE'] is not configured")
+        profiles = UserProfile.objects.order_by('pk')
+        if options['companies']:
+            profiles = profiles.filter(pk__in=options['companies'])
+
+        for profile in profiles:
+            alias = tenants.register_database(profile)
+            config = tenants.database_settings(profile)
+            if config['ENGINE'].endswith('sqlite3'):
+                Path(config['NAME']).parent.mkdir(parents=True, exist_ok=True)
+            self.stdout.write(f"{profile} ({alias})")
+            with tenants.using_company(profile):
+                call_command('migrate', database=alias, interactive=False,
+                             verbosity=options['verbosity'], stdout=self.stdout)
+        self.stdout.write(self.style.SUCCESS("Company databases are up to date"))
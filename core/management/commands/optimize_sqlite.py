@@ -0,0 +1,63 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from core import tenants
+from core.models import UserProfile
+
+
+class Command(BaseCommand):
+    help = "Refresh SQLite query planner statistics and checkpoint the WAL; run it periodically"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--database', action='append', dest='databases',
+            help="Database alias to optimize (repeatable); all SQLite databases when omitted",
+        )
+        parser.add_argument(
+            '--analyze', action='store_true',
+            help="Run a full ANALYZE instead of PRAGMA optimize",
+        )
+        parser.add_argument(
+            '--analysis-limit', type=int, default=1000,
+            help="Rows sampled per index by ANALYZE (0 for no limit)",
+        )
+        parser.add_argument(
+            '--no-checkpoint', action='store_true',
+            help="Leave the WAL file as it is",
+        )
+
+    def get_aliases(self, options):
+        if tenants.enabled():
+            for profile in UserProfile.objects.all():
+                tenants.register_database(profile)
+        if options['databases']:
+            unknown = set(options['databases']) - set(connections.settings)
+            if unknown:
+                raise CommandError(f"Unknown database alias {', '.join(sorted(unknown))}")
+            return options['databases']
+        return [
+            alias for alias in connections.settings
+            if connections[alias].vendor == 'sqlite' and not connections[alias].is_in_memory_db()
+        ]
+
+    def handle(self, *args, **options):
+        for alias in self.get_aliases(options):
+            connection = connections[alias]
+            if connection.vendor != 'sqlite':
+                raise CommandError(f"Database {alias} is not SQLite")
+            started = time.monotonic()
+            with connection.cursor() as cursor:
+                cursor.execute(f"PRAGMA analysis_limit = {int(options['analysis_limit'])}")
+                cursor.execute("ANALYZE" if options['analyze'] else "PRAGMA optimize")
+                summary = f"{alias}: {'analyzed' if options['analyze'] else 'optimized'}"
+                if not options['no_checkpoint']:
+                    cursor.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+                    busy, log_pages, checkpointed = cursor.fetchone()
+                    if log_pages < 0:
+                        summary += ", not in WAL mode"
+                    else:
+                        summary += f", {checkpointed} WAL pages checkpointed" + (" (readers busy)" if busy else "")
+            self.stdout.write(f"{summary} in {time.monotonic() - started:.2f}s")
+        self.stdout.write(self.style.SUCCESS("SQLite databases optimized"))
@@ -0,0 +1,116 @@
+import sqlite3
+from contextlib import closing
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+
+from core import sync
+from core.models import UserProfile
+from core.tenants import using_company
+from reports.utils import get_sql_server_connection
+
+
+class Command(BaseCommand):
+    help = "Load items and parameter details from the Busy database of the active (or given) UserProfile"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--company', type=int,
+            help="Pk of the UserProfile to sync instead of the active one",
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=5000,
+            help="Rows fetched and upserted per batch",
+        )
+        parser.add_argument(
+            '--source-sqlite',
+            help="Read from a local SQLite copy of the Busy tables instead of SQL Server",
+        )
+        parser.add_argument(
+            '--skip-items', action='store_true',
+            help="Only load parameter details",
+        )
+        parser.add_argument(
+            '--incremental', action='store_true',
+            help="Only load vouchers past the stored watermark and recent edits",
+        )
+        parser.add_argument(
+            '--lookback-days', type=int, default=3,
+            help="Incremental mode: also reload vouchers dated within this many days",
+        )
+        parser.add_argument(
+            '--reconcile-days', type=int, default=90,
+            help="Incremental mode: days checked for rows deleted in Busy",
+        )
+        parser.add_argument(
+            '--reconcile', action='store_true', default=None,
+            help="Incremental mode: check for deletions now instead of on the configured interval",
+        )
+        parser.add_argument(
+            '--skip-ledger', action='store_true',
+            help="Do not rebuild the stock ledger after loading",
+        )
+        parser.add_argument(
+            '--skip-search-index', action='store_true',
+            help="Do not rebuild the parameter search index after loading (search falls back to icontains)",
+        )
+        parser.add_argument(
+            '--skip-facets', action='store_true',
+            help="Do not recount the parameter list filter facets after loading",
+        )
+
+    def get_source(self, options, profile):
+        """Return a context manager yielding the source connection"""
+        if options['source_sqlite']:
+            return closing(sqlite3.connect(options['source_sqlite']))
+        return get_sql_server_connection(profile)
+
+    def handle(self, *args, **options):
+        if options['company'] is None:
+            profile = UserProfile.get_active_config()
+        else:
+            profile = UserProfile.get_config(options['company'])
+            if profile is None:
+                raise CommandError(f"No UserProfile with pk {options['company']}")
+        if options['incremental'] and profile is None:
+            raise CommandError("Incremental sync needs an active UserProfile")
+
+        # With per-company databases this loads into the profile's own database
+        with using_company(profile):
+            self.sync(profile, options)
+        self.stdout.write(self.style.SUCCESS("Sync complete"))
+
+    def sync(self, profile, options):
+        batch_size = options['batch_size']
+        with self.get_source(options, profile) as connection:
+            if not options['skip_items']:
+                self.stdout.write(str(sync.sync_items(connection, batch_size)))
+                if profile is not None:
+                    sync.record_item_sync(profile)
+            if options['incremental']:
+                results = sync.sync_incremental(
+                    connection, profile, batch_size,
+                    lookback_days=options['lookback_days'],
+                    reconcile_days=options['reconcile_days'],
+                    reconcile=options['reconcile'],
+                )
+            else:
+                results = [sync.sync_param_details(connection, batch_size)]
+                if profile is not None:
+                    sync.record_watermark(profile, results[0])
+        for result in results:
+            self.stdout.write(str(result))
+
+        # bulk_create bypasses the signals that maintain the ledger, search index and facets
+        changed = [result.first_date for result in results if result.first_date]
+        for command, skip in (('rebuild_stock_ledger', 'skip_ledger'),
+                              ('rebuild_search_index', 'skip_search_index')):
+            if options[skip]:
+                continue
+            if not options['incremental']:
+                call_command(command, stdout=self.stdout)
+            elif changed:
+                call_command(command, since=min(changed), stdout=self.stdout)
+        # Facet counts are not dated, so they are always recounted in full
+        if not options['skip_facets'] and (changed or not options['incremental']):
+            call_command('rebuild_facets', stdout=self.stdout)
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.4 on 2026-10-17 09:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_rename_item_itemparamdet_itemcode'),
+    ]
+
+    # Existing rows get 0: their Value1 is already signed, and core.vouchers
+    # counts code 0 as stored rather than by a voucher type's sign
+    operations = [
+        migrations.AddField(
+            model_name='itemparamdet',
+            name='VchType',
+            field=models.IntegerField(default=0),
+        ),
+    ]
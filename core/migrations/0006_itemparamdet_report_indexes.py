@@ -0,0 +1,29 @@
+# Generated by Django 5.2.4 on 2026-10-17 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_itemparamdet_vchtype'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='itemparamdet',
+            index=models.Index(fields=['ItemCode', 'Date', 'Value1'], name='itemparamdet_item_date_value'),
+        ),
+        migrations.AddIndex(
+            model_name='itemparamdet',
+            index=models.Index(fields=['BCN', 'Date'], name='itemparamdet_bcn_date'),
+        ),
+        migrations.AddIndex(
+            model_name='itemparamdet',
+            index=models.Index(fields=['C1'], name='itemparamdet_c1'),
+        ),
+        migrations.AddIndex(
+            model_name='itemparamdet',
+            index=models.Index(fields=['C2'], name='itemparamdet_c2'),
+        ),
+    ]
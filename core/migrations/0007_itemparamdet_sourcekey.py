@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-17 10:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_itemparamdet_report_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='itemparamdet',
+            name='SourceKey',
+            field=models.CharField(blank=True, help_text='VchCode-SrNo of the row in the Busy database', max_length=50, null=True, unique=True),
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 5.2.4 on 2026-10-17 20:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+PARAMETER_FIELDS = ('C1', 'C2', 'C3', 'C4', 'C5')
+
+
+def make_label(values):
+    params = [str(value).strip() for value in values if value and str(value).strip()]
+    return ' | '.join(params) if params else "No Parameters"
+
+
+def populate_parameter_sets(apps, schema_editor):
+    ItemParamDet = apps.get_model('core', 'ItemParamDet')
+    ParameterSet = apps.get_model('core', 'ParameterSet')
+    alias = schema_editor.connection.alias
+    combinations = list(
+        ItemParamDet.objects.using(alias).values_list(*PARAMETER_FIELDS).distinct().order_by()
+    )
+    for values in combinations:
+        values = tuple(value or '' for value in values)
+        fields = dict(zip(PARAMETER_FIELDS, values))
+        parameter_set, _ = ParameterSet.objects.using(alias).get_or_create(**fields, defaults={'label': make_label(values)})
+        ItemParamDet.objects.using(alias).filter(**fields).update(ParamSet=parameter_set)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_syncstate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ParameterSet',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('C1', models.CharField(blank=True, max_length=50)),
+                ('C2', models.CharField(blank=True, max_length=50)),
+                ('C3', models.CharField(blank=True, max_length=50)),
+                ('C4', models.CharField(blank=True, max_length=50)),
+                ('C5', models.CharField(blank=True, max_length=50)),
+                ('label', models.CharField(help_text="Non-blank parameters joined with ' | '", max_length=255)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('C1', 'C2', 'C3', 'C4', 'C5'), name='parameterset_values')],
+            },
+        ),
+        migrations.AddField(
+            model_name='itemparamdet',
+            name='ParamSet',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='rows', to='core.parameterset'),
+        ),
+        migrations.RunPython(populate_parameter_sets, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,147 @@
+# Generated by Django 5.2.4 on 2026-10-17 21:00
+
+from importlib import import_module
+
+from django.db import migrations, models
+
+from core.conversion import (
+    convert_in_chunks, format_date, format_decimal, parse_date, parse_decimal,
+)
+
+CHUNK_SIZE = 5000
+
+VOUCHER_TYPE_CHOICES = [
+    (1, 'Opening'), (2, 'Receipt'), (3, 'Issue'), (4, 'Transfer In'),
+    (5, 'Transfer Out'), (6, 'Adjustment'), (9, 'Sale'),
+]
+
+
+def drop_bcn_view(apps, schema_editor):
+    # SQLite rebuilds core_itemparamdet below, which fails while a view reads it
+    schema_editor.execute("DROP VIEW IF EXISTS parameter_bcnstocksummary")
+
+
+def create_bcn_view(apps, schema_editor):
+    view = import_module('parameter.migrations.0006_bcnstocksummary_parameterset')
+    schema_editor.execute(view.view_sql(schema_editor.connection.vendor))
+
+
+def parse_required_date(value):
+    date = parse_date(value)
+    if date is None:
+        raise ValueError("Missing date")
+    return date
+
+
+def to_typed_columns(apps, schema_editor):
+    ItemParamDet = apps.get_model('core', 'ItemParamDet')
+    report = convert_in_chunks(ItemParamDet.objects.using(schema_editor.connection.alias), {
+        'Date': ('typed_date', parse_required_date),
+        'D3': ('typed_mrp', parse_decimal),
+        'D4': ('typed_sale_price', parse_decimal),
+    }, chunk_size=CHUNK_SIZE)
+    if not report.ok:
+        raise ValueError(
+            "ItemParamDet has values that are not dates or numbers; fix them and "
+            f"migrate again (nothing was changed).\n{report}"
+        )
+
+
+def to_text_columns(apps, schema_editor):
+    ItemParamDet = apps.get_model('core', 'ItemParamDet')
+    convert_in_chunks(ItemParamDet.objects.using(schema_editor.connection.alias), {
+        'typed_date': ('Date', format_date),
+        'typed_mrp': ('D3', format_decimal),
+        'typed_sale_price': ('D4', format_decimal),
+    }, chunk_size=CHUNK_SIZE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_parameterset'),
+        ('parameter', '0006_bcnstocksummary_parameterset'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_bcn_view, create_bcn_view),
+        migrations.RemoveIndex(
+            model_name='itemparamdet',
+            name='itemparamdet_item_date_value',
+        ),
+        migrations.RemoveIndex(
+            model_name='itemparamdet',
+            name='itemparamdet_bcn_date',
+        ),
+        migrations.AlterField(
+            model_name='itemparamdet',
+            name='VchType',
+            field=models.SmallIntegerField(choices=VOUCHER_TYPE_CHOICES, default=0),
+        ),
+        migrations.AddField(
+            model_name='itemparamdet',
+            name='typed_date',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='itemparamdet',
+            name='typed_mrp',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=12, null=True, verbose_name='mrp'),
+        ),
+        migrations.AddField(
+            model_name='itemparamdet',
+            name='typed_sale_price',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=12, null=True, verbose_name='sale price'),
+        ),
+        migrations.RunPython(to_typed_columns, to_text_columns),
+        # blank=True only gives the text column a '' default when this is reversed
+        migrations.AlterField(
+            model_name='itemparamdet',
+            name='Date',
+            field=models.CharField(blank=True, max_length=20),
+        ),
+        migrations.RemoveField(
+            model_name='itemparamdet',
+            name='Date',
+        ),
+        migrations.RemoveField(
+            model_name='itemparamdet',
+            name='D3',
+        ),
+        migrations.RemoveField(
+            model_name='itemparamdet',
+            name='D4',
+        ),
+        migrations.RenameField(
+            model_name='itemparamdet',
+            old_name='typed_date',
+            new_name='Date',
+        ),
+        migrations.RenameField(
+            model_name='itemparamdet',
+            old_name='typed_mrp',
+            new_name='D3',
+        ),
+        migrations.RenameField(
+            model_name='itemparamdet',
+            old_name='typed_sale_price',
+            new_name='D4',
+        ),
+        migrations.AlterField(
+            model_name='itemparamdet',
+            name='Date',
+            field=models.DateField(help_text='Format: YYYY-MM-DD'),
+        ),
+        migrations.AddIndex(
+            model_name='itemparamdet',
+            index=models.Index(fields=['ItemCode', 'Date', 'Value1'], name='itemparamdet_item_date_value'),
+        ),
+        migrations.AddIndex(
+            model_name='itemparamdet',
+            index=models.Index(fields=['BCN', 'Date'], name='itemparamdet_bcn_date'),
+        ),
+        migrations.AddIndex(
+            model_name='itemparamdet',
+            index=models.Index(fields=['VchType', 'Date'], name='itemparamdet_vchtype_date'),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.4 on 2026-10-17 11:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_itemparamdet_typed_columns'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LedgerChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('since', models.DateField(blank=True, null=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-17 15:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_ledgerchange'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='itemparamdet',
+            name='VchType',
+            field=models.SmallIntegerField(choices=[(0, 'Already signed'), (1, 'Opening'), (2, 'Receipt'), (3, 'Issue'), (4, 'Transfer In'), (5, 'Transfer Out'), (6, 'Adjustment'), (9, 'Sale')], default=0),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-17 15:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_itemparamdet_vchtype_already_signed'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='syncstate',
+            name='items_synced_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
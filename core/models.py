@@ -1,4 +1,17 @@
-from django.db import models
+import threading
+import uuid
+
+from django.core.cache import cache
+from django.db import models, transaction
+
+from .vouchers import DEFAULT_VOUCHER_TYPES
+
+# Shared cache key bumped whenever a profile changes
+ACTIVE_PROFILE_VERSION_KEY = 'core:userprofile:active:version'
+
+# LedgerChange rows kept for get_ledger_changes()
+LEDGER_CHANGES_KEPT = 500
+
 
 class UserProfile(models.Model):
     # SQL Server Info
@@ -14,20 +27,120 @@ class UserProfile(models.Model):
     company_name = models.CharField(max_length=255)
     company_address = models.TextField(blank=True)
 
+    # Process-local copy of the active profile and the version it was read at
+    _active_cache = {'version': None, 'profile': None}
+    # Process-local copies of profiles looked up by pk, at the same version
+    _profiles_cache = {'version': None, 'profiles': {}}
+    _active_lock = threading.Lock()
+
     def save(self, *args, **kwargs):
-        if self.is_active:
-            UserProfile.objects.exclude(pk=self.pk).update(is_active=False)
-        super().save(*args, **kwargs)
+        if not self.is_active:
+            return super().save(*args, **kwargs)
+        with transaction.atomic():
+            self._deactivate_others()
+            super().save(*args, **kwargs)
+
+    def activate(self):
+        """Make this the only active profile"""
+        self.is_active = True
+        self.save()
+
+    def _deactivate_others(self):
+        """Lock the currently active profiles and switch them off"""
+        others = UserProfile.objects.select_for_update().filter(is_active=True).exclude(pk=self.pk)
+        if list(others.values_list('pk', flat=True)):
+            others.update(is_active=False)
 
     @classmethod
     def get_active_config(cls):
-        """Return the active profile, or None if not set."""
-        return cls.objects.filter(is_active=True).first()
+        """Return the active profile, or None if not set.
+
+        The profile is cached in the process and re-read only when the
+        shared version key changes, so most calls run no query. Treat the
+        returned instance as read-only.
+        """
+        version = cache.get(ACTIVE_PROFILE_VERSION_KEY)
+        if version is None:
+            version = cls.bump_active_version()
+        with cls._active_lock:
+            if cls._active_cache['version'] == version:
+                return cls._active_cache['profile']
+
+        profile = cls.objects.filter(is_active=True).first()
+        with cls._active_lock:
+            cls._active_cache.update(version=version, profile=profile)
+        return profile
+
+    @classmethod
+    def get_config(cls, pk):
+        """Return the profile with pk, or None if there is none
+
+        Cached in the process like get_active_config(); treat the returned
+        instance as read-only.
+        """
+        version = cache.get(ACTIVE_PROFILE_VERSION_KEY)
+        if version is None:
+            version = cls.bump_active_version()
+        with cls._active_lock:
+            if cls._profiles_cache['version'] != version:
+                cls._profiles_cache.update(version=version, profiles={})
+            elif pk in cls._profiles_cache['profiles']:
+                return cls._profiles_cache['profiles'][pk]
+
+        profile = cls.objects.filter(pk=pk).first()
+        with cls._active_lock:
+            if cls._profiles_cache['version'] == version:
+                cls._profiles_cache['profiles'][pk] = profile
+        return profile
+
+    @classmethod
+    def clear_active_cache(cls):
+        """Forget this process's cached profiles"""
+        with cls._active_lock:
+            cls._active_cache.update(version=None, profile=None)
+            cls._profiles_cache.update(version=None, profiles={})
+
+    @classmethod
+    def bump_active_version(cls):
+        """Invalidate the cached active profile in every process
+
+        The version is a fresh random token rather than a counter, so a key
+        lost to eviction can never bring back a version a process still holds.
+        """
+        version = uuid.uuid4().hex
+        cache.set(ACTIVE_PROFILE_VERSION_KEY, version, timeout=None)
+        return version
 
     def __str__(self):
         return f"{self.company_name}"
 
 
+class SyncState(models.Model):
+    """High-water mark of the incremental Busy sync for one profile"""
+    profile = models.OneToOneField(UserProfile, on_delete=models.CASCADE, related_name='sync_state')
+    last_vch_code = models.BigIntegerField(default=0)
+    last_synced_at = models.DateTimeField(null=True, blank=True)
+    last_reconciled_at = models.DateTimeField(null=True, blank=True)
+    # Item masters are upserted without signals; readers compare this instead
+    items_synced_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.profile} - VchCode {self.last_vch_code}"
+
+
+class LedgerChange(models.Model):
+    """A change to ItemParamDet rows; its id is the ledger version it made
+
+    since is the earliest date whose rows changed, or null when any date
+    may have. The database hands out the ids, so concurrent writers never
+    share a version or lose each other's entries.
+    """
+    since = models.DateField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.pk} - {self.since or 'any date'}"
+
+
 
 
 
@@ -43,12 +156,65 @@ class Master1(models.Model):
 
 
 
+PARAMETER_FIELDS = ('C1', 'C2', 'C3', 'C4', 'C5')
+
+
+class ParameterSet(models.Model):
+    """One distinct C1-C5 combination, shared by every ItemParamDet row holding it
+
+    Lets reports group, filter and display by parameters on an integer
+    key instead of five free-text columns.
+    """
+    C1 = models.CharField(max_length=50, blank=True)
+    C2 = models.CharField(max_length=50, blank=True)
+    C3 = models.CharField(max_length=50, blank=True)
+    C4 = models.CharField(max_length=50, blank=True)
+    C5 = models.CharField(max_length=50, blank=True)
+    label = models.CharField(max_length=255, help_text="Non-blank parameters joined with ' | '")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=list(PARAMETER_FIELDS), name='parameterset_values'),
+        ]
+
+    @staticmethod
+    def make_label(values):
+        params = [str(value).strip() for value in values if value and str(value).strip()]
+        return ' | '.join(params) if params else "No Parameters"
+
+    @classmethod
+    def resolve(cls, combinations):
+        """Return {(C1, ..., C5): id} for combinations, creating missing sets"""
+        combinations = {tuple(values) for values in combinations}
+        ids = cls._lookup(combinations)
+        missing = combinations - ids.keys()
+        if missing:
+            cls.objects.bulk_create([
+                cls(**dict(zip(PARAMETER_FIELDS, values)), label=cls.make_label(values))
+                for values in missing
+            ], ignore_conflicts=True)
+            ids.update(cls._lookup(missing))
+        return ids
+
+    @classmethod
+    def _lookup(cls, combinations):
+        # Narrow on C1, then match whole combinations in Python
+        sets = cls.objects.filter(C1__in={values[0] for values in combinations})
+        found = {}
+        for pk, *values in sets.values_list('pk', *PARAMETER_FIELDS):
+            if tuple(values) in combinations:
+                found[tuple(values)] = pk
+        return found
+
+    def __str__(self):
+        return self.label
+
+
 class ItemParamDet(models.Model):
-     VOUCHER_TYPES = [
-        ('1', 'Opening Balance'),
-        ('2', 'Purchase'),
-        ('9', 'Sale'),
-    ]
+     # 0 marks rows whose Value1 is already signed, e.g. loaded before VchType existed
+     VOUCHER_TYPES = [(0, 'Already signed')] + [
+         (vch_type.code, vch_type.label) for vch_type in DEFAULT_VOUCHER_TYPES
+     ]
      Date = models.DateField(help_text="Format: YYYY-MM-DD")  
      VchNo = models.CharField(max_length=10)
      ItemCode = models.ForeignKey(Master1, on_delete=models.CASCADE)
@@ -57,10 +223,91 @@ class ItemParamDet(models.Model):
      C3 = models.CharField(max_length=50, blank=True)
      C4 = models.CharField(max_length=50, blank=True)
      C5 = models.CharField(max_length=50, blank=True)
-     D3 = models.CharField(max_length=50, blank=True,verbose_name='mrp') 
-     D4 = models.CharField(max_length=50, blank=True,verbose_name='sale price') 
+     D3 = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True, verbose_name='mrp')
+     D4 = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True, verbose_name='sale price')
      BCN = models.CharField(max_length=50, blank=True) 
      Value1 = models.FloatField(default=0)
+     # Busy voucher type; its stock sign comes from core.vouchers (0 keeps Value1 as stored)
+     VchType = models.SmallIntegerField(choices=VOUCHER_TYPES, default=0)
+     SourceKey = models.CharField(max_length=50, unique=True, null=True, blank=True,
+                                  help_text="VchCode-SrNo of the row in the Busy database")
+     # Kept in step with C1-C5 by save() and assign_parameter_sets()
+     ParamSet = models.ForeignKey(ParameterSet, on_delete=models.PROTECT, null=True, blank=True,
+                                  related_name='rows')
+
+     class Meta:
+         indexes = [
+             # Item stock aggregates: filter on item and date, sum Value1
+             models.Index(fields=['ItemCode', 'Date', 'Value1'], name='itemparamdet_item_date_value'),
+             # BCN stock aggregates and the BCN list filter
+             models.Index(fields=['BCN', 'Date'], name='itemparamdet_bcn_date'),
+             # Voucher type and date range filters
+             models.Index(fields=['VchType', 'Date'], name='itemparamdet_vchtype_date'),
+             # Parameter list filters
+             models.Index(fields=['C1'], name='itemparamdet_c1'),
+             models.Index(fields=['C2'], name='itemparamdet_c2'),
+         ]
      
+     @classmethod
+     def from_db(cls, db, field_names, values):
+         instance = super().from_db(db, field_names, values)
+         # Remember the stored date so a later write knows which periods it touched
+         instance._loaded_date = instance.__dict__.get('Date')
+         return instance
+
+     def save(self, *args, **kwargs):
+         update_fields = kwargs.get('update_fields')
+         if update_fields is None or set(update_fields) & set(PARAMETER_FIELDS):
+             self.assign_parameter_sets([self])
+             if update_fields is not None:
+                 kwargs['update_fields'] = set(update_fields) | {'ParamSet'}
+         super().save(*args, **kwargs)
+
+     def parameter_values(self):
+         return tuple(getattr(self, field) or '' for field in PARAMETER_FIELDS)
+
+     @classmethod
+     def assign_parameter_sets(cls, rows):
+         """Point unsaved or changed rows at the ParameterSet of their C1-C5
+
+         bulk_create() and QuerySet.update() bypass save(); call this on the
+         instances first.
+         """
+         ids = ParameterSet.resolve(row.parameter_values() for row in rows)
+         for row in rows:
+             row.ParamSet_id = ids[row.parameter_values()]
+
+     @classmethod
+     def get_ledger_version(cls):
+         """Return the version of the stock data: the id of the latest LedgerChange"""
+         return LedgerChange.objects.aggregate(version=models.Max('pk'))['version'] or 0
+
+     @classmethod
+     def bump_ledger_version(cls, since=None):
+         """Record a change to rows dated on or after since (None: any date)
+
+         Returns:
+             The new version
+         """
+         since = cls._meta.get_field('Date').to_python(since) if since else None
+         version = LedgerChange.objects.create(since=since).pk
+         LedgerChange.objects.filter(pk__lte=version - LEDGER_CHANGES_KEPT).delete()
+         return version
+
+     @classmethod
+     def get_ledger_changes(cls, after):
+         """Return the earliest changed date of every version after a given one
+
+         Dates are ISO strings, or None where any date may have changed.
+         Returns None when the kept history no longer covers every version
+         since after.
+         """
+         # Pruning removes the oldest rows, so history is complete above the oldest kept one
+         oldest = LedgerChange.objects.aggregate(oldest=models.Min('pk'))['oldest']
+         if oldest is not None and oldest > after + 1:
+             return None
+         changes = LedgerChange.objects.filter(pk__gt=after).order_by('pk').values_list('since', flat=True)
+         return [since.isoformat() if since else None for since in changes]
+
      def __str__(self):
          return f"{self.ItemCode.Code if self.ItemCode else 'N/A'} - {self.Date} - {self.VchNo}"
\ No newline at end of file
@@ -0,0 +1,43 @@
+"""Signal handlers invalidating the cached active UserProfile and stock results"""
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import Signal, receiver
+
+from reports.utils import connection_manager
+
+from .models import UserProfile, ItemParamDet
+
+# Sent by core.sync after ItemParamDet rows changed without per-row signals,
+# with since the earliest date affected (None: any date)
+param_details_bulk_changed = Signal()
+
+
+@receiver(post_save, sender=UserProfile)
+@receiver(post_delete, sender=UserProfile)
+def bust_active_profile_cache(sender, **kwargs):
+    UserProfile.bump_active_version()
+    # Bump again once committed, in case another process re-read the old row meanwhile
+    transaction.on_commit(UserProfile.bump_active_version)
+
+
+@receiver(post_save, sender=UserProfile)
+def close_inactive_pools(sender, instance, **kwargs):
+    """Close the SQL Server connections of the profiles switched off by activating instance"""
+    if instance.is_active:
+        transaction.on_commit(lambda: connection_manager.flush(keep=instance.pk))
+
+
+@receiver(post_save, sender=ItemParamDet)
+@receiver(post_delete, sender=ItemParamDet)
+def bump_ledger_version(sender, instance, created=False, **kwargs):
+    """Invalidate cached stock results covering the dates this row touched"""
+    dates = [instance.Date]
+    if not created:
+        # An update also changes the figures from the row's old date
+        dates.append(getattr(instance, '_loaded_date', None))
+    dates = [ItemParamDet._meta.get_field('Date').to_python(date) if date else None for date in dates]
+    since = None if None in dates else min(dates)
+
+    ItemParamDet.bump_ledger_version(since)
+    transaction.on_commit(lambda: ItemParamDet.bump_ledger_version(since))
+    instance._loaded_date = instance.Date
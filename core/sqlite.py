@@ -0,0 +1,90 @@
+"""Connection settings for sites running on the bundled SQLite files
+
+Every new SQLite connection (default, the reporting copy and company
+databases alike) gets the pragmas of settings.SQLITE_TUNING: WAL
+journaling so report reads no longer wait for sync writes, NORMAL
+synchronous commits, memory-mapped I/O, a larger page cache and in-memory
+temporary tables. Together with 'transaction_mode': 'IMMEDIATE' in the
+database OPTIONS, writers queue on BUSY_TIMEOUT instead of failing midway
+through a transaction.
+
+Statements that still find the database locked are retried by
+retry_when_locked() when that is safe: outside transactions, including
+the BEGIN that starts one. The optimize_sqlite command refreshes the
+planner statistics and checkpoints the WAL; schedule it like sync_busy.
+"""
+import logging
+import time
+
+from django.conf import settings
+from django.db.utils import OperationalError
+
+logger = logging.getLogger('core.sqlite')
+
+# Defaults for settings.SQLITE_TUNING
+SQLITE_DEFAULTS = {
+    'JOURNAL_MODE': 'WAL',
+    'SYNCHRONOUS': 'NORMAL',        # durable at checkpoints; safe from corruption in WAL mode
+    'MMAP_SIZE': 256 * 1024 ** 2,   # bytes of the file read through memory mapping
+    'CACHE_SIZE': -64 * 1024,       # page cache per connection; negative values are KiB
+    'TEMP_STORE': 'MEMORY',         # temporary tables and sort files
+    'BUSY_TIMEOUT': 5000,           # milliseconds a connection waits for a lock
+    'RETRIES': 3,                   # further attempts of a statement that found the database locked
+    'RETRY_DELAY': 0.2,             # seconds before the first retry, doubled on each one after
+}
+
+
+def get_sqlite_settings():
+    """Return the SQLite settings merged over the defaults"""
+    options = dict(SQLITE_DEFAULTS)
+    options.update(getattr(settings, 'SQLITE_TUNING', {}))
+    return options
+
+
+def pragma_statements(options, in_memory=False):
+    """Return the PRAGMA statements applied to a new connection"""
+    statements = [
+        f"PRAGMA busy_timeout = {int(options['BUSY_TIMEOUT'])}",
+        f"PRAGMA synchronous = {options['SYNCHRONOUS']}",
+        f"PRAGMA cache_size = {int(options['CACHE_SIZE'])}",
+        f"PRAGMA temp_store = {options['TEMP_STORE']}",
+    ]
+    # In-memory databases have no file to journal or map
+    if not in_memory:
+        statements.insert(0, f"PRAGMA journal_mode = {options['JOURNAL_MODE']}")
+        statements.append(f"PRAGMA mmap_size = {int(options['MMAP_SIZE'])}")
+    return statements
+
+
+def is_locked_error(exc):
+    return isinstance(exc, OperationalError) and 'locked' in str(exc)
+
+
+def retry_when_locked(execute, sql, params, many, context):
+    """Execute wrapper retrying statements that found the database locked
+
+    Inside a transaction the error is raised instead: the statements before
+    it would not be retried with it, so the atomic block has to roll back.
+    """
+    connection = context['connection']
+    options = get_sqlite_settings()
+    for attempt in range(options['RETRIES'] + 1):
+        try:
+            return execute(sql, params, many, context)
+        except OperationalError as exc:
+            if not is_locked_error(exc) or connection.in_atomic_block or attempt == options['RETRIES']:
+                raise
+            logger.warning("Database %s is locked, retrying (%s)", connection.alias, attempt + 1)
+            time.sleep(options['RETRY_DELAY'] * 2 ** attempt)
+
+
+def configure_connection(sender, connection, **kwargs):
+    """connection_created receiver applying SQLITE_TUNING to SQLite connections"""
+    if connection.vendor != 'sqlite':
+        return
+    options = get_sqlite_settings()
+    # On the raw connection, so the pragmas are not logged or counted as queries
+    for statement in pragma_statements(options, connection.is_in_memory_db()):
+        connection.connection.execute(statement)
+    if retry_when_locked not in connection.execute_wrappers:
+        connection.execute_wrappers.append(retry_when_locked)
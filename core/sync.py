@@ -0,0 +1,354 @@
+"""Bulk loading of items and parameter details from the Busy SQL Server database"""
+import datetime
+import hashlib
+import time
+
+from django.conf import settings
+from django.db import models, router, transaction
+from django.db.models import Min
+from django.utils import timezone
+
+from .conversion import parse_decimal
+from .models import Master1, ItemParamDet, SyncState
+from .signals import param_details_bulk_changed
+
+
+PARAM_DETAIL_SELECT = (
+    "SELECT p.VchCode, p.SrNo, p.Date, t.VchNo, p.ItemCode, "
+    "p.C1, p.C2, p.C3, p.C4, p.C5, p.D3, p.D4, p.BCN, p.Value1, p.VchType "
+    "FROM ItemParamDet p LEFT JOIN Tran1 t ON t.VchCode = p.VchCode "
+)
+
+# Source queries; override with settings.BUSY_SYNC_QUERIES
+SOURCE_QUERIES = {
+    'items': (
+        "SELECT Code, MasterType, Name FROM Master1 "
+        "WHERE MasterType = 6 ORDER BY Code"
+    ),
+    'param_details': PARAM_DETAIL_SELECT + "ORDER BY p.VchCode, p.SrNo",
+    # Vouchers past the watermark, plus recent ones that may have been edited
+    'param_details_since': (
+        PARAM_DETAIL_SELECT + "WHERE p.VchCode > ? OR p.Date >= ? "
+        "ORDER BY p.VchCode, p.SrNo"
+    ),
+    'param_details_between': (
+        PARAM_DETAIL_SELECT + "WHERE p.Date >= ? AND p.Date < ? "
+        "ORDER BY p.VchCode, p.SrNo"
+    ),
+    # The columns hashed into per-date fingerprints to detect deleted and edited rows
+    'partition_rows': (
+        "SELECT VchCode, SrNo, Date, ItemCode, VchType, Value1, BCN, C1, C2, C3, C4, C5 "
+        "FROM ItemParamDet WHERE Date >= ?"
+    ),
+    'partition_keys': "SELECT VchCode, SrNo FROM ItemParamDet WHERE Date >= ? AND Date < ?",
+}
+
+PARAM_UPDATE_FIELDS = [
+    'Date', 'VchNo', 'ItemCode', 'C1', 'C2', 'C3', 'C4', 'C5',
+    'D3', 'D4', 'BCN', 'Value1', 'VchType', 'ParamSet',
+]
+
+
+def get_source_query(name):
+    return getattr(settings, 'BUSY_SYNC_QUERIES', {}).get(name, SOURCE_QUERIES[name])
+
+
+class SyncResult:
+    """Row count and timing of one sync step"""
+    def __init__(self, name):
+        self.name = name
+        self.rows = 0
+        self.skipped = 0
+        self.first_date = None    # earliest date whose rows changed
+        self.max_vch_code = 0
+        self.started = time.monotonic()
+        self.elapsed = 0.0
+
+    def touch(self, date):
+        if date and (self.first_date is None or date < self.first_date):
+            self.first_date = date
+
+    def finish(self):
+        self.elapsed = time.monotonic() - self.started
+        return self
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.elapsed if self.elapsed else float(self.rows)
+
+    def __str__(self):
+        return (f"{self.name}: {self.rows} rows in {self.elapsed:.2f}s "
+                f"({self.rows_per_second:.0f} rows/s, {self.skipped} skipped)")
+
+
+def bulk_changed(since):
+    """Invalidate what per-row signals would have after rows dated since onwards changed"""
+    ItemParamDet.bump_ledger_version(since)
+    param_details_bulk_changed.send(sender=ItemParamDet, since=since)
+
+
+def fetch_batches(connection, query, batch_size, params=()):
+    """Yield lists of row dicts, fetching batch_size rows per round trip"""
+    cursor = connection.cursor()
+    try:
+        if params:
+            cursor.execute(query, params)
+        else:
+            cursor.execute(query)
+        columns = [column[0] for column in cursor.description]
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield [dict(zip(columns, row)) for row in rows]
+    finally:
+        cursor.close()
+
+
+def clean_text(value):
+    return '' if value is None else str(value).strip()
+
+
+def clean_date(value):
+    if value is None or value == '':
+        return None
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    if isinstance(value, datetime.date):
+        return value
+    return datetime.date.fromisoformat(str(value)[:10])
+
+
+def clean_decimal(value):
+    """Busy price text as a Decimal; prices that are not numbers are left empty"""
+    try:
+        return parse_decimal(value)
+    except ValueError:
+        return None
+
+
+def sync_items(connection, batch_size=5000, query=None):
+    """Upsert item masters keyed on Code"""
+    result = SyncResult('Master1')
+    for rows in fetch_batches(connection, query or get_source_query('items'), batch_size):
+        items = [
+            Master1(Code=clean_text(row['Code']), MasterType=clean_text(row['MasterType']),
+                    Name=clean_text(row['Name']))
+            for row in rows
+        ]
+        with transaction.atomic(using=router.db_for_write(Master1)):
+            Master1.objects.bulk_create(
+                items, batch_size=batch_size, update_conflicts=True,
+                unique_fields=['Code'], update_fields=['MasterType', 'Name'],
+            )
+        result.rows += len(items)
+    return result.finish()
+
+
+def sync_param_details(connection, batch_size=5000, query=None, params=(),
+                       item_ids=None, dates=None, bump_version=True):
+    """Upsert parameter detail rows keyed on SourceKey (VchCode-SrNo)
+
+    Rows whose item is not present locally are skipped and counted.
+    item_ids maps item codes to Master1 ids (read here when not given);
+    with dates, rows dated on other days are passed over. bump_version
+    False leaves calling bulk_changed() to the caller.
+    """
+    result = SyncResult('ItemParamDet')
+    if item_ids is None:
+        item_ids = dict(Master1.objects.values_list('Code', 'id'))
+    for rows in fetch_batches(connection, query or get_source_query('param_details'), batch_size, params):
+        details = []
+        for row in rows:
+            if dates is not None and clean_date(row['Date']) not in dates:
+                continue
+            item_id = item_ids.get(clean_text(row['ItemCode']))
+            if item_id is None:
+                result.skipped += 1
+                continue
+            result.max_vch_code = max(result.max_vch_code, int(row['VchCode'] or 0))
+            details.append(ItemParamDet(
+                SourceKey=f"{row['VchCode']}-{row['SrNo']}",
+                Date=clean_date(row['Date']),
+                VchNo=clean_text(row['VchNo']),
+                ItemCode_id=item_id,
+                C1=clean_text(row['C1']),
+                C2=clean_text(row['C2']),
+                C3=clean_text(row['C3']),
+                C4=clean_text(row['C4']),
+                C5=clean_text(row['C5']),
+                D3=clean_decimal(row['D3']),
+                D4=clean_decimal(row['D4']),
+                BCN=clean_text(row['BCN']),
+                Value1=float(row['Value1'] or 0),
+                VchType=int(row['VchType'] or 0),
+            ))
+        if not details:
+            continue
+        ItemParamDet.assign_parameter_sets(details)
+        # Rows moved to another date change the ledger from the old date too
+        result.touch(ItemParamDet.objects.filter(
+            SourceKey__in=[detail.SourceKey for detail in details]
+        ).aggregate(first=Min('Date'))['first'])
+        result.touch(min(detail.Date for detail in details))
+        with transaction.atomic(using=router.db_for_write(ItemParamDet)):
+            ItemParamDet.objects.bulk_create(
+                details, batch_size=batch_size, update_conflicts=True,
+                unique_fields=['SourceKey'], update_fields=PARAM_UPDATE_FIELDS,
+            )
+        result.rows += len(details)
+    # bulk_create sends no signals; invalidate cached stock results here
+    if result.rows and bump_version:
+        bulk_changed(result.first_date)
+    return result.finish()
+
+
+def delete_param_details(pks, batch_size=5000):
+    """Delete ItemParamDet rows by pk without sending per-row signals
+
+    Like bulk_create(), this leaves the ledger, search index and facets to
+    the rebuild commands run after a sync. Rows referencing the deleted
+    ones through a cascading foreign key are deleted first.
+    """
+    using = router.db_for_write(ItemParamDet)
+    cascades = [rel for rel in ItemParamDet._meta.related_objects if rel.on_delete is models.CASCADE]
+    with transaction.atomic(using=using):
+        for start in range(0, len(pks), batch_size):
+            batch = pks[start:start + batch_size]
+            for rel in cascades:
+                rel.related_model._base_manager.using(using).filter(
+                    **{f'{rel.field.name}__in': batch}
+                )._raw_delete(using)
+            ItemParamDet._base_manager.using(using).filter(pk__in=batch)._raw_delete(using)
+
+
+def record_item_sync(profile):
+    """Note that the item masters of profile were just loaded"""
+    state, _ = SyncState.objects.get_or_create(profile=profile)
+    state.items_synced_at = timezone.now()
+    state.save(update_fields=['items_synced_at'])
+
+
+def record_watermark(profile, result):
+    """Store the highest VchCode loaded by a full sync as the watermark"""
+    state, _ = SyncState.objects.get_or_create(profile=profile)
+    state.last_vch_code = max(state.last_vch_code, result.max_vch_code)
+    state.last_synced_at = timezone.now()
+    state.save()
+
+
+def row_digest(key, item_code, vch_type, value, bcn, *params):
+    """Hash of the synced columns of one parameter detail row, as an int
+
+    Busy and local rows go through the same cleaning first, so a row that
+    was loaded unchanged hashes the same on both sides.
+    """
+    canonical = '|'.join([
+        key, clean_text(item_code), str(int(vch_type or 0)), f"{float(value or 0):.6f}",
+        clean_text(bcn), *(clean_text(param) for param in params),
+    ])
+    return int.from_bytes(hashlib.sha1(canonical.encode()).digest()[:8], 'big')
+
+
+def add_digest(fingerprints, date, digest):
+    # A sum rather than a hash of the sorted rows, so rows can come in any order
+    fingerprints[date] = (fingerprints.get(date, 0) + digest) % 2 ** 64
+
+
+def reconcile_partitions(connection, since, batch_size=5000):
+    """Remove rows deleted in Busy and refresh dates that no longer match
+
+    Every date from since onwards gets a fingerprint on each side: the sum
+    of row_digest() over its rows, covering the key, item, voucher type,
+    Value1, BCN and C1-C5. Busy rows are hashed as they are fetched;
+    rows of items that are not synced are left out, as the sync skips
+    them. For each date whose fingerprints differ, local rows missing
+    from Busy are deleted and the date is reloaded, which also picks up
+    rows edited in place. All differing dates are handled in one pass over
+    the span they cover, and the ledger version is bumped once at the end.
+    """
+    result = SyncResult('Reconcile')
+    item_ids = dict(Master1.objects.values_list('Code', 'id'))
+    source = {}
+    for rows in fetch_batches(connection, get_source_query('partition_rows'),
+                              batch_size, (since.isoformat(),)):
+        for row in rows:
+            if clean_text(row['ItemCode']) not in item_ids:
+                continue
+            add_digest(source, clean_date(row['Date']), row_digest(
+                f"{row['VchCode']}-{row['SrNo']}", row['ItemCode'], row['VchType'], row['Value1'],
+                row['BCN'], row['C1'], row['C2'], row['C3'], row['C4'], row['C5'],
+            ))
+
+    local = {}
+    for row in (
+        ItemParamDet.objects.filter(SourceKey__isnull=False, Date__gte=since)
+        .values_list('Date', 'SourceKey', 'ItemCode__Code', 'VchType', 'Value1',
+                     'BCN', 'C1', 'C2', 'C3', 'C4', 'C5')
+        .iterator(chunk_size=batch_size)
+    ):
+        add_digest(local, clean_date(row[0]), row_digest(*row[1:]))
+
+    dates = {date for date in set(source) | set(local) if source.get(date) != local.get(date)}
+    if not dates:
+        return result.finish()
+    bounds = (min(dates).isoformat(), (max(dates) + datetime.timedelta(days=1)).isoformat())
+    source_keys = {
+        f"{row['VchCode']}-{row['SrNo']}"
+        for rows in fetch_batches(connection, get_source_query('partition_keys'), batch_size, bounds)
+        for row in rows
+    }
+    stale = [
+        pk for pk, key in ItemParamDet.objects.filter(
+            Date__in=dates, SourceKey__isnull=False
+        ).values_list('id', 'SourceKey').iterator(chunk_size=batch_size)
+        if key not in source_keys
+    ]
+    delete_param_details(stale, batch_size)
+    result.rows += len(stale)
+    result.touch(min(dates))
+
+    reloaded = sync_param_details(connection, batch_size, get_source_query('param_details_between'),
+                                  bounds, item_ids=item_ids, dates=dates, bump_version=False)
+    result.skipped += reloaded.skipped
+    bulk_changed(result.first_date)
+    return result.finish()
+
+
+def sync_incremental(connection, profile, batch_size=5000, lookback_days=3,
+                     reconcile_days=90, reconcile=None):
+    """Load vouchers newer than the profile's watermark
+
+    Vouchers past the stored VchCode watermark are loaded together with
+    every voucher dated within the last lookback_days, which picks up
+    recent edits. Deletions are found by reconcile_partitions over the
+    last reconcile_days. That step runs when reconcile is True, or when
+    reconcile is None and BUSY_SYNC_RECONCILE_INTERVAL seconds have passed
+    since the last run.
+
+    Returns:
+        List of SyncResult for the steps that ran
+    """
+    state, _ = SyncState.objects.get_or_create(profile=profile)
+    now = timezone.now()
+    today = timezone.localdate()
+
+    since = today - datetime.timedelta(days=lookback_days)
+    loaded = sync_param_details(connection, batch_size, get_source_query('param_details_since'),
+                                (state.last_vch_code, since.isoformat()))
+    state.last_vch_code = max(state.last_vch_code, loaded.max_vch_code)
+    results = [loaded]
+
+    if reconcile is None:
+        interval = getattr(settings, 'BUSY_SYNC_RECONCILE_INTERVAL', 3600)
+        reconcile = (state.last_reconciled_at is None
+                     or (now - state.last_reconciled_at).total_seconds() >= interval)
+    if reconcile:
+        results.append(reconcile_partitions(
+            connection, today - datetime.timedelta(days=reconcile_days), batch_size
+        ))
+        state.last_reconciled_at = now
+
+    state.last_synced_at = now
+    state.save()
+    return results
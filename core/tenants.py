@@ -0,0 +1,205 @@
+"""One database per company for the item and parameter detail tables
+
+With settings.REPORT_TENANTS['DATABASE'] set, every UserProfile keeps its
+Master1, ItemParamDet and ParameterSet rows, and the parameter tables
+derived from them, in a database of its own. The database is registered
+with Django under the alias 'company_<pk>' the first time it is needed and
+kept for the life of the process, so one process serves any number of
+companies at once.
+
+TenantRouter sends those models to the database of the current company:
+the one entered with using_company() (TenantMiddleware enters the company
+selected in the session), or else the active profile. Profiles, sync
+state, users, sessions and report jobs always stay on 'default'. With
+DATABASE left as None the router does nothing and every table lives in
+'default', as before.
+
+    REPORT_TENANTS = {
+        'DATABASE': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'companies' / 'company_{pk}.sqlite3',
+        },
+    }
+
+Run the migrate_companies command to create or update the databases.
+"""
+import contextlib
+import contextvars
+import copy
+import threading
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+# Defaults for settings.REPORT_TENANTS
+TENANT_DEFAULTS = {
+    'DATABASE': None,           # DATABASES entry for company databases; {pk} in NAME is the profile pk
+    'SESSION_KEY': 'company_id',    # session key holding the selected profile pk
+}
+
+ALIAS_PREFIX = 'company_'
+TENANT_APPS = frozenset({'core', 'parameter'})
+# Models of TENANT_APPS kept on 'default' for all companies
+SHARED_MODELS = frozenset({'core.userprofile', 'core.syncstate', 'parameter.reportjob'})
+
+# The UserProfile being worked on, when not the active one
+_company = contextvars.ContextVar('company', default=None)
+_register_lock = threading.Lock()
+
+
+def get_tenant_settings():
+    """Return the tenant settings merged over the defaults"""
+    options = dict(TENANT_DEFAULTS)
+    options.update(getattr(settings, 'REPORT_TENANTS', {}))
+    return options
+
+
+def enabled():
+    return getattr(settings, 'REPORT_TENANTS', {}).get('DATABASE') is not None
+
+
+def is_tenant_model(model):
+    opts = model._meta
+    return opts.app_label in TENANT_APPS and opts.label_lower not in SHARED_MODELS
+
+
+def database_alias(profile):
+    return f'{ALIAS_PREFIX}{profile.pk}'
+
+
+def database_settings(profile):
+    """Return the DATABASES entry of a profile's database"""
+    config = copy.deepcopy(get_tenant_settings()['DATABASE'])
+    config['NAME'] = str(config['NAME']).format(pk=profile.pk)
+    return config
+
+
+def add_database(alias, config):
+    """Make a database available as connections[alias], unless it already is
+
+    Django then keeps one connection per alias and thread, like for the
+    databases in settings.
+    """
+    if alias in connections.settings:
+        return
+    with _register_lock:
+        if alias not in connections.settings:
+            # configure_settings() fills in the defaults but insists on a 'default' entry
+            configured = connections.configure_settings({
+                DEFAULT_DB_ALIAS: connections.settings[DEFAULT_DB_ALIAS],
+                alias: config,
+            })
+            connections.settings[alias] = configured[alias]
+
+
+def register_database(profile):
+    """Make a profile's database available, once per process, and return its alias"""
+    alias = database_alias(profile)
+    if alias not in connections.settings:
+        add_database(alias, database_settings(profile))
+    return alias
+
+
+def unregister_database(alias):
+    """Forget a registered database, closing this thread's connection to it"""
+    with _register_lock:
+        if alias in connections.settings:
+            connections[alias].close()
+            del connections[alias]
+            del connections.settings[alias]
+
+
+def current_profile():
+    """Return the profile being worked on: the one entered with using_company(), or the active one"""
+    profile = _company.get()
+    if profile is None:
+        from .models import UserProfile
+        profile = UserProfile.get_active_config()
+    return profile
+
+
+def current_alias():
+    """Return the database alias of the current company, or None to use 'default'"""
+    if not enabled():
+        return None
+    profile = current_profile()
+    return register_database(profile) if profile is not None else None
+
+
+@contextlib.contextmanager
+def using_company(profile):
+    """Work on profile's data inside the block (None: the active profile)"""
+    token = _company.set(profile)
+    try:
+        yield profile
+    finally:
+        _company.reset(token)
+
+
+class TenantRouter:
+    """Route the company models to the current company's database"""
+
+    def db_for_read(self, model, **hints):
+        if not is_tenant_model(model):
+            return None
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db:
+            return instance._state.db
+        return current_alias()
+
+    db_for_write = db_for_read
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if not db.startswith(ALIAS_PREFIX):
+            return None
+        if app_label not in TENANT_APPS:
+            return False
+        return model_name is None or f'{app_label}.{model_name}' not in SHARED_MODELS
+
+
+def _stream_sync(content, profile):
+    iterator = iter(content)
+    while True:
+        with using_company(profile):
+            try:
+                chunk = next(iterator)
+            except StopIteration:
+                return
+        yield chunk
+
+
+async def _stream_async(content, profile):
+    iterator = aiter(content)
+    while True:
+        with using_company(profile):
+            try:
+                chunk = await anext(iterator)
+            except StopAsyncIteration:
+                return
+        yield chunk
+
+
+class TenantMiddleware:
+    """Work on the company selected in the session for the rest of the request
+
+    Streamed responses compute their rows after the view returns, so each
+    chunk is produced inside the company as well.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def selected_profile(self, request):
+        from .models import UserProfile
+        session = getattr(request, 'session', None)
+        company_id = session.get(get_tenant_settings()['SESSION_KEY']) if session is not None else None
+        return UserProfile.get_config(company_id) if company_id is not None else None
+
+    def __call__(self, request):
+        profile = self.selected_profile(request)
+        with using_company(profile):
+            response = self.get_response(request)
+        if profile is not None and response.streaming:
+            stream = _stream_async if response.is_async else _stream_sync
+            response.streaming_content = stream(response.streaming_content, profile)
+        return response
@@ -1,3 +1,617 @@
-from django.test import TestCase
+import datetime
+import io
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+from decimal import Decimal
+from types import SimpleNamespace
 
-# Create your tests here.
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection
+from django.db.utils import OperationalError
+from django.test import TestCase, override_settings
+
+from reports.utils import ConnectionManager, ConnectionPool, PoolExhausted, connection_manager
+from . import sqlite, tenants
+from .conversion import convert_in_chunks, parse_date, parse_decimal
+from .models import ACTIVE_PROFILE_VERSION_KEY, UserProfile, Master1, ItemParamDet, LedgerChange, ParameterSet, SyncState
+from .sync import reconcile_partitions
+from .vouchers import VoucherRegistry, get_voucher_registry
+
+
+class FakeCursor:
+    def __init__(self, connection):
+        self.connection = connection
+
+    def execute(self, sql, *params):
+        if self.connection.broken:
+            raise RuntimeError("connection lost")
+
+    def fetchall(self):
+        return [(1,)]
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    """Stand-in for a pyodbc connection"""
+    def __init__(self, connection_string):
+        self.connection_string = connection_string
+        self.closed = False
+        self.broken = False
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+def create_profile(**kwargs):
+    values = dict(sql_host='http://localhost', server='HOST\\SQLEXPRESS', sql_username='sa',
+                  sql_password='secret', sql_database='BusyComp0001_db12025',
+                  company_name='Demo', is_active=True)
+    values.update(kwargs)
+    return UserProfile.objects.create(**values)
+
+
+class ActiveProfileCacheTests(TestCase):
+    def setUp(self):
+        UserProfile.clear_active_cache()
+
+    def test_cached_lookup_runs_no_query(self):
+        profile = create_profile()
+        self.assertEqual(UserProfile.get_active_config(), profile)
+        with self.assertNumQueries(0):
+            self.assertEqual(UserProfile.get_active_config(), profile)
+
+    def test_save_and_delete_invalidate(self):
+        first = create_profile(company_name='First')
+        self.assertEqual(UserProfile.get_active_config(), first)
+        second = create_profile(company_name='Second')
+        self.assertEqual(UserProfile.get_active_config(), second)
+        second.delete()
+        self.assertIsNone(UserProfile.get_active_config())
+
+    def test_lost_version_key_does_not_repeat_a_version(self):
+        first = create_profile(company_name='First')
+        self.assertEqual(UserProfile.get_active_config(), first)
+        version = caches['default'].get(ACTIVE_PROFILE_VERSION_KEY)
+        # Another process switched profiles, then the version key expired
+        UserProfile.objects.filter(pk=first.pk).update(company_name='Renamed')
+        caches['default'].delete(ACTIVE_PROFILE_VERSION_KEY)
+        self.assertEqual(UserProfile.get_active_config().company_name, 'Renamed')
+        self.assertNotEqual(caches['default'].get(ACTIVE_PROFILE_VERSION_KEY), version)
+
+    def test_suite_keeps_off_the_project_cache(self):
+        self.assertEqual(caches['default'].__class__.__name__, 'LocMemCache')
+
+    def test_activate_switches_off_others(self):
+        first = create_profile(company_name='First')
+        second = create_profile(company_name='Second', is_active=False)
+        second.activate()
+        first.refresh_from_db()
+        self.assertFalse(first.is_active)
+        self.assertEqual(UserProfile.get_active_config(), second)
+
+
+class ConnectionPoolTests(TestCase):
+    def test_reuses_connections(self):
+        pool = ConnectionPool('DSN', connect=FakeConnection)
+        with pool.connection() as first:
+            pass
+        with pool.connection() as second:
+            pass
+        self.assertIs(first, second)
+        self.assertEqual(pool.size, 1)
+
+    def test_bounded(self):
+        pool = ConnectionPool('DSN', connect=FakeConnection, MAX_SIZE=1, ACQUIRE_TIMEOUT=0.01)
+        with pool.connection():
+            with self.assertRaises(PoolExhausted):
+                pool.acquire()
+
+    def test_recycles_and_health_checks(self):
+        pool = ConnectionPool('DSN', connect=FakeConnection, MAX_LIFETIME=0)
+        with pool.connection() as first:
+            pass
+        self.assertTrue(first.closed)
+        self.assertEqual(pool.size, 0)
+
+        pool = ConnectionPool('DSN', connect=FakeConnection, HEALTH_CHECK_AFTER=-1)
+        with pool.connection() as first:
+            first.broken = True
+        with pool.connection() as second:
+            pass
+        self.assertIsNot(first, second)
+        self.assertTrue(first.closed)
+
+    def test_health_check_runs_without_the_lock(self):
+        pool = ConnectionPool('DSN', connect=FakeConnection, HEALTH_CHECK_AFTER=-1)
+        with pool.connection() as conn:
+            pass
+        held = []
+        original = pool._is_healthy
+
+        def try_lock():
+            acquired = pool._condition.acquire(blocking=False)
+            held.append(acquired)
+            if acquired:
+                pool._condition.release()
+
+        def is_healthy(conn, now):
+            # Another borrower must be able to take the lock during the ping
+            borrower = threading.Thread(target=try_lock)
+            borrower.start()
+            borrower.join()
+            return original(conn, now)
+        pool._is_healthy = is_healthy
+        with pool.connection():
+            pass
+        self.assertEqual(held, [True])
+
+    def test_evicts_idle(self):
+        pool = ConnectionPool('DSN', connect=FakeConnection, IDLE_TIMEOUT=-1)
+        with pool.connection() as conn:
+            pass
+        self.assertTrue(conn.closed)
+        self.assertEqual(pool.idle_count, 0)
+
+
+class ConnectionManagerTests(TestCase):
+    def test_builds_dsn_from_active_profile(self):
+        create_profile(sql_port='1433')
+        manager = ConnectionManager(connect=FakeConnection)
+        with manager.connection() as conn:
+            self.assertIn('SERVER=HOST\\SQLEXPRESS,1433;', conn.connection_string)
+            self.assertIn('DATABASE=BusyComp0001_db12025;', conn.connection_string)
+
+    def test_keeps_a_pool_per_profile(self):
+        first_profile = create_profile()
+        manager = ConnectionManager(connect=FakeConnection)
+        with manager.connection() as first:
+            pass
+        second_profile = create_profile(sql_database='OtherCompany', is_active=False)
+        with manager.connection(second_profile) as second:
+            pass
+        self.assertIn('DATABASE=OtherCompany;', second.connection_string)
+        # Switching back reuses the first company's connection
+        with manager.connection(first_profile) as again:
+            pass
+        self.assertIs(again, first)
+        self.assertFalse(first.closed)
+
+        second_profile.sql_database = 'Renamed'
+        with manager.connection(second_profile) as renamed:
+            pass
+        self.assertTrue(second.closed)
+        self.assertIn('DATABASE=Renamed;', renamed.connection_string)
+
+    def test_activating_a_profile_closes_the_others(self):
+        first_profile = create_profile()
+        manager = ConnectionManager(connect=FakeConnection)
+        with manager.connection() as first:
+            pass
+        second_profile = create_profile(sql_database='OtherCompany', is_active=False)
+        with manager.connection(second_profile) as second:
+            pass
+
+        # Activated in another process: noticed on the next active lookup
+        UserProfile.objects.filter(pk=first_profile.pk).update(is_active=False)
+        UserProfile.objects.filter(pk=second_profile.pk).update(is_active=True)
+        UserProfile.bump_active_version()
+        with manager.connection() as again:
+            pass
+        self.assertIs(again, second)
+        self.assertTrue(first.closed)
+
+    def test_activation_flushes_the_shared_manager(self):
+        first_profile = create_profile()
+        second_profile = create_profile(sql_database='OtherCompany', is_active=False)
+        self.addCleanup(connection_manager.flush)
+        first_pool = connection_manager.get_pool(first_profile)
+        second_pool = connection_manager.get_pool(second_profile)
+        with self.captureOnCommitCallbacks(execute=True):
+            second_profile.activate()
+        with self.assertRaises(PoolExhausted):
+            first_pool.acquire()
+        self.assertIs(connection_manager.get_pool(second_profile), second_pool)
+
+
+def create_busy_source(path, details):
+    """Create a SQLite stand-in for the Busy tables read by the sync"""
+    source = sqlite3.connect(path)
+    source.executescript("""
+        CREATE TABLE Master1 (Code INTEGER, MasterType INTEGER, Name TEXT);
+        CREATE TABLE Tran1 (VchCode INTEGER, VchNo TEXT);
+        CREATE TABLE ItemParamDet (
+            VchCode INTEGER, SrNo INTEGER, Date TEXT, ItemCode INTEGER,
+            C1 TEXT, C2 TEXT, C3 TEXT, C4 TEXT, C5 TEXT, D3 TEXT, D4 TEXT,
+            BCN TEXT, Value1 REAL, VchType INTEGER
+        );
+        INSERT INTO Master1 VALUES (101, 6, 'Shirt'), (102, 6, 'Trouser'), (900, 2, 'Cash');
+        INSERT INTO Tran1 VALUES (1, 'OB-1'), (2, 'P-7');
+    """)
+    source.executemany(
+        "INSERT INTO ItemParamDet VALUES (?, ?, ?, ?, ?, NULL, NULL, NULL, NULL, '', '', ?, ?, ?)",
+        details,
+    )
+    source.commit()
+    source.close()
+
+
+class SyncBusyTests(TestCase):
+    def setUp(self):
+        # Profiles from earlier tests were rolled back without a signal
+        UserProfile.clear_active_cache()
+        handle, self.path = tempfile.mkstemp(suffix='.sqlite3')
+        os.close(handle)
+        self.addCleanup(os.remove, self.path)
+
+    def sync(self):
+        out = io.StringIO()
+        call_command('sync_busy', source_sqlite=self.path, batch_size=2, skip_ledger=True, stdout=out)
+        return out.getvalue()
+
+    def test_loads_and_upserts(self):
+        create_busy_source(self.path, [
+            (1, 1, '2024-04-01 00:00:00', 101, 'Red', 'B1', 10, 1),
+            (1, 2, '2024-04-01 00:00:00', 102, 'Blue', 'B2', 4, 1),
+            (2, 1, '2024-04-05 00:00:00', 101, 'Red', 'B1', 3, 2),
+            (2, 2, '2024-04-05 00:00:00', 999, 'Red', 'B9', 1, 2),
+        ])
+        output = self.sync()
+        self.assertIn('Master1: 2 rows', output)
+        self.assertIn('ItemParamDet: 3 rows', output)
+        self.assertIn('1 skipped', output)
+        row = ItemParamDet.objects.get(SourceKey='2-1')
+        self.assertEqual((row.ItemCode.Code, row.VchNo, row.Date, row.Value1, row.BCN),
+                         ('101', 'P-7', datetime.date(2024, 4, 5), 3, 'B1'))
+
+        source = sqlite3.connect(self.path)
+        source.execute("UPDATE ItemParamDet SET Value1 = 8 WHERE VchCode = 2 AND SrNo = 1")
+        source.execute("UPDATE Master1 SET Name = 'Formal Shirt' WHERE Code = 101")
+        source.commit()
+        source.close()
+
+        self.sync()
+        self.assertEqual(Master1.objects.count(), 2)
+        self.assertEqual(ItemParamDet.objects.count(), 3)
+        self.assertEqual(ItemParamDet.objects.get(SourceKey='2-1').Value1, 8)
+        # Both 'Red' rows share one parameter set
+        self.assertEqual(ParameterSet.objects.count(), 2)
+        self.assertEqual(ItemParamDet.objects.filter(ParamSet__label='Red').count(), 2)
+        self.assertEqual(Master1.objects.get(Code='101').Name, 'Formal Shirt')
+
+
+class IncrementalSyncTests(TestCase):
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix='.sqlite3')
+        os.close(handle)
+        self.addCleanup(os.remove, self.path)
+        self.profile = create_profile()
+        create_busy_source(self.path, [
+            (1, 1, '2020-01-01 00:00:00', 101, 'Red', 'B1', 10, 1),
+            (2, 1, '2020-02-01 00:00:00', 101, 'Red', 'B1', 3, 2),
+        ])
+        call_command('sync_busy', source_sqlite=self.path, skip_ledger=True, stdout=io.StringIO())
+
+    def source(self, *statements):
+        source = sqlite3.connect(self.path)
+        for statement in statements:
+            source.execute(statement)
+        source.commit()
+        source.close()
+
+    def sync(self, **options):
+        out = io.StringIO()
+        call_command('sync_busy', source_sqlite=self.path, incremental=True, skip_ledger=True,
+                     stdout=out, **options)
+        return out.getvalue()
+
+    def test_loads_only_vouchers_past_watermark(self):
+        self.assertEqual(SyncState.objects.get(profile=self.profile).last_vch_code, 2)
+        self.source(
+            "INSERT INTO ItemParamDet VALUES (3, 1, '2020-03-01', 101, 'Red', NULL, NULL, NULL, NULL, '', '', 'B1', 2, 9)",
+            # Old voucher edited in place: outside the lookback window, so not picked up
+            "UPDATE ItemParamDet SET Value1 = 99 WHERE VchCode = 1",
+        )
+        output = self.sync(reconcile=False)
+        self.assertIn('ItemParamDet: 1 rows', output)
+        self.assertEqual(SyncState.objects.get(profile=self.profile).last_vch_code, 3)
+        self.assertEqual(ItemParamDet.objects.get(SourceKey='1-1').Value1, 10)
+
+    def test_reconcile_detects_deletes(self):
+        self.source("DELETE FROM ItemParamDet WHERE VchCode = 2")
+        output = self.sync(reconcile=True, reconcile_days=100000)
+        self.assertIn('Reconcile: 1 rows', output)
+        self.assertEqual(list(ItemParamDet.objects.values_list('SourceKey', flat=True)), ['1-1'])
+        self.assertIsNotNone(SyncState.objects.get(profile=self.profile).last_reconciled_at)
+
+    def test_reconcile_detects_edits_keeping_count_and_total(self):
+        # Purchase turned into a sale and moved to another BCN: same rows, same Value1 sum
+        self.source("UPDATE ItemParamDet SET VchType = 9, BCN = 'B2', C1 = 'Blue' WHERE VchCode = 2")
+        self.sync(reconcile=True, reconcile_days=100000)
+        row = ItemParamDet.objects.get(SourceKey='2-1')
+        self.assertEqual((row.VchType, row.BCN, row.C1), (9, 'B2', 'Blue'))
+
+        # Both sides now hash alike, so no date is reloaded
+        source = sqlite3.connect(self.path)
+        self.addCleanup(source.close)
+        self.assertIsNone(reconcile_partitions(source, datetime.date(2000, 1, 1)).first_date)
+
+
+    def test_reconcile_reloads_all_dates_with_one_version_bump(self):
+        self.source("DELETE FROM ItemParamDet WHERE VchCode = 1",
+                    "UPDATE ItemParamDet SET Value1 = 4 WHERE VchCode = 2")
+        source = sqlite3.connect(self.path)
+        self.addCleanup(source.close)
+        version = ItemParamDet.get_ledger_version()
+        result = reconcile_partitions(source, datetime.date(2000, 1, 1))
+        self.assertEqual((result.rows, result.first_date), (1, datetime.date(2020, 1, 1)))
+        self.assertEqual(list(ItemParamDet.objects.values_list('SourceKey', 'Value1')), [('2-1', 4)])
+        # Deleted without per-row signals, each of which would bump the version
+        self.assertEqual(list(LedgerChange.objects.filter(pk__gt=version).values_list('since', flat=True)),
+                         [datetime.date(2020, 1, 1)])
+
+
+class LedgerVersionTests(TestCase):
+    def test_changes_are_recorded_per_version(self):
+        start = ItemParamDet.get_ledger_version()
+        first = ItemParamDet.bump_ledger_version(datetime.date(2024, 3, 1))
+        second = ItemParamDet.bump_ledger_version()
+        self.assertEqual((first, second), (start + 1, start + 2))
+        self.assertEqual(ItemParamDet.get_ledger_version(), second)
+        self.assertEqual(ItemParamDet.get_ledger_changes(start), ['2024-03-01', None])
+        self.assertEqual(ItemParamDet.get_ledger_changes(second), [])
+
+    def test_pruned_history_is_reported_missing(self):
+        start = ItemParamDet.get_ledger_version()
+        for _ in range(3):
+            ItemParamDet.bump_ledger_version(datetime.date(2024, 3, 1))
+        LedgerChange.objects.filter(pk__lte=start + 1).delete()
+        self.assertIsNone(ItemParamDet.get_ledger_changes(start))
+        self.assertEqual(ItemParamDet.get_ledger_changes(start + 1), ['2024-03-01', '2024-03-01'])
+
+
+class ParameterSetTests(TestCase):
+    def setUp(self):
+        self.item = Master1.objects.create(Code='101', MasterType='6', Name='Shirt')
+
+    def create_row(self, **kwargs):
+        return ItemParamDet.objects.create(ItemCode=self.item, Date=datetime.date(2024, 1, 1),
+                                           VchNo='1', VchType=2, **kwargs)
+
+    def test_rows_share_sets_and_follow_changes(self):
+        first = self.create_row(C1='Red', C2=' M ')
+        second = self.create_row(C1='Red', C2=' M ')
+        self.assertEqual(first.ParamSet_id, second.ParamSet_id)
+        self.assertEqual(first.ParamSet.label, 'Red | M')
+
+        second.C2 = 'L'
+        second.save(update_fields=['C2'])
+        second.refresh_from_db()
+        self.assertEqual(second.ParamSet.label, 'Red | L')
+        self.assertEqual(self.create_row().ParamSet.label, 'No Parameters')
+
+    def test_assign_for_bulk_create(self):
+        rows = [ItemParamDet(ItemCode=self.item, Date=datetime.date(2024, 1, 1), VchNo=str(n),
+                             VchType=2, C1=color) for n, color in enumerate(['Red', 'Blue', 'Red'])]
+        ItemParamDet.assign_parameter_sets(rows)
+        ItemParamDet.objects.bulk_create(rows)
+        self.assertEqual(dict(ParameterSet.objects.values_list('label', 'C1')), {'Red': 'Red', 'Blue': 'Blue'})
+        self.assertEqual(ItemParamDet.objects.filter(ParamSet__C1='Red').count(), 2)
+
+
+class ConversionTests(TestCase):
+    def test_parsers(self):
+        self.assertEqual(parse_date('2024-04-01 00:00:00'), datetime.date(2024, 4, 1))
+        self.assertEqual(parse_date('05/06/2024'), datetime.date(2024, 6, 5))
+        self.assertIsNone(parse_date(' '))
+        self.assertEqual(parse_decimal(' 1,299.5 '), Decimal('1299.50'))
+        self.assertIsNone(parse_decimal(''))
+        for bad in ('2024-13-01', 'tomorrow'):
+            with self.assertRaises(ValueError):
+                parse_date(bad)
+        for bad in ('abc', 'NaN'):
+            with self.assertRaises(ValueError):
+                parse_decimal(bad)
+
+    def test_converts_in_chunks_and_reports_bad_values(self):
+        item = Master1.objects.create(Code='101', MasterType='6', Name='Shirt')
+        for vch_no in ('10', 'x1', '12.5'):
+            ItemParamDet.objects.create(ItemCode=item, Date=datetime.date(2024, 1, 1), VchNo=vch_no)
+        report = convert_in_chunks(ItemParamDet.objects.all(), {'VchNo': ('D3', parse_decimal)}, chunk_size=2)
+        self.assertEqual((report.rows, report.bad_count, report.ok), (3, 1, False))
+        self.assertEqual(report.bad_values[0][1:], ('VchNo', 'x1'))
+        self.assertEqual(sorted(ItemParamDet.objects.values_list('D3', flat=True), key=str),
+                         [Decimal('10.00'), Decimal('12.50'), None])
+
+
+class VoucherRegistryTests(TestCase):
+    def setUp(self):
+        UserProfile.clear_active_cache()
+
+    def test_sign_vector_matches_signed_value(self):
+        vouchers = VoucherRegistry()
+        codes = [1, 2, 3, 4, 5, 6, 9, 7, -1, 250]
+        values = [10, 5, 3, 2, 1, 4, 6, 8, 9, 7]
+        self.assertEqual(list(vouchers.signed_values(codes, values)),
+                         [vouchers.signed_value(code, value) for code, value in zip(codes, values)])
+        # Unknown codes keep the stored value
+        self.assertEqual(list(vouchers.sign_vector(codes)), [1, 1, -1, 1, -1, 0, -1, 1, 1, 1])
+
+    def test_orm_expression_matches_signed_value(self):
+        item = Master1.objects.create(Code='I001', Name='Shirt', MasterType='6')
+        rows = [(1, 10), (2, 5), (3, 2), (6, 4), (9, 3)]
+        for vch_type, value in rows:
+            ItemParamDet.objects.create(ItemCode=item, VchType=vch_type, Value1=value, VchNo='1',
+                                        Date=datetime.date(2024, 1, 1))
+        vouchers = get_voucher_registry()
+        total = ItemParamDet.objects.aggregate(total=vouchers.signed_quantity())['total']
+        self.assertEqual(total, sum(vouchers.signed_value(code, value) for code, value in rows))
+        self.assertEqual(total, 10)
+
+    def test_rows_without_voucher_type_validate(self):
+        item = Master1.objects.create(Code='I001', Name='Shirt', MasterType='6')
+        row = ItemParamDet(ItemCode=item, Value1=-2, VchNo='1', Date=datetime.date(2024, 1, 1))
+        self.assertEqual(row.VchType, 0)
+        row.full_clean(exclude=['ParamSet'])
+        self.assertEqual(row.get_VchType_display(), 'Already signed')
+
+    @override_settings(BUSY_VOUCHER_TYPES={
+        'Acme': {6: {'sign': 1, 'label': 'Stock Found'}, 9: None, 12: {'label': 'Return', 'sign': 1}},
+    })
+    def test_company_overrides(self):
+        create_profile(company_name='Acme')
+        vouchers = get_voucher_registry()
+        self.assertEqual(vouchers.label(6), 'Stock Found')
+        self.assertEqual(vouchers.inward_codes, (1, 2, 4, 6, 12))
+        self.assertEqual(vouchers.outward_codes, (3, 5))
+        self.assertEqual(vouchers.label(9), 'Type 9')
+
+        other = create_profile(company_name='Other', is_active=False)
+        self.assertEqual(get_voucher_registry(other).outward_codes, (3, 5, 9))
+
+
+class TenantRoutingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        UserProfile.clear_active_cache()
+        directory = tempfile.mkdtemp()
+        cls.addClassCleanup(shutil.rmtree, directory)
+        settings_override = override_settings(REPORT_TENANTS={
+            'DATABASE': {'ENGINE': 'django.db.backends.sqlite3',
+                         'NAME': os.path.join(directory, 'company_{pk}.sqlite3')},
+        })
+        settings_override.enable()
+        cls.addClassCleanup(settings_override.disable)
+
+        cls.first = create_profile(company_name='First')
+        cls.second = create_profile(company_name='Second', is_active=False)
+        # Let the tests use the company databases; each test runs in a transaction on them too
+        cls.company_aliases = {tenants.database_alias(cls.first), tenants.database_alias(cls.second)}
+        cls.databases = cls.databases | cls.company_aliases
+        call_command('migrate_companies', verbosity=0, stdout=io.StringIO())
+
+    @classmethod
+    def tearDownClass(cls):
+        for alias in cls.company_aliases:
+            tenants.unregister_database(alias)
+        cls.databases = cls.databases - cls.company_aliases
+        super().tearDownClass()
+
+    def setUp(self):
+        UserProfile.clear_active_cache()
+
+    def create_item(self, profile, code):
+        with tenants.using_company(profile):
+            item = Master1.objects.create(Code=code, MasterType='6', Name='Shirt')
+            ItemParamDet.objects.create(ItemCode=item, Date=datetime.date(2024, 1, 1),
+                                        VchNo='1', VchType=2, Value1=5, C1='Red')
+
+    def test_company_rows_stay_in_their_database(self):
+        self.create_item(self.first, 'A1')
+        self.create_item(self.second, 'B1')
+        with tenants.using_company(self.second):
+            self.assertEqual(list(Master1.objects.values_list('Code', flat=True)), ['B1'])
+            self.assertEqual(ItemParamDet.objects.get().ParamSet.label, 'Red')
+            self.assertEqual(UserProfile.objects.db, 'default')
+            second_version = ItemParamDet.get_ledger_version()
+        # Without a selected company the active profile's database is used
+        self.assertEqual(list(Master1.objects.values_list('Code', flat=True)), ['A1'])
+        self.assertFalse(Master1.objects.using('default').exists())
+
+        ItemParamDet.bump_ledger_version()
+        with tenants.using_company(self.second):
+            self.assertEqual(ItemParamDet.get_ledger_version(), second_version)
+
+    def test_session_selects_company(self):
+        from django.contrib.auth.models import User
+        self.create_item(self.first, 'A1')
+        self.create_item(self.second, 'B1')
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+
+        response = self.client.post('/company/', {'company': self.second.pk})
+        self.assertEqual(response.status_code, 302)
+        response = self.client.get('/admin/parameter/stockreportview/')
+        self.assertContains(response, 'B1')
+        self.assertNotContains(response, 'A1')
+
+        self.client.post('/company/', {'company': ''})
+        self.assertContains(self.client.get('/admin/parameter/stockreportview/'), 'A1')
+        self.assertEqual(self.client.post('/company/', {'company': '999'}).status_code, 404)
+
+
+@override_settings(SQLITE_TUNING={'RETRIES': 2, 'RETRY_DELAY': 0})
+class SqliteTuningTests(TestCase):
+    def test_pragma_statements(self):
+        options = sqlite.get_sqlite_settings()
+        statements = sqlite.pragma_statements(options)
+        self.assertIn("PRAGMA journal_mode = WAL", statements)
+        self.assertIn("PRAGMA synchronous = NORMAL", statements)
+        self.assertIn(f"PRAGMA mmap_size = {256 * 1024 ** 2}", statements)
+        in_memory = sqlite.pragma_statements(options, in_memory=True)
+        self.assertFalse([s for s in in_memory if 'journal_mode' in s or 'mmap_size' in s])
+
+    def test_pragmas_applied_to_new_connections(self):
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA temp_store")
+            self.assertEqual(cursor.fetchone()[0], 2)
+            cursor.execute("PRAGMA busy_timeout")
+            self.assertEqual(cursor.fetchone()[0], 5000)
+        self.assertIn(sqlite.retry_when_locked, connection.execute_wrappers)
+
+    def locked_execute(self, failures):
+        calls = []
+
+        def execute(sql, params, many, context):
+            calls.append(sql)
+            if len(calls) <= failures:
+                raise OperationalError("database is locked")
+            return 'done'
+        return execute, calls
+
+    def test_retries_locked_statements_outside_transactions(self):
+        context = {'connection': SimpleNamespace(alias='default', in_atomic_block=False)}
+        execute, calls = self.locked_execute(failures=2)
+        with self.assertLogs('core.sqlite', 'WARNING'):
+            self.assertEqual(sqlite.retry_when_locked(execute, 'SELECT 1', None, False, context), 'done')
+        self.assertEqual(len(calls), 3)
+
+        execute, calls = self.locked_execute(failures=3)
+        with self.assertLogs('core.sqlite', 'WARNING'), self.assertRaises(OperationalError):
+            sqlite.retry_when_locked(execute, 'SELECT 1', None, False, context)
+
+    def test_locked_statements_inside_transactions_raise(self):
+        context = {'connection': SimpleNamespace(alias='default', in_atomic_block=True)}
+        execute, calls = self.locked_execute(failures=1)
+        with self.assertRaises(OperationalError):
+            sqlite.retry_when_locked(execute, 'SELECT 1', None, False, context)
+        self.assertEqual(len(calls), 1)
+
+    def test_optimize_command(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'data.sqlite3')
+        with sqlite3.connect(path) as db:
+            db.execute("PRAGMA journal_mode = WAL")
+            db.execute("CREATE TABLE t (n INTEGER)")
+            db.execute("CREATE INDEX t_n ON t (n)")
+        tenants.add_database('optimize_test', {'ENGINE': 'django.db.backends.sqlite3', 'NAME': path})
+        self.addCleanup(tenants.unregister_database, 'optimize_test')
+        databases = SqliteTuningTests.databases
+        SqliteTuningTests.databases = databases | {'optimize_test'}
+        self.addCleanup(setattr, SqliteTuningTests, 'databases', databases)
+
+        output = io.StringIO()
+        call_command('optimize_sqlite', database=['optimize_test'], analyze=True, stdout=output)
+        self.assertIn('optimize_test', output.getvalue())
+        self.assertIn('checkpointed', output.getvalue())
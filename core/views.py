@@ -1,3 +1,27 @@
-from django.shortcuts import render
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import Http404
+from django.shortcuts import redirect
+from django.utils.http import url_has_allowed_host_and_scheme
+from django.views.decorators.http import require_POST
 
-# Create your views here.
+from .models import UserProfile
+from .tenants import get_tenant_settings
+
+
+@require_POST
+@staff_member_required
+def select_company(request):
+    """Work on the posted company for the rest of the session (blank: the active profile)"""
+    key = get_tenant_settings()['SESSION_KEY']
+    company = request.POST.get('company')
+    if company:
+        if not company.isdigit() or UserProfile.get_config(int(company)) is None:
+            raise Http404("No such company")
+        request.session[key] = int(company)
+    else:
+        request.session.pop(key, None)
+    next_url = request.POST.get('next', '')
+    if not url_has_allowed_host_and_scheme(next_url, allowed_hosts={request.get_host()},
+                                           require_https=request.is_secure()):
+        next_url = 'admin:index'
+    return redirect(next_url)
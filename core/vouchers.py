@@ -0,0 +1,186 @@
+"""Busy voucher types and the sign each one applies to stock
+
+Every stock figure goes through a VoucherRegistry: it builds the ORM
+expressions used in SQL aggregates and the NumPy sign vectors used for
+in-memory batch computation, so both agree on one set of rules.
+
+Code 0, which every row loaded before VchType existed carries, and codes
+without a voucher type count Value1 as stored: Busy already signs those
+quantities, issues being negative.
+
+The defaults can be overridden per company with settings.BUSY_VOUCHER_TYPES,
+a dict mapping UserProfile.company_name to {code: overrides}, where
+overrides is a dict of VoucherType attributes or None to drop the type:
+
+    BUSY_VOUCHER_TYPES = {
+        'Acme Traders': {6: {'sign': 1}, 9: {'label': 'Retail Sale'}},
+    }
+"""
+import functools
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db.models import Case, F, FloatField, Q, Sum, Value, When
+from django.dispatch import receiver
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - only needed for in-memory batch figures
+    np = None
+
+
+INWARD, OUTWARD, NEUTRAL = 1, -1, 0
+
+
+class VoucherType:
+    """One voucher type: its label, stock sign and display colour"""
+    __slots__ = ('code', 'label', 'sign', 'color', 'opening')
+
+    def __init__(self, code, label, sign, color='gray', opening=False):
+        self.code = code
+        self.label = label
+        self.sign = sign
+        self.color = color
+        self.opening = opening
+
+    def replace(self, **changes):
+        values = {name: getattr(self, name) for name in self.__slots__}
+        values.update(changes)
+        return VoucherType(**values)
+
+    def __repr__(self):
+        return f"VoucherType({self.code}, {self.label!r}, sign={self.sign})"
+
+
+DEFAULT_VOUCHER_TYPES = (
+    VoucherType(1, "Opening", INWARD, 'blue', opening=True),
+    VoucherType(2, "Receipt", INWARD, 'green'),
+    VoucherType(3, "Issue", OUTWARD, 'red'),
+    VoucherType(4, "Transfer In", INWARD, 'purple'),
+    VoucherType(5, "Transfer Out", OUTWARD, 'red'),
+    VoucherType(6, "Adjustment", NEUTRAL, 'gray'),
+    VoucherType(9, "Sale", OUTWARD, 'red'),
+)
+
+
+def as_code(value):
+    """Return a voucher type code as an int, or None if it is not one"""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class VoucherRegistry:
+    """Lookup of voucher types with the expressions derived from their signs"""
+
+    def __init__(self, types=DEFAULT_VOUCHER_TYPES):
+        self.types = {vch_type.code: vch_type for vch_type in types}
+        self.inward_codes = self._codes(lambda t: t.sign > 0)
+        self.outward_codes = self._codes(lambda t: t.sign < 0)
+        self.neutral_codes = self._codes(lambda t: t.sign == 0)
+        self.opening_codes = self._codes(lambda t: t.opening)
+        self._sign_table = None
+
+    def _codes(self, predicate):
+        return tuple(sorted(code for code, vch_type in self.types.items() if predicate(vch_type)))
+
+    def get(self, code):
+        return self.types.get(as_code(code))
+
+    def label(self, code):
+        vch_type = self.get(code)
+        return vch_type.label if vch_type else f"Type {code}"
+
+    def color(self, code):
+        vch_type = self.get(code)
+        return vch_type.color if vch_type else 'gray'
+
+    def sign(self, code):
+        """Return the stock sign of a voucher type code (INWARD for unknown codes)"""
+        vch_type = self.get(code)
+        return vch_type.sign if vch_type else INWARD
+
+    def is_opening(self, code):
+        return as_code(code) in self.opening_codes
+
+    def signed_value(self, code, value):
+        """Return value signed by voucher type (as stored for unknown voucher types)"""
+        try:
+            return self.sign(code) * float(value or 0)
+        except (TypeError, ValueError):
+            return 0.0
+
+    def signed_quantity(self, condition=None, prefix=''):
+        """Sum of Value1 signed by voucher type, limited to rows matching condition
+
+        prefix is the lookup path to ItemParamDet, e.g. 'itemparamdet__'
+        when aggregating from Master1.
+        """
+        condition = condition if condition is not None else Q()
+        value = F(f'{prefix}Value1')
+        whens = [
+            When(condition & Q(**{f'{prefix}VchType__in': codes}), then=then)
+            for codes, then in [(self.outward_codes, -value), (self.neutral_codes, Value(0.0))]
+            if codes
+        ]
+        # Inward, zero and unknown codes keep Value1 as stored
+        if condition:
+            whens.append(When(condition, then=value))
+            default = Value(0.0)
+        else:
+            default = value
+        return Sum(Case(*whens, default=default, output_field=FloatField()))
+
+    def opening_filter(self, prefix=''):
+        """Q matching opening balance rows"""
+        return Q(**{f'{prefix}VchType__in': self.opening_codes})
+
+    def sign_vector(self, codes):
+        """Return a float array with the sign of each voucher type code"""
+        if np is None:
+            raise ImportError("numpy is required for in-memory stock figures")
+        if self._sign_table is None:
+            table = np.ones(max(self.types, default=0) + 1)
+            for code, vch_type in self.types.items():
+                if code >= 0:
+                    table[code] = vch_type.sign
+            self._sign_table = table
+        codes = np.asarray(codes, dtype=np.int64)
+        known = (codes >= 0) & (codes < len(self._sign_table))
+        signs = np.ones(codes.shape)
+        signs[known] = self._sign_table[codes[known]]
+        return signs
+
+    def signed_values(self, codes, values):
+        """Vectorized signed_value over parallel arrays of codes and values"""
+        return self.sign_vector(codes) * np.asarray(values, dtype=np.float64)
+
+
+@functools.lru_cache(maxsize=None)
+def _registry_for(company):
+    overrides = getattr(settings, 'BUSY_VOUCHER_TYPES', {}).get(company, {})
+    types = {vch_type.code: vch_type for vch_type in DEFAULT_VOUCHER_TYPES}
+    for code, changes in overrides.items():
+        code = int(code)
+        if changes is None:
+            types.pop(code, None)
+        elif code in types:
+            types[code] = types[code].replace(**changes)
+        else:
+            types[code] = VoucherType(code, **changes)
+    return VoucherRegistry(types.values())
+
+
+def get_voucher_registry(profile=None):
+    """Return the voucher registry for profile (default: the current company)"""
+    if profile is None:
+        from .tenants import current_profile
+        profile = current_profile()
+    return _registry_for(profile.company_name if profile else None)
+
+
+@receiver(setting_changed)
+def clear_voucher_registries(setting, **kwargs):
+    if setting == 'BUSY_VOUCHER_TYPES':
+        _registry_for.cache_clear()
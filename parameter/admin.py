@@ -1,15 +1,86 @@
 from django.contrib import admin
+from django.contrib.admin.views.main import ChangeList
+from django.core.exceptions import PermissionDenied
 from django.db import models
 from django.db.models import Sum, Count
 from django.utils.html import format_html
 from django.contrib import messages
-from django.http import HttpResponse
+from django.http import JsonResponse, Http404
+from django.urls import path, reverse
 from django.utils import timezone
 from rangefilter.filters import DateRangeFilter
-import csv
 import datetime
 from core.models import Master1, ItemParamDet
-from .models import StockReportView, ParameterStockView, BCNStockSummary
+from core.vouchers import get_voucher_registry
+from .models import StockReportView, ParameterStockView, BCNStockSummary, stock_status_counts
+from .cache import stock_cache, queryset_key
+from . import exports, facets, jobs, search
+from .exports import stream_csv, iterate_rows
+
+# Values suggested by an autocomplete list filter per keystroke
+FACET_SUGGESTIONS = 20
+
+
+def queue_report_job(model_admin, request, queryset, kind):
+    """Queue a background export of the selected rows for the changelist's date range
+
+    With "select all" the job covers every row of the date range, since
+    the worker does not see the changelist's search and filters.
+    """
+    start_date, end_date = model_admin.get_date_range(request)
+    params = {name: value.isoformat() for name, value in
+              (('start_date', start_date), ('end_date', end_date)) if value}
+    if request.POST.get('select_across') != '1':
+        params['ids'] = [str(pk) for pk in queryset.values_list('pk', flat=True)]
+    job = jobs.submit(kind, params, request.user)
+    model_admin.message_user(request, format_html(
+        'Queued {} as job {}. <a href="{}">Check its status</a>; the file can be downloaded once it is done.',
+        jobs.JOB_KINDS[kind].label, job.pk, reverse('report_job_status', args=[job.pk]),
+    ), messages.SUCCESS)
+
+
+def cached_status_counts(model_admin, request, queryset):
+    """stock_status_counts of a changelist queryset, through the result cache"""
+    start_date, end_date = model_admin.get_date_range(request)
+    key = queryset_key(queryset)
+    if key is None:
+        return stock_status_counts(queryset)
+    return stock_cache.get_or_compute(
+        f'{queryset.model._meta.label}:status', key, start_date, end_date,
+        lambda: stock_status_counts(queryset),
+    )
+
+
+class CachedChangeList(ChangeList):
+    """ChangeList whose page of results is served from the stock result cache
+
+    The key is the SQL of the filtered, searched and ordered queryset plus
+    the page, so each distinct view of the list is cached separately.
+    """
+    cached_attributes = (
+        'result_count', 'show_full_result_count', 'show_admin_actions',
+        'full_result_count', 'result_list', 'can_show_all', 'multi_page', 'paginator',
+    )
+
+    def get_results(self, request):
+        key = queryset_key(self.queryset)
+        if key is None:
+            return super().get_results(request)
+
+        def compute():
+            super(CachedChangeList, self).get_results(request)
+            self.result_list = list(self.result_list)
+            return {name: getattr(self, name) for name in self.cached_attributes}
+
+        start_date, end_date = self.model_admin.get_date_range(request)
+        results = stock_cache.get_or_compute(
+            f'{self.model._meta.label}:page',
+            (key, self.page_num, self.list_per_page, self.show_all),
+            start_date, end_date, compute,
+        )
+        for name, value in results.items():
+            setattr(self, name, value)
+
 
 class DateRangeFilter(admin.SimpleListFilter):
     title = 'Date Range'
@@ -33,6 +104,58 @@ class DateRangeFilter(admin.SimpleListFilter):
         return queryset
 
 
+class FacetFilter(admin.SimpleListFilter):
+    """List filter on one field with its values and row counts from ParameterFacet"""
+    field = None
+
+    def display(self, value):
+        return value
+
+    def lookups(self, request, model_admin):
+        return [
+            (value, f"{self.display(value)} ({count})")
+            for value, count in sorted(facets.choices(self.field))
+        ]
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(**{self.field: self.value()})
+        return queryset
+
+
+class FacetAutocompleteFilter(FacetFilter):
+    """FacetFilter for high-cardinality fields
+
+    Only the selected value is rendered; other values are suggested as the
+    user types, fetched from ParameterStockAdmin.facet_values_view.
+    """
+    template = 'admin/parameter/facet_autocomplete_filter.html'
+
+    def __init__(self, request, params, model, model_admin):
+        super().__init__(request, params, model, model_admin)
+        opts = model_admin.opts
+        self.facet_url = reverse(
+            f'{model_admin.admin_site.name}:{opts.app_label}_{opts.model_name}_facets',
+            args=[self.field],
+        )
+
+    def has_output(self):
+        return True
+
+    def lookups(self, request, model_admin):
+        value = self.value()
+        return [(value, self.display(value))] if value else []
+
+
+def facet_filter(field, title, display=None, autocomplete=False):
+    """Build a FacetFilter (or FacetAutocompleteFilter) class for a field"""
+    attrs = {'field': field, 'title': title, 'parameter_name': field}
+    if display is not None:
+        attrs['display'] = lambda self, value: display(value)
+    base = FacetAutocompleteFilter if autocomplete else FacetFilter
+    return type(f"{field.replace('__', '_')}FacetFilter", (base,), attrs)
+
+
 @admin.register(BCNStockSummary)
 class BCNStockSummaryAdmin(admin.ModelAdmin):
     list_display = (
@@ -43,7 +166,7 @@ class BCNStockSummaryAdmin(admin.ModelAdmin):
     list_filter = (DateRangeFilter,)
     ordering = ('bcn',)
     list_per_page = 50
-    actions = ['export_bcn_stock_csv']
+    actions = ['export_bcn_stock_csv', 'queue_bcn_stock_csv']
     
     def has_add_permission(self, request):
         return False
@@ -54,43 +177,51 @@ class BCNStockSummaryAdmin(admin.ModelAdmin):
     def has_delete_permission(self, request, obj=None):
         return False
     
+    def get_date_range(self, request):
+        """Get date range from request if available"""
+        return getattr(request, 'start_date', None), getattr(request, 'end_date', None)
+
+    def get_changelist(self, request, **kwargs):
+        return CachedChangeList
+
     def get_queryset(self, request):
-        # Get date range from request if available
-        start_date = getattr(request, 'start_date', None)
-        end_date = getattr(request, 'end_date', None)
+        start_date, end_date = self.get_date_range(request)
         
-        # Generate the queryset using our custom method
+        # Lazy queryset: paging, search and ordering all run in SQL
         return BCNStockSummary.get_queryset(start_date, end_date)
     
     def display_opening_stock(self, obj):
         """Display opening stock with formatting"""
         if obj.opening_stock > 0:
-            return format_html('<span style="color: green;">{:.2f}</span>', obj.opening_stock)
+            return format_html('<span style="color: green;">{}</span>', f"{obj.opening_stock:.2f}")
         elif obj.opening_stock < 0:
-            return format_html('<span style="color: red;">{:.2f}</span>', obj.opening_stock)
+            return format_html('<span style="color: red;">{}</span>', f"{obj.opening_stock:.2f}")
         else:
             return format_html('<span style="color: gray;">0.00</span>')
     display_opening_stock.short_description = "Opening Stock"
+    display_opening_stock.admin_order_field = 'opening_stock'
     
     def display_closing_stock(self, obj):
         """Display closing stock with formatting"""
         if obj.closing_stock > 0:
-            return format_html('<span style="color: green;">{:.2f}</span>', obj.closing_stock)
+            return format_html('<span style="color: green;">{}</span>', f"{obj.closing_stock:.2f}")
         elif obj.closing_stock < 0:
-            return format_html('<span style="color: red;">{:.2f}</span>', obj.closing_stock)
+            return format_html('<span style="color: red;">{}</span>', f"{obj.closing_stock:.2f}")
         else:
             return format_html('<span style="color: gray;">0.00</span>')
     display_closing_stock.short_description = "Closing Stock"
+    display_closing_stock.admin_order_field = 'closing_stock'
     
     def display_movement(self, obj):
         """Display movement with arrow indicators"""
         if obj.movement > 0:
-            return format_html('<span style="color: green;">↑ {:.2f}</span>', obj.movement)
+            return format_html('<span style="color: green;">↑ {}</span>', f"{obj.movement:.2f}")
         elif obj.movement < 0:
-            return format_html('<span style="color: red;">↓ {:.2f}</span>', abs(obj.movement))
+            return format_html('<span style="color: red;">↓ {}</span>', f"{abs(obj.movement):.2f}")
         else:
             return format_html('<span style="color: gray;">0.00</span>')
     display_movement.short_description = "Movement"
+    display_movement.admin_order_field = 'movement'
     
     def display_stock_status(self, obj):
         """Display stock status indicator"""
@@ -101,11 +232,10 @@ class BCNStockSummaryAdmin(admin.ModelAdmin):
         else:
             return format_html('<span style="color: red; font-weight: bold;">❌ Negative Stock</span>')
     display_stock_status.short_description = "Stock Status"
+    display_stock_status.admin_order_field = 'closing_stock'
     
     def export_bcn_stock_csv(self, request, queryset):
         """Export selected BCN stock items to CSV"""
-        response = HttpResponse(content_type='text/csv')
-        
         # Get date range for filename
         start_date = getattr(request, 'start_date', None)
         end_date = getattr(request, 'end_date', None)
@@ -115,63 +245,25 @@ class BCNStockSummaryAdmin(admin.ModelAdmin):
             filename = f"bcn_stock_report_{start_date}_to_{end_date}.csv"
         else:
             filename = f"bcn_stock_report_{timezone.now().strftime('%Y%m%d')}.csv"
-            
-        response['Content-Disposition'] = f'attachment; filename="{filename}"'
-        
-        writer = csv.writer(response)
-        writer.writerow(['BCN', 'Item Code', 'Item Name', 'Parameters', 'Opening Stock', 'Closing Stock', 'Movement', 'Stock Status'])
-        
-        for obj in queryset:
-            try:
-                # Determine stock status
-                if obj.closing_stock > 0:
-                    stock_status = "In Stock"
-                elif obj.closing_stock == 0:
-                    stock_status = "Out of Stock"
-                else:
-                    stock_status = "Negative Stock"
-                    
-                writer.writerow([
-                    obj.bcn,
-                    obj.item_code,
-                    obj.item_name,
-                    obj.parameters,
-                    f"{obj.opening_stock:.2f}",
-                    f"{obj.closing_stock:.2f}",
-                    f"{obj.movement:.2f}",
-                    stock_status
-                ])
-            except Exception as e:
-                # If any error occurs, use safe defaults
-                writer.writerow([
-                    obj.bcn or "N/A",
-                    "N/A",
-                    "N/A",
-                    "N/A",
-                    "0.00",
-                    "0.00",
-                    "0.00",
-                    "❓ Error"
-                ])
         
-        self.message_user(request, f"Exported {queryset.count()} BCN stock items to CSV", messages.SUCCESS)
-        return response
+        self.message_user(request, "Exported selected BCN stock items to CSV", messages.SUCCESS)
+        return stream_csv(exports.bcn_stock_rows(queryset), filename)
     
     export_bcn_stock_csv.short_description = "📊 Export selected to CSV"
+
+    def queue_bcn_stock_csv(self, request, queryset):
+        """Export in the background for large date ranges"""
+        queue_report_job(self, request, queryset, 'bcn_summary_csv')
+    queue_bcn_stock_csv.short_description = "⏳ Export selected to CSV in the background"
     
     def changelist_view(self, request, extra_context=None):
         """Override changelist view to add summary statistics"""
         response = super().changelist_view(request, extra_context=extra_context)
         
         # Only add summary if the response has a context_data attribute
-        if hasattr(response, 'context_data'):
-            queryset = self.get_queryset(request)
-            
-            # Calculate summary statistics
-            total_items = len(queryset)
-            positive_stock = sum(1 for item in queryset if item.closing_stock > 0)
-            zero_stock = sum(1 for item in queryset if item.closing_stock == 0)
-            negative_stock = sum(1 for item in queryset if item.closing_stock < 0)
+        if hasattr(response, 'context_data') and 'cl' in response.context_data:
+            # Reuse the rows the changelist already built
+            counts = cached_status_counts(self, request, response.context_data['cl'].queryset)
             
             # Get date range for display
             start_date = getattr(request, 'start_date', None)
@@ -184,13 +276,7 @@ class BCNStockSummaryAdmin(admin.ModelAdmin):
                     date_range_display = f"from {start_date} to {end_date}"
             
             # Add summary to context
-            response.context_data['summary'] = {
-                'total_items': total_items,
-                'positive_stock': positive_stock,
-                'zero_stock': zero_stock,
-                'negative_stock': negative_stock,
-                'date_range': date_range_display
-            }
+            response.context_data['summary'] = dict(counts, date_range=date_range_display)
             
         return response
 
@@ -203,16 +289,16 @@ class StockReportAdmin(admin.ModelAdmin):
     search_fields = ('Code', 'Name')
     list_filter = ('MasterType', DateRangeFilter)
     ordering = ('Code',)
-    actions = ['export_stock_csv']
-    
-    # Store date range in admin class
-    start_date = None
-    end_date = None
+    actions = ['export_stock_csv', 'queue_stock_csv']
     
     def get_queryset(self, request):
-        """Filter to show only item masters (MasterType = 6)"""
+        """Filter to show only item masters (MasterType = 6) with stock figures"""
         qs = super().get_queryset(request)
-        return qs.filter(MasterType=6)
+        start_date, end_date = self.get_date_range(request)
+        return qs.filter(MasterType=6).with_stock_figures(start_date, end_date)
+
+    def get_changelist(self, request, **kwargs):
+        return CachedChangeList
     
     # Remove add/edit/delete permissions
     def has_add_permission(self, request):
@@ -283,35 +369,19 @@ class StockReportAdmin(admin.ModelAdmin):
         # Default: no date filtering
         return None, None
     
-    def changelist_view(self, request, extra_context=None):
-        """Add date range to changelist view"""
-        # Get date range
-        self.start_date, self.end_date = self.get_date_range(request)
-        
-        # Add date range to context
-        extra_context = extra_context or {}
-        if self.start_date and self.end_date:
-            extra_context['date_range'] = {
-                'start_date': self.start_date,
-                'end_date': self.end_date,
-            }
-        
-        return super().changelist_view(request, extra_context)
-    
     def display_opening_stock(self, obj):
         """Display opening stock with formatting including voucher type 1"""
         try:
-            opening_stock = obj.get_opening_stock(self.start_date, self.end_date)
-            return "{:.2f}".format(opening_stock)
+            return "{:.2f}".format(obj.opening_stock)
         except (ValueError, TypeError, Exception):
             return "0.00"
     display_opening_stock.short_description = "Opening Stock"
-    display_opening_stock.admin_order_field = 'Code'
+    display_opening_stock.admin_order_field = 'opening_stock'
 
     def display_closing_stock(self, obj):
         """Display closing stock with formatting"""
         try:
-            stock_value = obj.get_closing_stock(self.start_date, self.end_date)
+            stock_value = obj.closing_stock
             
             if stock_value > 0:
                 color = "green"
@@ -321,17 +391,18 @@ class StockReportAdmin(admin.ModelAdmin):
                 color = "red"
                 
             return format_html(
-                '<span style="color: {}; font-weight: bold;">{:.2f}</span>',
-                color, stock_value
+                '<span style="color: {}; font-weight: bold;">{}</span>',
+                color, f"{stock_value:.2f}"
             )
         except (ValueError, TypeError, Exception):
             return format_html('<span style="color: gray;">0.00</span>')
     display_closing_stock.short_description = "Closing Stock"
+    display_closing_stock.admin_order_field = 'closing_stock'
 
     def display_movement(self, obj):
         """Display movement with color coding (excluding opening stock)"""
         try:
-            movement_value = obj.get_movement(self.start_date, self.end_date)
+            movement_value = obj.movement
             
             if movement_value > 0:
                 color = "green"
@@ -344,104 +415,64 @@ class StockReportAdmin(admin.ModelAdmin):
                 arrow = "→"
             
             return format_html(
-                '<span style="color: {};"> {} {:.2f}</span>',
-                color, arrow, movement_value
+                '<span style="color: {};"> {} {}</span>',
+                color, arrow, f"{movement_value:.2f}"
             )
         except (ValueError, TypeError, Exception):
             return format_html('<span style="color: gray;">→ 0.00</span>')
     display_movement.short_description = "Movement"
+    display_movement.admin_order_field = 'movement'
 
     def display_stock_status(self, obj):
         """Display stock status"""
-        return obj.get_stock_status(self.start_date, self.end_date)
+        return obj.stock_status
     display_stock_status.short_description = "Status"
 
     def export_stock_csv(self, request, queryset):
         """Export selected items to CSV"""
-        response = HttpResponse(content_type='text/csv')
-        response['Content-Disposition'] = 'attachment; filename="stock_report.csv"'
-        
         # Get date range for export
         start_date, end_date = self.get_date_range(request)
         
         # Add date range to filename if applicable
+        filename = "stock_report.csv"
         if start_date and end_date:
             filename = f"stock_report_{start_date}_to_{end_date}.csv"
-            response['Content-Disposition'] = f'attachment; filename="{filename}"'
         
-        writer = csv.writer(response)
-        header = ['Item Code', 'Item Name', 'Opening Stock', 'Closing Stock', 'Movement', 'Status']
+        # Figures come from the queryset annotation, not per-row aggregates
+        if 'closing_stock' not in queryset.query.annotations:
+            queryset = queryset.with_stock_figures(start_date, end_date)
         
-        # Add date range to header if applicable
-        if start_date and end_date:
-            date_range_str = f"Date Range: {start_date} to {end_date}"
-            writer.writerow([date_range_str])
-        
-        writer.writerow(header)
-        
-        for obj in queryset:
-            try:
-                opening_stock = obj.get_opening_stock(start_date, end_date)
-                closing_stock = obj.get_closing_stock(start_date, end_date)
-                movement = obj.get_movement(start_date, end_date)
-                
-                writer.writerow([
-                    obj.Code,
-                    obj.Name,
-                    f"{opening_stock:.2f}",
-                    f"{closing_stock:.2f}",
-                    f"{movement:.2f}",
-                    obj.get_stock_status(start_date, end_date)
-                ])
-            except (ValueError, TypeError, Exception) as e:
-                # If any error occurs, use safe defaults
-                writer.writerow([
-                    obj.Code or "N/A",
-                    obj.Name or "N/A",
-                    "0.00",
-                    "0.00",
-                    "0.00",
-                    "❓ Error"
-                ])
-        
-        self.message_user(request, f"Exported {queryset.count()} items to CSV", messages.SUCCESS)
-        return response
+        self.message_user(request, "Exported selected items to CSV", messages.SUCCESS)
+        return stream_csv(exports.stock_report_rows(queryset, start_date, end_date), filename)
     
     export_stock_csv.short_description = "📊 Export selected to CSV"
 
+    def queue_stock_csv(self, request, queryset):
+        """Export in the background for large date ranges"""
+        queue_report_job(self, request, queryset, 'stock_report_csv')
+    queue_stock_csv.short_description = "⏳ Export selected to CSV in the background"
+
     def changelist_view(self, request, extra_context=None):
-        """Add summary statistics to changelist"""
-        total_items = self.get_queryset(request).count()
-        
-        # Calculate stock status counts
-        positive_stock_count = 0
-        zero_stock_count = 0
-        negative_stock_count = 0
-        
-        for item in self.get_queryset(request):
-            try:
-                stock_value = item.get_closing_stock()
-                
-                if stock_value > 0:
-                    positive_stock_count += 1
-                elif stock_value == 0:
-                    zero_stock_count += 1
-                else:
-                    negative_stock_count += 1
-            except (ValueError, TypeError, Exception):
-                zero_stock_count += 1
+        """Add date range and summary statistics to changelist"""
+        start_date, end_date = self.get_date_range(request)
         
+        # Add date range to context
         extra_context = extra_context or {}
-        extra_context.update({
-            'summary_stats': {
-                'total_items': total_items,
-                'positive_stock': positive_stock_count,
-                'zero_stock': zero_stock_count,
-                'negative_stock': negative_stock_count,
+        if start_date and end_date:
+            extra_context['date_range'] = {
+                'start_date': start_date,
+                'end_date': end_date,
             }
-        })
         
-        return super().changelist_view(request, extra_context)
+        response = super().changelist_view(request, extra_context)
+        
+        # Count stock status over the changelist's own annotated queryset
+        if hasattr(response, 'context_data') and 'cl' in response.context_data:
+            response.context_data['summary_stats'] = cached_status_counts(
+                self, request, response.context_data['cl'].queryset
+            )
+        
+        return response
 
 @admin.register(ParameterStockView)
 class ParameterStockAdmin(admin.ModelAdmin):
@@ -450,7 +481,14 @@ class ParameterStockAdmin(admin.ModelAdmin):
         'display_value', 'Date', 'VchNo', 'BCN', 'display_vch_type'
     )
     search_fields = ('ItemCode__Code', 'ItemCode__Name', 'C1', 'C2', 'C3', 'C4', 'C5', 'VchNo', 'BCN')
-    list_filter = ('Date', 'VchType', 'ItemCode__Code', 'C1', 'C2', 'BCN')
+    list_filter = (
+        'Date',
+        facet_filter('VchType', 'voucher type', display=lambda code: get_voucher_registry().label(code)),
+        facet_filter('ItemCode__Code', 'item code', autocomplete=True),
+        facet_filter('C1', 'C1'),
+        facet_filter('C2', 'C2'),
+        facet_filter('BCN', 'BCN', autocomplete=True),
+    )
     ordering = ('ItemCode__Code', '-Date', '-Value1')
     date_hierarchy = 'Date'
     list_per_page = 50
@@ -458,7 +496,29 @@ class ParameterStockAdmin(admin.ModelAdmin):
     
     def get_queryset(self, request):
         """Get all parameter stock details with related data"""
-        return super().get_queryset(request).select_related('ItemCode')
+        return super().get_queryset(request).select_related('ItemCode', 'ParamSet')
+
+    def get_search_results(self, request, queryset, search_term):
+        """Search through the token index when it has been built"""
+        if search_term and search.index_ready():
+            return search.search(queryset, search_term), False
+        return super().get_search_results(request, queryset, search_term)
+
+    def get_urls(self):
+        info = self.opts.app_label, self.opts.model_name
+        return [
+            path('facets/<str:field>/', self.admin_site.admin_view(self.facet_values_view),
+                 name='%s_%s_facets' % info),
+        ] + super().get_urls()
+
+    def facet_values_view(self, request, field):
+        """JSON suggestions for an autocomplete list filter, filtered by ?term="""
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+        if field not in facets.FACET_FIELDS:
+            raise Http404(f"No list filter facet for {field}")
+        values = facets.choices(field, request.GET.get('term', '').strip(), limit=FACET_SUGGESTIONS)
+        return JsonResponse({'results': [{'value': value, 'count': count} for value, count in values]})
     
     def has_add_permission(self, request):
         return False
@@ -494,8 +554,8 @@ class ParameterStockAdmin(admin.ModelAdmin):
                 color = "gray"
             
             return format_html(
-                '<span style="color: {}; font-weight: bold;">{:.2f}</span>',
-                color, value
+                '<span style="color: {}; font-weight: bold;">{}</span>',
+                color, f"{value:.2f}"
             )
         except (ValueError, TypeError):
             return format_html('<span style="color: gray;">0.00</span>')
@@ -510,39 +570,16 @@ class ParameterStockAdmin(admin.ModelAdmin):
             return format_html('<span title="BCN: {}"><strong>{}</strong></span>', obj.BCN, params)
         return params
     get_parameter_string.short_description = "Parameters"
+    get_parameter_string.admin_order_field = 'ParamSet__label'
 
     def display_vch_type(self, obj):
         """Display voucher type with description"""
-        vch_type_map = {
-            1: "Opening",
-            2: "Receipt", 
-            3: "Issue",
-            4: "Transfer In",
-            5: "Transfer Out",
-            6: "Adjustment",
-            9: "Sale",
-            # Add more mappings as needed
-        }
-        
         vch_type = getattr(obj, 'VchType', None)
         if vch_type:
-            description = vch_type_map.get(vch_type, f"Type {vch_type}")
-            
-            # Color code by voucher type
-            if vch_type == 1:  # Opening
-                color = "blue"
-            elif vch_type == 2:  # Receipt/Purchase
-                color = "green"
-            elif vch_type in [3, 5, 9]:  # Issue/Transfer Out/Sale
-                color = "red"
-            elif vch_type == 4:  # Transfer In
-                color = "purple"
-            else:
-                color = "gray"
-                
+            vouchers = get_voucher_registry()
             return format_html(
                 '<span title="Voucher Type {}" style="color: {}; font-weight: bold;">{}</span>',
-                vch_type, color, description
+                vch_type, vouchers.color(vch_type), vouchers.label(vch_type)
             )
         return "N/A"
     
@@ -551,52 +588,41 @@ class ParameterStockAdmin(admin.ModelAdmin):
     
     def export_parameter_stock_csv(self, request, queryset):
         """Export selected parameter stock items to CSV"""
-        response = HttpResponse(content_type='text/csv')
-        response['Content-Disposition'] = 'attachment; filename="parameter_stock_report.csv"'
-        
-        writer = csv.writer(response)
-        writer.writerow(['Item Code', 'Item Name', 'Parameters', 'BCN', 'Quantity', 'Date', 'Voucher No', 'Voucher Type'])
-        
-        vch_type_map = {
-            1: "Opening",
-            2: "Receipt", 
-            3: "Issue",
-            4: "Transfer In",
-            5: "Transfer Out",
-            6: "Adjustment",
-            9: "Sale",
-        }
+        vouchers = get_voucher_registry()
         
-        for obj in queryset:
-            try:
-                # Get voucher type description
-                vch_type = getattr(obj, 'VchType', None)
-                vch_description = vch_type_map.get(vch_type, f"Type {vch_type}") if vch_type else "N/A"
-                
-                writer.writerow([
-                    obj.get_item_code_display(),
-                    obj.get_item_name_display(),
-                    obj.get_parameter_string(),
-                    obj.BCN or "",
-                    f"{obj.Value1:.2f}",
-                    obj.Date,
-                    obj.VchNo,
-                    vch_description
-                ])
-            except Exception as e:
-                # If any error occurs, use safe defaults
-                writer.writerow([
-                    "N/A",
-                    "N/A",
-                    "N/A",
-                    "N/A",
-                    "0.00",
-                    "N/A",
-                    "N/A",
-                    "❓ Error"
-                ])
-        
-        self.message_user(request, f"Exported {queryset.count()} parameter stock items to CSV", messages.SUCCESS)
-        return response
+        def rows():
+            yield ['Item Code', 'Item Name', 'Parameters', 'BCN', 'Quantity', 'Date', 'Voucher No', 'Voucher Type']
+            
+            for obj in iterate_rows(queryset.select_related('ItemCode', 'ParamSet')):
+                try:
+                    # Get voucher type description
+                    vch_type = getattr(obj, 'VchType', None)
+                    vch_description = vouchers.label(vch_type) if vch_type else "N/A"
+                    
+                    yield [
+                        obj.get_item_code_display(),
+                        obj.get_item_name_display(),
+                        obj.get_parameter_string(),
+                        obj.BCN or "",
+                        f"{obj.Value1:.2f}",
+                        obj.Date,
+                        obj.VchNo,
+                        vch_description
+                    ]
+                except Exception as e:
+                    # If any error occurs, use safe defaults
+                    yield [
+                        "N/A",
+                        "N/A",
+                        "N/A",
+                        "N/A",
+                        "0.00",
+                        "N/A",
+                        "N/A",
+                        "❓ Error"
+                    ]
+        
+        self.message_user(request, "Exported selected parameter stock items to CSV", messages.SUCCESS)
+        return stream_csv(rows(), "parameter_stock_report.csv")
     
     export_parameter_stock_csv.short_description = "📊 Export selected to CSV"
\ No newline at end of file
@@ -0,0 +1,222 @@
+"""Async JSON endpoints with stock figures for POS and e-commerce clients
+
+GET /api/stock/<dimension>/ returns opening, closing and movement per
+item, BCN or parameter set for an optional start_date/end_date range
+(YYYY-MM-DD), optionally limited to the given keys (item codes, BCNs or
+parameter set ids; malformed keys get a 400). Rows are read with the async ORM and streamed as they
+arrive, either as one JSON document or, with ?format=ndjson or an
+"Accept: application/x-ndjson" header, as one JSON object per line.
+
+Responses carry an ETag derived from the ledger version (of the reporting
+copy while reads go there) and the company's last item sync, so a client
+polling with If-None-Match gets a 304 without any figures being computed
+until ItemParamDet changes or item names are reloaded. Item
+and parameter set figures follow the stock report (opening vouchers
+within the range); BCN figures follow the BCN summary (everything before
+start_date).
+
+Clients authenticate with a staff session or an
+"Authorization: Bearer <token>" header naming one of STOCK_API['TOKENS'].
+"""
+import datetime
+import hashlib
+import hmac
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.http import Http404, JsonResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.views.decorators.http import require_safe
+
+from core.models import SyncState
+from core.tenants import current_profile
+from .models import BCNStockSummary, ParameterSetStockView, StockReportView
+from .reporting import read_version
+
+# Defaults for settings.STOCK_API
+API_DEFAULTS = {
+    'TOKENS': (),           # bearer tokens accepted besides staff sessions
+    'CHUNK_SIZE': 2000,     # rows fetched from the database per round trip
+}
+
+NDJSON_CONTENT_TYPE = 'application/x-ndjson'
+FIGURES = ('opening_stock', 'closing_stock', 'movement')
+
+
+def get_api_settings():
+    """Return the stock API settings merged over the defaults"""
+    options = dict(API_DEFAULTS)
+    options.update(getattr(settings, 'STOCK_API', {}))
+    return options
+
+
+class StockDimension:
+    """What the figures of one endpoint are grouped by
+
+    queryset(start_date, end_date) returns the annotated rows of model,
+    key_field is the field matched by ?key= and fields maps output names
+    to the fields read from each row.
+    """
+    __slots__ = ('model', 'queryset', 'key_field', 'fields')
+
+    def __init__(self, model, queryset, key_field, fields):
+        self.model = model
+        self.queryset = queryset
+        self.key_field = key_field
+        self.fields = fields
+
+    def parse_keys(self, keys):
+        """Return keys as values of key_field; raise ValidationError if one is malformed"""
+        opts = self.model._meta
+        field = opts.pk if self.key_field == 'pk' else opts.get_field(self.key_field)
+        return [field.to_python(key) for key in keys]
+
+
+STOCK_DIMENSIONS = {
+    'items': StockDimension(
+        StockReportView,
+        lambda start, end: StockReportView.objects.filter(MasterType=6).with_stock_figures(start, end).order_by('Code'),
+        'Code', {'code': 'Code', 'name': 'Name'},
+    ),
+    'bcns': StockDimension(
+        BCNStockSummary,
+        lambda start, end: BCNStockSummary.get_queryset(start, end).order_by('bcn'),
+        'bcn', {'bcn': 'bcn', 'item_code': 'item_code', 'item_name': 'item_name', 'parameters': 'parameters'},
+    ),
+    'parameter-sets': StockDimension(
+        ParameterSetStockView,
+        lambda start, end: ParameterSetStockView.objects.with_stock_figures(start, end).order_by('label'),
+        'pk', {'id': 'pk', 'label': 'label'},
+    ),
+}
+
+
+def parse_dates(query):
+    """Return the (start_date, end_date) of a query, as dates or None; raise ValueError if malformed"""
+    return tuple(
+        datetime.date.fromisoformat(query[name]) if query.get(name) else None
+        for name in ('start_date', 'end_date')
+    )
+
+
+def wants_ndjson(request):
+    if 'format' in request.GET:
+        return request.GET['format'] == 'ndjson'
+    return NDJSON_CONTENT_TYPE in request.headers.get('Accept', '')
+
+
+def stock_etag(dimension, query, ndjson):
+    """ETag of a response: the ledger version plus a hash of what was asked
+
+    The current company is part of the hash since its voucher types decide
+    the signs of the figures (and, with per-company databases, whose rows
+    they are). So is its last item sync, which renames items without
+    moving the ledger version.
+    """
+    profile = current_profile()
+    items_synced_at = None
+    if profile is not None:
+        items_synced_at = SyncState.objects.filter(profile=profile).values_list(
+            'items_synced_at', flat=True).first()
+    request_key = json.dumps([
+        dimension,
+        sorted((name, query.getlist(name)) for name in query if name != 'format'),
+        ndjson,
+        [profile.pk, profile.company_name] if profile else None,
+        items_synced_at.isoformat() if items_synced_at else None,
+    ])
+    digest = hashlib.sha1(request_key.encode()).hexdigest()[:16]
+    return f'"{read_version()}-{digest}"'
+
+
+def build_queryset(dimension, start_date, end_date, keys):
+    """Return the values() queryset of a dimension (reads the voucher registry)"""
+    queryset = dimension.queryset(start_date, end_date)
+    if keys:
+        queryset = queryset.filter(**{f'{dimension.key_field}__in': keys})
+    return queryset.values(*dimension.fields.values(), *FIGURES)
+
+
+def serialize(dimension, row):
+    record = {name: row[field] for name, field in dimension.fields.items()}
+    record.update(
+        opening=round(row['opening_stock'] or 0.0, 4),
+        closing=round(row['closing_stock'] or 0.0, 4),
+        movement=round(row['movement'] or 0.0, 4),
+    )
+    return record
+
+
+async def ndjson_lines(dimension, queryset, chunk_size):
+    async for row in queryset.aiterator(chunk_size=chunk_size):
+        yield json.dumps(serialize(dimension, row)) + '\n'
+
+
+async def json_document(dimension, queryset, chunk_size, header):
+    """Stream {"...header", "results": [...]} one row at a time"""
+    yield json.dumps(header)[:-1] + ', "results": ['
+    separator = ''
+    async for row in queryset.aiterator(chunk_size=chunk_size):
+        yield separator + json.dumps(serialize(dimension, row))
+        separator = ', '
+    yield ']}'
+
+
+def valid_token(supplied):
+    """Whether supplied is one of STOCK_API['TOKENS'], compared in constant time"""
+    supplied = supplied.encode()
+    # No short-circuit, so the time taken does not tell which token matched
+    matches = [hmac.compare_digest(supplied, token.encode()) for token in get_api_settings()['TOKENS']]
+    return any(matches)
+
+
+async def api_authorized(request):
+    token = request.headers.get('Authorization', '')
+    if token.startswith('Bearer ') and valid_token(token[len('Bearer '):]):
+        return True
+    user = await request.auser()
+    return user.is_active and user.is_staff
+
+
+@require_safe
+async def stock_figures(request, dimension):
+    """Stream the stock figures of one dimension as JSON or NDJSON"""
+    if dimension not in STOCK_DIMENSIONS:
+        raise Http404(f"Unknown stock dimension {dimension!r}")
+    if not await api_authorized(request):
+        return JsonResponse({'error': "Staff login or API token required"}, status=403)
+    try:
+        start_date, end_date = parse_dates(request.GET)
+    except ValueError:
+        return JsonResponse({'error': "Dates must be YYYY-MM-DD"}, status=400)
+    spec = STOCK_DIMENSIONS[dimension]
+    try:
+        keys = spec.parse_keys(request.GET.getlist('key'))
+    except ValidationError:
+        return JsonResponse({'error': f"Malformed key for {dimension}"}, status=400)
+
+    ndjson = wants_ndjson(request)
+    etag = await sync_to_async(stock_etag)(dimension, request.GET, ndjson)
+    not_modified = get_conditional_response(request, etag=etag)
+    if not_modified is not None:
+        return not_modified
+
+    queryset = await sync_to_async(build_queryset)(spec, start_date, end_date, keys)
+    chunk_size = get_api_settings()['CHUNK_SIZE']
+    if ndjson:
+        response = StreamingHttpResponse(ndjson_lines(spec, queryset, chunk_size),
+                                         content_type=NDJSON_CONTENT_TYPE)
+    else:
+        header = {
+            'dimension': dimension,
+            'start_date': start_date.isoformat() if start_date else None,
+            'end_date': end_date.isoformat() if end_date else None,
+        }
+        response = StreamingHttpResponse(json_document(spec, queryset, chunk_size, header),
+                                         content_type='application/json')
+    response['ETag'] = etag
+    # Clients may keep the body but must revalidate it on every use
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
@@ -3,4 +3,7 @@ from django.apps import AppConfig
 class ParameterConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'parameter'
-    verbose_name = "📊 Stock Reports"
\ No newline at end of file
+    verbose_name = "📊 Stock Reports"
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,318 @@
+"""Benchmarks for the stock report admin pages and CSV exports
+
+seed() fills Master1/ItemParamDet with a reproducible synthetic dataset,
+run() drives each scenario through the Django test client and records
+wall time, query count and peak traced memory, and compare() checks a
+run against a stored baseline. The benchmark_reports management command
+ties them together on a throwaway test database.
+
+concurrent_reads() measures something else: how many stock lookups
+reader threads complete while another thread bulk inserts rows, on a
+SQLite file copy of the dataset under each of CONCURRENCY_PROFILES.
+"""
+import contextlib
+import datetime
+import gc
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from django.contrib.auth import get_user_model
+from django.db import connection, connections, reset_queries, router, transaction
+from django.db.utils import OperationalError
+from django.test import Client, override_settings
+
+from core import tenants
+from core.models import Master1, ItemParamDet
+from core.sqlite import SQLITE_DEFAULTS
+from . import search
+from .cache import stock_cache
+from .models import ParameterFacet, ParameterSearchToken, StockLedger, StockReportView
+
+DEFAULT_SIZES = (10_000, 100_000, 1_000_000)
+ROWS_PER_ITEM = 50
+ROWS_PER_BCN = 5
+SEED_BATCH_SIZE = 5000
+VCH_TYPES = (1, 2, 2, 3, 4, 5, 9, 9)
+
+# Differences below these are treated as noise by compare()
+MIN_REGRESSION = {'seconds': 0.05, 'peak_kb': 256, 'reads_per_second': 5}
+
+# SQLITE_TUNING of each concurrent_reads() run: SQLite's own defaults and core.sqlite's
+CONCURRENCY_PROFILES = {
+    'rollback_journal': {'JOURNAL_MODE': 'DELETE', 'SYNCHRONOUS': 'FULL', 'MMAP_SIZE': 0,
+                         'CACHE_SIZE': -2000, 'TEMP_STORE': 'DEFAULT'},
+    'tuned': SQLITE_DEFAULTS,
+}
+CONCURRENT_READERS = 4
+CONCURRENT_INSERTS = 20_000
+CONCURRENT_INSERT_BATCH = 500
+
+STOCK_REPORT_URL = '/admin/parameter/stockreportview/'
+BCN_SUMMARY_URL = '/admin/parameter/bcnstocksummary/'
+PARAMETER_STOCK_URL = '/admin/parameter/parameterstockview/'
+
+# name: (method, url, data); exports act on every row through select_across
+SCENARIOS = {
+    'stock_report_changelist': ('get', STOCK_REPORT_URL, {'date_range': 'this_year'}),
+    'stock_report_csv': ('post', STOCK_REPORT_URL, {'action': 'export_stock_csv', 'select_across': '1', 'index': '0', '_selected_action': '0'}),
+    'bcn_summary_changelist': ('get', BCN_SUMMARY_URL, {}),
+    'bcn_summary_csv': ('post', BCN_SUMMARY_URL, {'action': 'export_bcn_stock_csv', 'select_across': '1', 'index': '0', '_selected_action': '0'}),
+    'parameter_stock_changelist': ('get', PARAMETER_STOCK_URL, {}),
+    'parameter_stock_csv': ('post', PARAMETER_STOCK_URL, {'action': 'export_parameter_stock_csv', 'select_across': '1', 'index': '0', '_selected_action': '0'}),
+}
+
+
+# Children before the tables their foreign keys point at
+SEEDED_TABLES = (ParameterSearchToken, StockLedger, ParameterFacet, ItemParamDet, Master1)
+
+
+def clear():
+    """Empty the tables seed() fills and those derived from them
+
+    Raw deletes skip the per-row post_delete receivers, which would
+    otherwise make reseeding the larger sizes slower than the runs.
+    """
+    using = router.db_for_write(ItemParamDet)
+    with transaction.atomic(using=using):
+        for model in SEEDED_TABLES:
+            model._base_manager.using(using).all()._raw_delete(using)
+
+
+def seed(rows, seed=0, batch_size=SEED_BATCH_SIZE):
+    """Replace the item and parameter detail tables with rows synthetic rows"""
+    rng = random.Random(seed)
+    clear()
+
+    item_count = max(1, rows // ROWS_PER_ITEM)
+    Master1.objects.bulk_create(
+        [Master1(Code=f'B{i:07d}', Name=f'Item {i}', MasterType='6') for i in range(item_count)],
+        batch_size=batch_size,
+    )
+    item_ids = list(Master1.objects.order_by('pk').values_list('pk', flat=True))
+
+    start = datetime.date(2024, 1, 1)
+    batch = []
+    for n in range(rows):
+        batch.append(ItemParamDet(
+            ItemCode_id=item_ids[n % item_count],
+            Date=start + datetime.timedelta(days=rng.randrange(730)),
+            VchNo=str(n),
+            VchType=rng.choice(VCH_TYPES),
+            Value1=float(rng.randrange(1, 100)),
+            BCN=f'BCN{n // ROWS_PER_BCN:07d}',
+            C1=rng.choice(('Red', 'Blue', 'Green', 'Black')),
+            C2=rng.choice(('S', 'M', 'L', 'XL')),
+        ))
+        if len(batch) >= batch_size:
+            ItemParamDet.assign_parameter_sets(batch)
+            ItemParamDet.objects.bulk_create(batch)
+            batch = []
+    ItemParamDet.assign_parameter_sets(batch)
+    ItemParamDet.objects.bulk_create(batch)
+    ItemParamDet.bump_ledger_version()
+    search.mark_gap()
+
+
+def measure(func):
+    """Run func once and return its wall time, query count and peak memory
+
+    Queries are counted on every configured database, wherever the
+    routers send them.
+    """
+    queries = 0
+
+    def count(execute, sql, params, many, context):
+        nonlocal queries
+        queries += 1
+        return execute(sql, params, many, context)
+
+    reset_queries()
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    with contextlib.ExitStack() as stack:
+        # Wrappers rather than CaptureQueriesContext, which would connect to every database
+        for alias in connections:
+            stack.enter_context(connections[alias].execute_wrapper(count))
+        func()
+    seconds = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'seconds': round(seconds, 4), 'queries': queries, 'peak_kb': peak // 1024}
+
+
+def request_scenario(client, method, url, data):
+    response = getattr(client, method)(url, data)
+    if response.status_code != 200:
+        raise AssertionError(f"{method.upper()} {url} returned {response.status_code}")
+    if response.streaming:
+        for _ in response.streaming_content:
+            pass
+    else:
+        response.content
+
+
+def insert_rows(alias, rows, batch_size, item_ids, stats):
+    """Bulk insert rows into alias, one transaction per batch"""
+    started = time.perf_counter()
+    try:
+        for offset in range(0, rows, batch_size):
+            batch = [
+                ItemParamDet(ItemCode_id=item_ids[n % len(item_ids)], Date=datetime.date(2026, 1, 1),
+                             VchNo=f'C{n}', VchType=2, Value1=1.0, BCN=f'CBCN{n:07d}')
+                for n in range(offset, min(offset + batch_size, rows))
+            ]
+            with transaction.atomic(using=alias):
+                ItemParamDet.objects.using(alias).bulk_create(batch)
+    except OperationalError:
+        stats['insert_errors'] += 1
+    finally:
+        stats['insert_seconds'] = time.perf_counter() - started
+        connections[alias].close()
+
+
+def read_stock(alias, queryset, item_ids, done, stats, lock):
+    """Look up the stock of random items until done is set"""
+    rng = random.Random(threading.get_ident())
+    reads = errors = 0
+    slowest = 0.0
+    try:
+        while not done.is_set():
+            started = time.perf_counter()
+            try:
+                list(queryset.filter(pk=rng.choice(item_ids)))
+            except OperationalError:
+                errors += 1
+                continue
+            reads += 1
+            slowest = max(slowest, time.perf_counter() - started)
+    finally:
+        connections[alias].close()
+        with lock:
+            stats['reads'] += reads
+            stats['read_errors'] += errors
+            stats['max_read_ms'] = max(stats['max_read_ms'], round(slowest * 1000, 1))
+
+
+def concurrent_reads(readers=CONCURRENT_READERS, rows=CONCURRENT_INSERTS, profiles=None):
+    """Measure stock lookups per second while rows are bulk inserted
+
+    The seeded database is copied to a SQLite file per profile of
+    CONCURRENCY_PROFILES; readers threads then look up single item stock
+    figures while one thread inserts rows in CONCURRENT_INSERT_BATCH
+    batches, each in its own transaction.
+
+    Returns:
+        Dict mapping 'concurrent_reads_<profile>' to its measurement
+    """
+    item_ids = list(Master1.objects.values_list('pk', flat=True))
+    directory = tempfile.mkdtemp()
+    results = {}
+    try:
+        for name in profiles or CONCURRENCY_PROFILES:
+            alias = f'benchmark_{name}'
+            tenants.add_database(alias, {
+                'ENGINE': 'django.db.backends.sqlite3',
+                'NAME': os.path.join(directory, f'{name}.sqlite3'),
+                'OPTIONS': {'transaction_mode': 'IMMEDIATE'},
+            })
+            with override_settings(SQLITE_TUNING=CONCURRENCY_PROFILES[name]):
+                connection.ensure_connection()
+                connections[alias].ensure_connection()
+                connection.connection.backup(connections[alias].connection)
+                # Reconnect so the profile's pragmas apply to the copied file
+                connections[alias].close()
+
+                queryset = StockReportView.objects.using(alias).with_stock_figures()
+                stats = dict(reads=0, read_errors=0, max_read_ms=0.0, insert_errors=0)
+                done, lock = threading.Event(), threading.Lock()
+                threads = [
+                    threading.Thread(target=read_stock, args=(alias, queryset, item_ids, done, stats, lock))
+                    for _ in range(readers)
+                ]
+                for thread in threads:
+                    thread.start()
+                insert_rows(alias, rows, CONCURRENT_INSERT_BATCH, item_ids, stats)
+                done.set()
+                for thread in threads:
+                    thread.join()
+            tenants.unregister_database(alias)
+
+            seconds = stats['insert_seconds']
+            results[f'concurrent_reads_{name}'] = {
+                'seconds': round(seconds, 4),
+                'reads_per_second': round(stats['reads'] / seconds, 1) if seconds else 0.0,
+                'inserted_rows_per_second': round(rows / seconds, 1) if seconds else 0.0,
+                'max_read_ms': stats['max_read_ms'],
+                'errors': stats['read_errors'] + stats['insert_errors'],
+            }
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return results
+
+
+def run(sizes=DEFAULT_SIZES, scenarios=None, seed_value=0, stdout=None, readers=None):
+    """Seed each size and measure every scenario on a cold result cache
+
+    With readers, concurrent_reads() is measured too, with that many
+    reader threads.
+
+    Returns:
+        Dict mapping str(size) to {scenario: measurement}
+    """
+    user, _ = get_user_model().objects.get_or_create(
+        username='benchmark', defaults={'is_staff': True, 'is_superuser': True}
+    )
+    client = Client()
+    client.force_login(user)
+
+    results = {}
+    for size in sizes:
+        seed(size, seed_value)
+        results[str(size)] = {}
+        for name in scenarios or SCENARIOS:
+            stock_cache.clear()
+            results[str(size)][name] = measure(lambda: request_scenario(client, *SCENARIOS[name]))
+            if stdout is not None:
+                stdout.write(f"{size:>9} {name:<28} {results[str(size)][name]}")
+        if readers:
+            for name, measurement in concurrent_reads(readers).items():
+                results[str(size)][name] = measurement
+                if stdout is not None:
+                    stdout.write(f"{size:>9} {name:<28} {measurement}")
+    return results
+
+
+def compare(results, baseline, tolerance=0.25):
+    """List regressions of results against a baseline run
+
+    Wall time and peak memory regress when they exceed the baseline by
+    more than tolerance (a fraction) and by more than MIN_REGRESSION; the
+    query count regresses on any increase. Concurrent read throughput
+    regresses when it falls short of the baseline by as much. Sizes and
+    scenarios missing from either run are ignored.
+    """
+    regressions = []
+    for size, scenarios in results.items():
+        for name, current in scenarios.items():
+            previous = baseline.get(size, {}).get(name)
+            if previous is None:
+                continue
+            if 'reads_per_second' in current:
+                metric = 'reads_per_second'
+                allowed = max(previous[metric] * tolerance, MIN_REGRESSION[metric])
+                if current[metric] < previous[metric] - allowed:
+                    regressions.append(f"{size} {name}: {metric} {previous[metric]} -> {current[metric]}")
+                continue
+            if current['queries'] > previous['queries']:
+                regressions.append(f"{size} {name}: queries {previous['queries']} -> {current['queries']}")
+            for metric in ('seconds', 'peak_kb'):
+                allowed = max(previous[metric] * tolerance, MIN_REGRESSION[metric])
+                if current[metric] > previous[metric] + allowed:
+                    regressions.append(f"{size} {name}: {metric} {previous[metric]} -> {current[metric]}")
+    return regressions
@@ -0,0 +1,152 @@
+"""Date-range-aware cache of computed stock report results
+
+Results are kept per process in a bounded LRU, keyed by the active
+profile, a scope naming the computation, the item/BCN set it covers and
+the date range. Every entry remembers the ItemParamDet ledger version it
+was computed at. When the version has moved on, the entry is still served
+if every change since was dated after its end_date, which keeps closed
+historical periods cached; otherwise it is dropped and recomputed.
+
+Entries for open periods (no end_date, or end_date today or later) expire
+after TIMEOUT seconds; closed periods only leave the cache through LRU
+eviction or a change dated inside them.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.exceptions import EmptyResultSet
+from django.utils import timezone
+
+from core.models import ItemParamDet
+from core.tenants import current_profile
+from .reporting import read_version
+
+
+# Defaults for settings.STOCK_REPORT_CACHE
+CACHE_DEFAULTS = {
+    'MAX_ENTRIES': 256,   # results kept per process
+    'TIMEOUT': 300,       # seconds an open-period result is kept
+}
+
+
+def get_cache_settings():
+    """Return the cache settings merged over the defaults"""
+    options = dict(CACHE_DEFAULTS)
+    options.update(getattr(settings, 'STOCK_REPORT_CACHE', {}))
+    return options
+
+
+def queryset_key(queryset):
+    """Return the SQL and parameters of a queryset, or None if it has none"""
+    try:
+        sql, params = queryset.query.sql_with_params()
+    except EmptyResultSet:
+        return None
+    return f"{sql} {params!r}"
+
+
+def as_date(value):
+    return ItemParamDet._meta.get_field('Date').to_python(value) if value else None
+
+
+class CacheEntry:
+    __slots__ = ('value', 'version', 'end_date', 'expires')
+
+    def __init__(self, value, version, end_date, expires):
+        self.value = value
+        self.version = version
+        self.end_date = end_date
+        self.expires = expires
+
+
+class StockResultCache:
+    """Bounded, thread-safe LRU of stock results with ledger-versioned eviction"""
+
+    def __init__(self, max_entries=None, timeout=None):
+        options = get_cache_settings()
+        self.max_entries = max_entries or options['MAX_ENTRIES']
+        self.timeout = timeout if timeout is not None else options['TIMEOUT']
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = dict(hits=0, misses=0, stale=0, expired=0, evictions=0)
+
+    def make_key(self, scope, items, start_date, end_date):
+        """Build the cache key; items is any repr-stable description of the item/BCN set"""
+        profile = current_profile()
+        digest = hashlib.sha1(repr(items).encode()).hexdigest()
+        return (profile.pk if profile else None, scope, digest, as_date(start_date), as_date(end_date))
+
+    def _is_current(self, entry, version, changes):
+        """Whether no change since the entry was computed falls inside its period
+
+        changes are the ledger changes since entry.version, or None if unknown.
+        """
+        if entry.version == version:
+            return True
+        if entry.end_date is None or changes is None:
+            return False
+        end_date = entry.end_date.isoformat()
+        return all(since is not None and since > end_date for since in changes)
+
+    def get_or_compute(self, scope, items, start_date, end_date, compute):
+        """Return the cached result for the key, calling compute() on a miss"""
+        key = self.make_key(scope, items, start_date, end_date)
+        version = ItemParamDet.get_ledger_version()
+        now = time.monotonic()
+
+        # Read the changes since the entry's version before taking the lock,
+        # so lookups in other threads do not wait on the query
+        with self._lock:
+            entry = self._entries.get(key)
+        changes = None
+        if entry is not None and entry.version != version and entry.end_date is not None:
+            changes = ItemParamDet.get_ledger_changes(entry.version)
+
+        with self._lock:
+            current = self._entries.get(key)
+            if current is not None:
+                if current.expires is not None and current.expires <= now:
+                    self._counters['expired'] += 1
+                    del self._entries[key]
+                # changes only describe the entry they were read for
+                elif self._is_current(current, version, changes if current is entry else None):
+                    current.version = version
+                    self._entries.move_to_end(key)
+                    self._counters['hits'] += 1
+                    return current.value
+                else:
+                    self._counters['stale'] += 1
+                    del self._entries[key]
+            self._counters['misses'] += 1
+
+        # Compute outside the lock; reports can take a while
+        value = compute()
+        end = as_date(end_date)
+        closed = end is not None and end < timezone.localdate()
+        # Results read from a lagging reporting copy are as old as the copy
+        entry = CacheEntry(value, read_version(version), end, None if closed else now + self.timeout)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._counters['evictions'] += 1
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Return the hit/miss counters and current size for monitoring"""
+        with self._lock:
+            stats = dict(self._counters, size=len(self._entries), max_entries=self.max_entries)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
+
+
+stock_cache = StockResultCache()
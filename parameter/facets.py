@@ -0,0 +1,122 @@
+"""Precomputed distinct values and row counts for the parameter list filters
+
+Django's own list filters run a SELECT DISTINCT over ItemParamDet for
+every changelist render. ParameterFacet instead keeps one row per
+(field, value) with the number of rows holding it: the signal handlers
+in parameter.signals apply +1/-1 deltas as rows are saved and deleted,
+and rebuild() recounts everything with one GROUP BY per field after bulk
+loads.
+"""
+from collections import Counter
+
+from django.db import router, transaction
+from django.db.models import Count, F
+
+from core.models import Master1, ItemParamDet
+from .models import ParameterFacet
+
+# Lookup paths (as used in ParameterStockAdmin.list_filter) with facets
+FACET_FIELDS = ('VchType', 'ItemCode__Code', 'C1', 'C2', 'BCN')
+VALUE_MAX_LENGTH = ParameterFacet._meta.get_field('value').max_length
+
+
+def as_value(value):
+    """Return the stored form of a field value, or None when it is blank"""
+    if value is None:
+        return None
+    value = str(value).strip()
+    return value[:VALUE_MAX_LENGTH] or None
+
+
+def row_facets(row):
+    """Return the (field, value) pairs of an ItemParamDet row"""
+    values = {field: getattr(row, field, None) for field in FACET_FIELDS if '__' not in field}
+    values['ItemCode__Code'] = (
+        Master1.objects.filter(pk=row.ItemCode_id).values_list('Code', flat=True).first()
+        if row.ItemCode_id else None
+    )
+    return {(field, as_value(value)) for field, value in values.items() if as_value(value)}
+
+
+def apply_deltas(deltas):
+    """Add a Counter of {(field, value): change} to the stored counts
+
+    Facets whose count drops to zero are deleted.
+    """
+    with transaction.atomic(using=router.db_for_write(ParameterFacet)):
+        for (field, value), change in deltas.items():
+            if not change:
+                continue
+            updated = ParameterFacet.objects.filter(field=field, value=value).update(
+                count=F('count') + change
+            )
+            if not updated and change > 0:
+                ParameterFacet.objects.create(field=field, value=value, count=change)
+        touched = [key for key, change in deltas.items() if change < 0]
+        for field, value in touched:
+            ParameterFacet.objects.filter(field=field, value=value, count__lte=0).delete()
+
+
+def row_changed(previous, current):
+    """Apply the facet changes of one row going from previous to current
+
+    Either may be None (a new or deleted row); both are sets from row_facets().
+    """
+    deltas = Counter()
+    for key in previous or ():
+        deltas[key] -= 1
+    for key in current or ():
+        deltas[key] += 1
+    apply_deltas(deltas)
+
+
+def rebuild(batch_size=5000):
+    """Recount every facet from ItemParamDet
+
+    Returns:
+        Number of facets written
+    """
+    facets = []
+    for field in FACET_FIELDS:
+        counts = Counter()
+        rows = ItemParamDet.objects.values(field).annotate(rows=Count('pk')).order_by()
+        for row in rows.iterator(chunk_size=batch_size):
+            value = as_value(row[field])
+            if value:
+                counts[value] += row['rows']
+        facets.extend(
+            ParameterFacet(field=field, value=value, count=count)
+            for value, count in counts.items()
+        )
+    with transaction.atomic(using=router.db_for_write(ParameterFacet)):
+        ParameterFacet.objects.all().delete()
+        ParameterFacet.objects.bulk_create(facets, batch_size=batch_size)
+    return len(facets)
+
+
+def facets_ready():
+    """Whether the facet table has been built (or there is nothing to count)"""
+    return ParameterFacet.objects.exists() or not ItemParamDet.objects.exists()
+
+
+def choices(field, prefix='', limit=None):
+    """Return (value, count) pairs of a field, most common first
+
+    Falls back to counting ItemParamDet directly while the facet table has
+    not been built.
+
+    Args:
+        prefix: Only values starting with this text (case-insensitive)
+        limit: Maximum number of pairs
+    """
+    if facets_ready():
+        facets = ParameterFacet.objects.filter(field=field)
+        lookup = 'value'
+    else:
+        facets = ItemParamDet.objects.exclude(**{f'{field}__isnull': True}).values(field).annotate(count=Count('pk'))
+        lookup = field
+    if prefix:
+        facets = facets.filter(**{f'{lookup}__istartswith': prefix})
+    facets = facets.order_by('-count', lookup).values_list(lookup, 'count')
+    return [(as_value(value), count) for value, count in (facets[:limit] if limit else facets)
+            if as_value(value)]
@@ -0,0 +1,179 @@
+"""Report jobs computed off-request
+
+A ReportJob names one of JOB_KINDS and its params (ISO start_date and
+end_date, optionally the ids of the selected rows, and the company it was
+submitted for). The
+run_report_worker command claims queued jobs and runs each through
+run_job() in a process pool: the CSV is written under
+REPORT_JOBS['RESULT_DIR'] and the job row records progress as it goes,
+so the admin request that submitted it returns at once. A job still
+running RUNNING_TIMEOUT seconds after it started is taken to have lost
+its worker and is failed when the next job is claimed.
+"""
+import csv
+import datetime
+import logging
+import os
+import traceback
+from pathlib import Path
+
+from django.conf import settings
+from django.utils import timezone
+
+from core.models import UserProfile
+from core.tenants import current_profile, using_company
+from . import exports
+from .models import BCNStockSummary, ReportJob, StockReportView
+
+logger = logging.getLogger('parameter.jobs')
+
+# Defaults for settings.REPORT_JOBS
+JOB_DEFAULTS = {
+    'RESULT_DIR': None,         # default BASE_DIR / 'report_jobs'
+    'PROCESSES': 2,             # worker processes run by run_report_worker
+    'POLL_INTERVAL': 2,         # seconds between queue polls when idle
+    'PROGRESS_EVERY': 1000,     # rows written between progress updates
+    'KEEP_DAYS': 7,             # finished jobs and their files are purged after this
+    'RUNNING_TIMEOUT': 6 * 3600,  # seconds after which a running job counts as abandoned
+}
+
+
+def get_job_settings():
+    """Return the job settings merged over the defaults"""
+    options = dict(JOB_DEFAULTS)
+    options.update(getattr(settings, 'REPORT_JOBS', {}))
+    options['RESULT_DIR'] = Path(options['RESULT_DIR'] or Path(settings.BASE_DIR) / 'report_jobs')
+    return options
+
+
+def job_dates(params):
+    """Return the (start_date, end_date) of job params, as dates or None"""
+    return tuple(
+        datetime.date.fromisoformat(params[name]) if params.get(name) else None
+        for name in ('start_date', 'end_date')
+    )
+
+
+def stock_report_csv(params):
+    start_date, end_date = job_dates(params)
+    queryset = StockReportView.objects.filter(MasterType=6).with_stock_figures(start_date, end_date)
+    if params.get('ids'):
+        queryset = queryset.filter(pk__in=params['ids'])
+    queryset = queryset.order_by('Code')
+    # stock_report_rows() leads with a date range line when both dates are set
+    headers = 2 if start_date and end_date else 1
+    return queryset, headers, exports.stock_report_rows(queryset, start_date, end_date)
+
+
+def bcn_summary_csv(params):
+    start_date, end_date = job_dates(params)
+    queryset = BCNStockSummary.get_queryset(start_date, end_date)
+    if params.get('ids'):
+        queryset = queryset.filter(pk__in=params['ids'])
+    return queryset, 1, exports.bcn_stock_rows(queryset)
+
+
+class JobKind:
+    """A kind of report job: its label, download filename and builder
+
+    build(params) returns the queryset being exported (counted for
+    progress), the number of header rows the CSV starts with and an
+    iterable of CSV rows.
+    """
+    __slots__ = ('label', 'filename', 'build')
+
+    def __init__(self, label, filename, build):
+        self.label = label
+        self.filename = filename
+        self.build = build
+
+
+JOB_KINDS = {
+    'stock_report_csv': JobKind("Stock report CSV", 'stock_report.csv', stock_report_csv),
+    'bcn_summary_csv': JobKind("BCN stock summary CSV", 'bcn_stock_report.csv', bcn_summary_csv),
+}
+
+
+def submit(kind, params=None, user=None):
+    """Queue a job and return it"""
+    if kind not in JOB_KINDS:
+        raise ValueError(f"Unknown report job kind {kind!r}")
+    params = dict(params or {})
+    job_dates(params)   # reject malformed dates now rather than in the worker
+    profile = current_profile()
+    if profile is not None:
+        params.setdefault('company', profile.pk)
+    return ReportJob.objects.create(kind=kind, params=params, created_by=user)
+
+
+def result_path(job):
+    return get_job_settings()['RESULT_DIR'] / job.result_file
+
+
+def partial_path(job):
+    """Where run_job() writes the CSV of job until it is complete"""
+    return get_job_settings()['RESULT_DIR'] / f"{job.pk}-{JOB_KINDS[job.kind].filename}.part"
+
+
+def claim_next(worker=''):
+    """Fail abandoned jobs, then claim the oldest queued one (see ReportJob.claim_next)"""
+    timeout = datetime.timedelta(seconds=get_job_settings()['RUNNING_TIMEOUT'])
+    for job in ReportJob.fail_abandoned(timezone.now() - timeout):
+        logger.error("Report job %s was abandoned by worker %s", job.pk, job.worker or '?')
+        if job.kind in JOB_KINDS:
+            partial_path(job).unlink(missing_ok=True)
+    return ReportJob.claim_next(worker)
+
+
+def run_job(job_id):
+    """Compute a claimed job, writing its CSV and recording progress
+
+    Returns:
+        The job's final status
+    """
+    job = ReportJob.objects.get(pk=job_id)
+    options = get_job_settings()
+    directory = options['RESULT_DIR']
+    directory.mkdir(parents=True, exist_ok=True)
+    name = f"{job.pk}-{JOB_KINDS[job.kind].filename}" if job.kind in JOB_KINDS else ''
+    partial = directory / f"{name}.part"
+    written = headers = 0
+    jobs = ReportJob.objects.filter(pk=job.pk)
+    company = job.params.get('company')
+    try:
+        with using_company(UserProfile.get_config(company) if company else None):
+            queryset, headers, rows = JOB_KINDS[job.kind].build(job.params)
+            jobs.update(rows_total=queryset.count())
+            with open(partial, 'w', newline='', encoding='utf-8') as output:
+                writer = csv.writer(output)
+                for row in rows:
+                    writer.writerow(row)
+                    written += 1
+                    # Progress counts data rows only, like rows_total
+                    if written > headers and (written - headers) % options['PROGRESS_EVERY'] == 0:
+                        jobs.update(rows_done=written - headers)
+        os.replace(partial, directory / name)
+    except Exception:
+        logger.exception("Report job %s failed", job.pk)
+        partial.unlink(missing_ok=True)
+        jobs.update(status=ReportJob.FAILED, error=traceback.format_exc(), finished_at=timezone.now())
+        return ReportJob.FAILED
+    jobs.update(status=ReportJob.DONE, rows_done=max(written - headers, 0), result_file=name,
+                finished_at=timezone.now())
+    return ReportJob.DONE
+
+
+def purge_expired(keep_days=None):
+    """Delete finished jobs older than keep_days, with their files
+
+    Returns:
+        Number of jobs deleted
+    """
+    keep_days = get_job_settings()['KEEP_DAYS'] if keep_days is None else keep_days
+    expired = ReportJob.objects.filter(
+        status__in=(ReportJob.DONE, ReportJob.FAILED),
+        finished_at__lt=timezone.now() - datetime.timedelta(days=keep_days),
+    )
+    for job in expired.exclude(result_file=''):
+        result_path(job).unlink(missing_ok=True)
+    return expired.delete()[0]
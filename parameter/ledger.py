@@ -0,0 +1,128 @@
+"""Maintenance of the materialized daily stock ledger (StockLedger)"""
+from django.db import router, transaction
+from django.db.models import F, Sum
+
+from core.models import ItemParamDet
+from core.vouchers import get_voucher_registry
+from .models import StockLedger
+
+
+def row_key(row):
+    """Return the ledger key and deltas contributed by one ItemParamDet row"""
+    vouchers = get_voucher_registry()
+    date = ItemParamDet._meta.get_field('Date').to_python(row.Date)
+    value = float(row.Value1 or 0)
+    vch_type = getattr(row, 'VchType', None)
+    quantity = vouchers.signed_value(vch_type, value)
+    opening_value = quantity if vouchers.is_opening(vch_type) else 0.0
+    return (row.ItemCode_id, row.BCN, date), (quantity, value, opening_value)
+
+
+def _apply_to_series(item_id, bcn, date, quantity, value, opening_value):
+    """Add deltas to one (item, BCN) series on a date and shift later balances
+
+    The day's row is created through get_or_create(), so a concurrent save
+    that creates it first is picked up instead of failing on the unique
+    constraints; a new row then takes over the balances before its date.
+    """
+    entry, created = StockLedger.objects.get_or_create(item_id=item_id, bcn=bcn, date=date)
+    carried = StockLedger.totals(date, inclusive=False, item=item_id, bcn=bcn) if created else (0.0, 0.0, 0.0)
+
+    StockLedger.objects.filter(pk=entry.pk).update(
+        net_quantity=F('net_quantity') + quantity,
+        balance=F('balance') + carried[0] + quantity,
+        running_value=F('running_value') + carried[1] + value,
+        running_opening_value=F('running_opening_value') + carried[2] + opening_value,
+    )
+
+    StockLedger.objects.filter(item_id=item_id, bcn=bcn, date__gt=date).update(
+        balance=F('balance') + quantity,
+        running_value=F('running_value') + value,
+        running_opening_value=F('running_opening_value') + opening_value,
+    )
+
+
+def apply_change(key, deltas, sign=1):
+    """Apply one row's contribution (sign=-1 to remove it) to the ledger"""
+    item_id, bcn, date = key
+    if item_id is None or date is None:
+        return
+    quantity, value, opening_value = (sign * delta for delta in deltas)
+    if not (quantity or value or opening_value):
+        return
+    with transaction.atomic(using=router.db_for_write(StockLedger)):
+        _apply_to_series(item_id, None, date, quantity, value, opening_value)
+        if bcn:
+            _apply_to_series(item_id, bcn, date, quantity, value, opening_value)
+
+
+def rebuild(batch_size=5000, since=None):
+    """Rebuild the ledger from ItemParamDet
+
+    With since, only rows dated on or after it are rewritten; running
+    balances carry on from the latest rows before that date.
+
+    Returns:
+        Number of ledger rows written
+    """
+    vouchers = get_voucher_registry()
+    daily = dict(
+        net_quantity=vouchers.signed_quantity(),
+        total_value=Sum('Value1'),
+        opening_value=vouchers.signed_quantity(vouchers.opening_filter()),
+    )
+    source = ItemParamDet.objects.all()
+    carried = {}
+    if since:
+        source = source.filter(Date__gte=since)
+        for by_bcn in (False, True):
+            for row in StockLedger.latest_rows(since, inclusive=False, by_bcn=by_bcn).values(
+                'item_id', 'bcn', 'balance', 'running_value', 'running_opening_value'
+            ):
+                carried[(row['item_id'], row['bcn'])] = (
+                    row['balance'], row['running_value'], row['running_opening_value']
+                )
+
+    item_days = (
+        source.values('ItemCode_id', 'Date')
+        .annotate(**daily).order_by('ItemCode_id', 'Date')
+    )
+    bcn_days = (
+        source.filter(BCN__isnull=False).exclude(BCN='')
+        .values('ItemCode_id', 'BCN', 'Date')
+        .annotate(**daily).order_by('ItemCode_id', 'BCN', 'Date')
+    )
+
+    written = 0
+    with transaction.atomic(using=router.db_for_write(StockLedger)):
+        if since:
+            StockLedger.objects.filter(date__gte=since).delete()
+        else:
+            StockLedger.objects.all().delete()
+        for rows in (item_days, bcn_days):
+            batch = []
+            series = None
+            for row in rows.iterator(chunk_size=batch_size):
+                key = (row['ItemCode_id'], row.get('BCN'))
+                if key != series:
+                    series = key
+                    balance, running_value, running_opening_value = carried.get(key, (0.0, 0.0, 0.0))
+                balance += row['net_quantity'] or 0
+                running_value += row['total_value'] or 0
+                running_opening_value += row['opening_value'] or 0
+                batch.append(StockLedger(
+                    item_id=row['ItemCode_id'], bcn=row.get('BCN'),
+                    date=ItemParamDet._meta.get_field('Date').to_python(row['Date']),
+                    net_quantity=row['net_quantity'] or 0,
+                    balance=balance, running_value=running_value,
+                    running_opening_value=running_opening_value,
+                ))
+                if len(batch) >= batch_size:
+                    StockLedger.objects.bulk_create(batch)
+                    written += len(batch)
+                    batch = []
+            StockLedger.objects.bulk_create(batch)
+            written += len(batch)
+    # Ledger-backed figures from since onwards may have changed
+    ItemParamDet.bump_ledger_version(since)
+    return written
@@ -0,0 +1,69 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+
+from parameter import benchmarks
+from reports.testing import TEST_CACHES
+
+
+class Command(BaseCommand):
+    help = "Benchmark the stock report admin pages and CSV exports on synthetic data"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', type=int, nargs='+', default=list(benchmarks.DEFAULT_SIZES),
+            help="ItemParamDet row counts to benchmark",
+        )
+        parser.add_argument(
+            '--scenario', action='append', choices=sorted(benchmarks.SCENARIOS),
+            help="Only run this scenario (repeatable)",
+        )
+        parser.add_argument(
+            '--output', default='benchmark_results.json',
+            help="JSON file the measurements are written to",
+        )
+        parser.add_argument(
+            '--baseline',
+            help="JSON file from an earlier run; exit with an error on regressions",
+        )
+        parser.add_argument(
+            '--tolerance', type=float, default=0.25,
+            help="Allowed slowdown and memory growth over the baseline, as a fraction",
+        )
+        parser.add_argument(
+            '--seed', type=int, default=0,
+            help="Random seed of the synthetic dataset",
+        )
+        parser.add_argument(
+            '--concurrency', type=int, nargs='?', const=benchmarks.CONCURRENT_READERS, default=None,
+            metavar='READERS',
+            help="Also measure SQLite reads during bulk inserts with this many reader threads",
+        )
+
+    def handle(self, *args, **options):
+        # Seeding replaces the item tables, so work on a throwaway test database,
+        # with every read kept on it and the site's cache left alone
+        isolated = override_settings(CACHES=TEST_CACHES, REPORTING_DATABASE={'ALIAS': None},
+                                     REPORT_TENANTS={'DATABASE': None})
+        with isolated:
+            setup_test_environment(debug=False)
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+            try:
+                results = benchmarks.run(options['sizes'], options['scenario'], options['seed'], self.stdout,
+                                         readers=options['concurrency'])
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+                teardown_test_environment()
+
+        with open(options['output'], 'w') as output:
+            json.dump(results, output, indent=2, sort_keys=True)
+        self.stdout.write(f"Results written to {options['output']}")
+
+        if options['baseline']:
+            with open(options['baseline']) as baseline:
+                regressions = benchmarks.compare(results, json.load(baseline), options['tolerance'])
+            if regressions:
+                raise CommandError("Benchmark regressions:\n" + "\n".join(regressions))
+            self.stdout.write(self.style.SUCCESS("No regressions against the baseline"))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from parameter import facets
+
+
+class Command(BaseCommand):
+    help = "Recount the distinct values shown by the parameter stock list filters"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=5000,
+            help="Number of facets written per batch",
+        )
+
+    def handle(self, *args, **options):
+        written = facets.rebuild(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {written} list filter facets"))
@@ -0,0 +1,23 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+
+from parameter import search
+
+
+class Command(BaseCommand):
+    help = "Rebuild the token index used by the parameter stock search"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=5000,
+            help="Number of rows indexed per batch",
+        )
+        parser.add_argument(
+            '--since', type=datetime.date.fromisoformat,
+            help="Only reindex rows dated on or after this date (YYYY-MM-DD)",
+        )
+
+    def handle(self, *args, **options):
+        written = search.rebuild(batch_size=options['batch_size'], since=options['since'])
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt search index with {written} tokens"))
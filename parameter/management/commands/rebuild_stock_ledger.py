@@ -0,0 +1,23 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+
+from parameter import ledger
+
+
+class Command(BaseCommand):
+    help = "Rebuild the materialized daily stock ledger from ItemParamDet"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=5000,
+            help="Number of ledger rows written per bulk insert",
+        )
+        parser.add_argument(
+            '--since', type=datetime.date.fromisoformat,
+            help="Only rewrite entries dated on or after this date (YYYY-MM-DD)",
+        )
+
+    def handle(self, *args, **options):
+        written = ledger.rebuild(batch_size=options['batch_size'], since=options['since'])
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt stock ledger with {written} rows"))
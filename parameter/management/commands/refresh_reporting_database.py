@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from core.models import ItemParamDet
+from parameter import reporting
+
+
+class Command(BaseCommand):
+    help = "Copy the database to the reporting alias that serves the stock reports"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--mark-only', action='store_true',
+            help="Only record the reporting copy as current (it is replicated by other means)",
+        )
+
+    def handle(self, *args, **options):
+        alias = reporting.configured_alias()
+        if alias is None:
+            raise CommandError("REPORTING_DATABASE['ALIAS'] does not name a configured database")
+
+        # Read before copying: changes made during the copy count as not copied
+        version = ItemParamDet.get_ledger_version()
+        started = time.time()
+        if not options['mark_only']:
+            vendors = {connections[DEFAULT_DB_ALIAS].vendor, connections[alias].vendor}
+            if vendors != {'sqlite'}:
+                raise CommandError(
+                    "Only SQLite databases can be copied; replicate the database with its "
+                    "own tools and run this command with --mark-only"
+                )
+            reporting.copy_sqlite(DEFAULT_DB_ALIAS, alias)
+        reporting.mark_refreshed(alias, version, started)
+        self.stdout.write(self.style.SUCCESS(
+            f"Reporting database '{alias}' is current as of ledger version {version}"
+        ))
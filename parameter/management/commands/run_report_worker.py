@@ -0,0 +1,95 @@
+import multiprocessing
+import os
+import socket
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.utils import timezone
+
+from parameter import jobs, worker
+from parameter.models import ReportJob
+
+# Seconds between purges of expired job results
+PURGE_INTERVAL = 3600
+
+
+class Command(BaseCommand):
+    help = "Run queued report jobs in a pool of worker processes"
+
+    def add_arguments(self, parser):
+        options = jobs.get_job_settings()
+        parser.add_argument(
+            '--processes', type=int, default=options['PROCESSES'],
+            help="Worker processes; 0 runs jobs one at a time in this process",
+        )
+        parser.add_argument(
+            '--poll-interval', type=float, default=options['POLL_INTERVAL'],
+            help="Seconds between queue polls when idle",
+        )
+        parser.add_argument(
+            '--once', action='store_true',
+            help="Exit once the queue is empty instead of polling for more jobs",
+        )
+
+    def handle(self, *args, **options):
+        self.name = f"{socket.gethostname()}:{os.getpid()}"
+        self.last_purge = 0.0
+        if options['processes'] > 0:
+            self.run_pool(options)
+        else:
+            self.run_inline(options)
+
+    def purge(self):
+        if time.monotonic() - self.last_purge >= PURGE_INTERVAL:
+            self.last_purge = time.monotonic()
+            purged = jobs.purge_expired()
+            if purged:
+                self.stdout.write(f"Purged {purged} expired jobs")
+
+    def finished(self, job_id, status):
+        self.stdout.write(f"Job {job_id}: {status}")
+
+    def run_inline(self, options):
+        while True:
+            self.purge()
+            job = jobs.claim_next(self.name)
+            if job is not None:
+                self.finished(job.pk, jobs.run_job(job.pk))
+            elif options['once']:
+                return
+            else:
+                time.sleep(options['poll_interval'])
+
+    def run_pool(self, options):
+        processes = options['processes']
+        # Spawned processes open their own connections; don't share this one's
+        connections.close_all()
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(processes, mp_context=context, initializer=worker.init_worker) as pool:
+            running = {}
+            while True:
+                self.purge()
+                while len(running) < processes:
+                    job = jobs.claim_next(self.name)
+                    if job is None:
+                        break
+                    running[pool.submit(worker.run_job, job.pk)] = job.pk
+                if not running:
+                    if options['once']:
+                        return
+                    time.sleep(options['poll_interval'])
+                    continue
+                done, _ = wait(running, timeout=options['poll_interval'], return_when=FIRST_COMPLETED)
+                for future in done:
+                    job_id = running.pop(future)
+                    try:
+                        status = future.result()
+                    except Exception as exc:
+                        # The process died before the job could record its own failure
+                        ReportJob.objects.filter(pk=job_id).update(
+                            status=ReportJob.FAILED, error=repr(exc), finished_at=timezone.now()
+                        )
+                        status = ReportJob.FAILED
+                    self.finished(job_id, status)
@@ -0,0 +1,51 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:29
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_rename_item_itemparamdet_itemcode'),
+        ('parameter', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BCNStockSummary',
+            fields=[
+                ('bcn', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('item_code', models.CharField(max_length=20)),
+                ('item_name', models.CharField(max_length=100)),
+                ('parameters', models.CharField(max_length=255)),
+                ('opening_stock', models.FloatField(default=0)),
+                ('closing_stock', models.FloatField(default=0)),
+                ('movement', models.FloatField(default=0)),
+            ],
+            options={
+                'verbose_name': 'BCN-wise Stock Summary',
+                'verbose_name_plural': 'BCN-wise Stock Summary',
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='StockLedger',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bcn', models.CharField(blank=True, max_length=50, null=True)),
+                ('date', models.DateField()),
+                ('net_quantity', models.FloatField(default=0)),
+                ('balance', models.FloatField(default=0)),
+                ('running_value', models.FloatField(default=0)),
+                ('running_opening_value', models.FloatField(default=0)),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_ledger', to='core.master1')),
+            ],
+            options={
+                'verbose_name': 'Stock Ledger Entry',
+                'verbose_name_plural': 'Stock Ledger',
+                'indexes': [models.Index(fields=['bcn', 'date'], name='stock_ledger_bcn_date')],
+                'constraints': [models.UniqueConstraint(fields=('item', 'bcn', 'date'), name='stock_ledger_item_bcn_date')],
+            },
+        ),
+    ]
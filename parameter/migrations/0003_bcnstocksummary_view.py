@@ -0,0 +1,78 @@
+# Generated by Django 5.2.4 on 2026-10-17 13:40
+
+from django.db import migrations
+
+
+def parameter_list(concat):
+    """SQL joining the non-blank C1-C5 of the sample row with ' | '"""
+    parts = [
+        f"CASE WHEN TRIM(COALESCE(d.C{i}, '')) <> '' THEN {concat(repr(' | '), f'd.C{i}')} ELSE '' END"
+        for i in range(1, 6)
+    ]
+    joined = parts[0]
+    for part in parts[1:]:
+        joined = concat(joined, part)
+    return f"COALESCE(NULLIF(SUBSTRING({joined}, 4, 300), ''), 'No Parameters')"
+
+
+def view_sql(vendor):
+    if vendor == 'microsoft':
+        concat = lambda left, right: f"({left} + {right})"
+    else:
+        concat = lambda left, right: f"({left} || {right})"
+    return f"""
+        CREATE VIEW parameter_bcnstocksummary AS
+        SELECT
+            s.BCN AS bcn,
+            m.Code AS item_code,
+            CASE WHEN m.MasterType = '6' THEN m.Name ELSE 'Unknown Item' END AS item_name,
+            {parameter_list(concat)} AS parameters
+        FROM (
+            SELECT BCN, MIN(id) AS sample_id
+            FROM core_itemparamdet
+            WHERE BCN IS NOT NULL AND BCN <> ''
+            GROUP BY BCN
+        ) s
+        JOIN core_itemparamdet d ON d.id = s.sample_id
+        JOIN core_master1 m ON m.id = d.ItemCode_id
+    """
+
+
+def create_view(apps, schema_editor):
+    schema_editor.execute(view_sql(schema_editor.connection.vendor))
+
+
+def drop_view(apps, schema_editor):
+    schema_editor.execute("DROP VIEW IF EXISTS parameter_bcnstocksummary")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_syncstate'),
+        ('parameter', '0002_stockledger'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='bcnstocksummary',
+            options={'managed': False, 'ordering': ('bcn',), 'verbose_name': 'BCN-wise Stock Summary', 'verbose_name_plural': 'BCN-wise Stock Summary'},
+        ),
+        migrations.RemoveField(
+            model_name='bcnstocksummary',
+            name='closing_stock',
+        ),
+        migrations.RemoveField(
+            model_name='bcnstocksummary',
+            name='movement',
+        ),
+        migrations.RemoveField(
+            model_name='bcnstocksummary',
+            name='opening_stock',
+        ),
+        migrations.AlterModelTable(
+            name='bcnstocksummary',
+            table='parameter_bcnstocksummary',
+        ),
+        migrations.RunPython(create_view, drop_view),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.4 on 2026-10-17 18:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_syncstate'),
+        ('parameter', '0003_bcnstocksummary_view'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ParameterSearchToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(max_length=50)),
+                ('row', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_tokens', to='core.itemparamdet')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['token', 'row'], name='search_token_token_row')],
+                'constraints': [models.UniqueConstraint(fields=('row', 'token'), name='search_token_row_token')],
+            },
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.4 on 2026-10-17 19:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parameter', '0004_parametersearchtoken'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ParameterFacet',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('field', models.CharField(max_length=30)),
+                ('value', models.CharField(max_length=100)),
+                ('count', models.IntegerField(default=0)),
+            ],
+            options={
+                'ordering': ('field', 'value'),
+                'constraints': [models.UniqueConstraint(fields=('field', 'value'), name='parameter_facet_field_value')],
+            },
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.2.4 on 2026-10-17 20:10
+
+from importlib import import_module
+
+from django.db import migrations
+
+previous = import_module('parameter.migrations.0003_bcnstocksummary_view')
+
+
+def view_sql(vendor):
+    if vendor == 'microsoft':
+        concat = lambda left, right: f"({left} + {right})"
+    else:
+        concat = lambda left, right: f"({left} || {right})"
+    # Rows not yet linked to a ParameterSet fall back to joining C1-C5
+    return f"""
+        CREATE VIEW parameter_bcnstocksummary AS
+        SELECT
+            s.BCN AS bcn,
+            m.Code AS item_code,
+            CASE WHEN m.MasterType = '6' THEN m.Name ELSE 'Unknown Item' END AS item_name,
+            COALESCE(p.label, {previous.parameter_list(concat)}) AS parameters
+        FROM (
+            SELECT BCN, MIN(id) AS sample_id
+            FROM core_itemparamdet
+            WHERE BCN IS NOT NULL AND BCN <> ''
+            GROUP BY BCN
+        ) s
+        JOIN core_itemparamdet d ON d.id = s.sample_id
+        JOIN core_master1 m ON m.id = d.ItemCode_id
+        LEFT JOIN core_parameterset p ON p.id = d.ParamSet_id
+    """
+
+
+def replace_view(sql):
+    def operation(apps, schema_editor):
+        schema_editor.execute("DROP VIEW IF EXISTS parameter_bcnstocksummary")
+        schema_editor.execute(sql(schema_editor.connection.vendor))
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_parameterset'),
+        ('parameter', '0005_parameterfacet'),
+    ]
+
+    operations = [
+        migrations.RunPython(replace_view(view_sql), replace_view(previous.view_sql)),
+    ]
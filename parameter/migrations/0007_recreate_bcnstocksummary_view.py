@@ -0,0 +1,28 @@
+# Generated by Django 5.2.4 on 2026-10-17 21:05
+
+from importlib import import_module
+
+from django.db import migrations
+
+view = import_module('parameter.migrations.0006_bcnstocksummary_parameterset')
+
+
+def create_view(apps, schema_editor):
+    schema_editor.execute(view.view_sql(schema_editor.connection.vendor))
+
+
+def drop_view(apps, schema_editor):
+    schema_editor.execute("DROP VIEW IF EXISTS parameter_bcnstocksummary")
+
+
+class Migration(migrations.Migration):
+    """Recreate the view dropped while core 0009 retyped ItemParamDet columns"""
+
+    dependencies = [
+        ('core', '0010_itemparamdet_typed_columns'),
+        ('parameter', '0006_bcnstocksummary_parameterset'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_view, drop_view),
+    ]
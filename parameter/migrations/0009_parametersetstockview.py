@@ -0,0 +1,27 @@
+# Generated by Django 5.2.4 on 2026-10-17 23:00
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_itemparamdet_typed_columns'),
+        ('parameter', '0008_reportjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ParameterSetStockView',
+            fields=[
+            ],
+            options={
+                'verbose_name': 'Parameter Set Stock',
+                'verbose_name_plural': 'Parameter Set Stock',
+                'proxy': True,
+                'indexes': [],
+                'constraints': [],
+            },
+            bases=('core.parameterset',),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.4 on 2026-10-17 11:40
+
+from django.db import migrations, models
+
+
+def drop_duplicate_item_days(apps, schema_editor):
+    """Keep one item-wide row per item and day
+
+    Concurrent saves could insert the same item-wide day twice; every later
+    update then changed both rows alike, so the first one holds the figures.
+    """
+    StockLedger = apps.get_model('parameter', 'StockLedger')
+    rows = StockLedger.objects.using(schema_editor.connection.alias).filter(bcn__isnull=True)
+    duplicated = (
+        rows.values('item_id', 'date').annotate(first=models.Min('pk'), rows=models.Count('pk'))
+        .filter(rows__gt=1)
+    )
+    for day in duplicated:
+        rows.filter(item_id=day['item_id'], date=day['date']).exclude(pk=day['first']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_itemparamdet_typed_columns'),
+        ('parameter', '0009_parametersetstockview'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_duplicate_item_days, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='stockledger',
+            constraint=models.UniqueConstraint(condition=models.Q(('bcn__isnull', True)), fields=('item', 'date'), name='stock_ledger_item_date'),
+        ),
+    ]
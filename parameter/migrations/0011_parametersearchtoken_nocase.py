@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-17 14:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parameter', '0010_stockledger_item_date'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='parametersearchtoken',
+            name='token',
+            field=models.CharField(db_collation='NOCASE', max_length=50),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.4 on 2026-10-17 16:30
+
+from django.db import migrations, models
+
+
+def record_unbuilt_index(apps, schema_editor):
+    """Mark the index incomplete where rows exist but it was never built"""
+    alias = schema_editor.connection.alias
+    ItemParamDet = apps.get_model('core', 'ItemParamDet')
+    ParameterSearchToken = apps.get_model('parameter', 'ParameterSearchToken')
+    SearchIndexGap = apps.get_model('parameter', 'SearchIndexGap')
+    if (ItemParamDet.objects.using(alias).exists()
+            and not ParameterSearchToken.objects.using(alias).exists()):
+        SearchIndexGap.objects.using(alias).create(since=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_syncstate_items_synced_at'),
+        ('parameter', '0011_parametersearchtoken_nocase'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchIndexGap',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('since', models.DateField(blank=True, null=True)),
+            ],
+        ),
+        migrations.RunPython(record_unbuilt_index, migrations.RunPython.noop),
+    ]
@@ -1,89 +1,258 @@
+from django.conf import settings
 from django.db import models
-from django.db.models import Sum, Case, When, F, FloatField, Q, Value, CharField
-from django.db.models.functions import Concat
+from django.db.models import Sum, Case, When, F, FloatField, Q, Value, CharField, Min, Exists, OuterRef, Count, Subquery, ExpressionWrapper
+from django.db.models.functions import Coalesce, Concat
 from django.utils import timezone
-from core.models import Master1, ItemParamDet
+from core.models import Master1, ItemParamDet, ParameterSet
+from core.vouchers import get_voucher_registry
+
+
+def stock_status_counts(rows, field='closing_stock'):
+    """Count rows by the sign of their closing stock
+
+    A QuerySet (annotated with field) is counted with one conditional
+    aggregate query; a list of objects is counted in a single pass.
+
+    Returns:
+        Dict with total_items, positive_stock, zero_stock and negative_stock
+    """
+    if isinstance(rows, models.QuerySet):
+        return rows.aggregate(
+            total_items=Count('pk'),
+            positive_stock=Count('pk', filter=Q(**{f'{field}__gt': 0})),
+            zero_stock=Count('pk', filter=Q(**{field: 0})),
+            negative_stock=Count('pk', filter=Q(**{f'{field}__lt': 0})),
+        )
+
+    counts = dict(total_items=0, positive_stock=0, zero_stock=0, negative_stock=0)
+    for row in rows:
+        value = getattr(row, field) or 0
+        counts['total_items'] += 1
+        if value > 0:
+            counts['positive_stock'] += 1
+        elif value == 0:
+            counts['zero_stock'] += 1
+        else:
+            counts['negative_stock'] += 1
+    return counts
+
+
+def stock_status(closing):
+    """Status label for a closing stock figure"""
+    if closing > 0:
+        return "✅ In Stock"
+    elif closing == 0:
+        return "⚠️ Zero Stock"
+    else:
+        return "❌ Negative Stock"
+
+
+class BCNStockSummaryQuerySet(models.QuerySet):
+    """QuerySet for BCN summaries with lazily computed stock figures"""
+
+    def with_stock_figures(self, start_date=None, end_date=None, use_ledger=False):
+        """Annotate opening_stock, closing_stock and movement for a date range
+
+        Each figure is a correlated subquery on the BCN, so only the rows a
+        page actually fetches are computed. With use_ledger the figures are
+        read from the materialized StockLedger instead of ItemParamDet.
+
+        Args:
+            start_date: Optional start date filter
+            end_date: Optional end date filter
+            use_ledger: Read the figures from the materialized StockLedger
+        """
+        if use_ledger:
+            return self._with_ledger_figures(start_date, end_date)
+
+        vouchers = get_voucher_registry()
+
+        def figure(condition):
+            rows = (
+                ItemParamDet.objects.filter(condition, BCN=OuterRef('bcn'))
+                .values('BCN').annotate(total=vouchers.signed_quantity()).values('total')
+            )
+            return Coalesce(Subquery(rows, output_field=FloatField()), Value(0.0))
+
+        movement_filter = ~vouchers.opening_filter()
+        if start_date:
+            movement_filter &= Q(Date__gte=start_date)
+        if end_date:
+            movement_filter &= Q(Date__lte=end_date)
+
+        return self.annotate(
+            opening_stock=figure(Q(Date__lt=start_date) if start_date else Q()),
+            closing_stock=figure(Q(Date__lte=end_date) if end_date else Q()),
+            movement=figure(movement_filter),
+        )
+
+    def with_snapshot_figures(self, start_date=None, end_date=None, snapshot=None):
+        """Evaluate the queryset with figures computed from a StockSnapshot
+
+        Returns a list, not a queryset. snapshot defaults to the
+        process-wide parameter.snapshot.current_snapshot().
+        """
+        from .snapshot import current_snapshot
+        snapshot = snapshot or current_snapshot()
+        rows = list(self)
+        figures = snapshot.bcn_figures([row.bcn for row in rows], start_date, end_date)
+        for row in rows:
+            row.opening_stock, row.closing_stock, row.movement = figures[row.bcn]
+        return rows
+
+    def _with_ledger_figures(self, start_date=None, end_date=None):
+        def balance(date, inclusive, field='balance'):
+            rows = (
+                StockLedger.latest_rows(date, inclusive, by_bcn=True).filter(bcn=OuterRef('bcn'))
+                .values('bcn').annotate(total=Sum(field)).values('total')
+            )
+            return Coalesce(Subquery(rows, output_field=FloatField()), Value(0.0))
+
+        end_balance = balance(end_date, True)
+        end_opening = balance(end_date, True, 'running_opening_value')
+        if start_date:
+            start_balance = balance(start_date, False)
+            start_opening = balance(start_date, False, 'running_opening_value')
+            opening = start_balance
+        else:
+            start_balance = start_opening = Value(0.0)
+            # Without a start date the opening figure covers the whole history
+            opening = balance(None, True)
+
+        return self.annotate(
+            opening_stock=opening,
+            closing_stock=end_balance,
+            movement=ExpressionWrapper(
+                (end_balance - start_balance) - (end_opening - start_opening),
+                output_field=FloatField()
+            ),
+        )
 
 
 class BCNStockSummary(models.Model):
-    """Model to represent BCN-wise stock summary"""
+    """Model to represent BCN-wise stock summary
+
+    Backed by the parameter_bcnstocksummary database view, which holds one
+    row per BCN with the item and parameters of its first ItemParamDet
+    row. Stock figures are added by BCNStockSummaryQuerySet.with_stock_figures.
+    """
     bcn = models.CharField(max_length=50, primary_key=True)
     item_code = models.CharField(max_length=20)
     item_name = models.CharField(max_length=100)
     parameters = models.CharField(max_length=255)
-    opening_stock = models.FloatField(default=0)
-    closing_stock = models.FloatField(default=0)
-    movement = models.FloatField(default=0)
+
+    objects = BCNStockSummaryQuerySet.as_manager()
     
     class Meta:
         managed = False
+        db_table = 'parameter_bcnstocksummary'
+        ordering = ('bcn',)
         verbose_name = 'BCN-wise Stock Summary'
         verbose_name_plural = 'BCN-wise Stock Summary'
     
     @classmethod
-    def get_queryset(cls, start_date=None, end_date=None):
-        """Generate a queryset of BCN stock summaries"""
-        # Get distinct BCNs from ItemParamDet
-        bcn_query = ItemParamDet.objects.filter(BCN__isnull=False).exclude(BCN='').values_list('BCN', flat=True).distinct()
-        
-        # Create a list to hold our summary objects
-        summaries = []
-        
-        for bcn in bcn_query:
-            # Get a sample record to extract item and parameter info
-            sample = ItemParamDet.objects.filter(BCN=bcn).first()
-            if not sample:
-                continue
-                
-            # Get item details
-            item_code = sample.ItemCode
-            item_name = 'Unknown Item'
-            try:
-                item = Master1.objects.filter(Code=item_code, MasterType=6).first()
-                if item:
-                    item_name = item.Name
-            except Exception:
-                pass
-                
-            # Get parameters
-            params = []
-            for i in range(1, 6):
-                param_value = getattr(sample, f'C{i}', None)
-                if param_value and param_value.strip():
-                    params.append(param_value)
-            parameters = ' | '.join(params) if params else 'No Parameters'
-            
-            # Calculate stock values
-            opening_stock = ParameterStockView.get_opening_stock_by_bcn(bcn, start_date, end_date)
-            closing_stock = ParameterStockView.get_closing_stock_by_bcn(bcn, start_date, end_date)
-            movement = ParameterStockView.get_movement_by_bcn(bcn, start_date, end_date)
-            
-            # Create a summary object
-            summary = cls(bcn=bcn, item_code=item_code, item_name=item_name, 
-                          parameters=parameters, opening_stock=opening_stock,
-                          closing_stock=closing_stock, movement=movement)
-            summaries.append(summary)
-            
-        return summaries
+    def get_queryset(cls, start_date=None, end_date=None, use_ledger=False):
+        """Return a lazy queryset of BCN stock summaries for a date range"""
+        return cls.objects.with_stock_figures(start_date, end_date, use_ledger)
+
+
+class StockReportQuerySet(models.QuerySet):
+    """QuerySet for item masters with bulk stock calculations"""
+
+    # Lookup path from the model to its ItemParamDet rows
+    rows_prefix = 'itemparamdet__'
+    # StockSnapshot method giving the figures per primary key
+    snapshot_figures = 'item_figures'
+
+    def with_stock_figures(self, start_date=None, end_date=None):
+        """Annotate every item with opening, closing, movement and status
+
+        Produces the same figures as StockReportView.get_opening_stock,
+        get_closing_stock, get_movement and get_stock_status, but for all
+        rows in one SQL statement.
+
+        Args:
+            start_date: Optional start date filter
+            end_date: Optional end date filter
+        """
+        vouchers = get_voucher_registry()
+        prefix = self.rows_prefix
+        date_filter = Q()
+        if start_date:
+            date_filter &= Q(**{f'{prefix}Date__gte': start_date})
+        if end_date:
+            date_filter &= Q(**{f'{prefix}Date__lte': end_date})
+        opening = vouchers.opening_filter(prefix)
+
+        return self.annotate(
+            opening_stock=Coalesce(
+                vouchers.signed_quantity(date_filter & opening, prefix),
+                Value(0.0), output_field=FloatField()
+            ),
+            closing_stock=Coalesce(
+                vouchers.signed_quantity(date_filter, prefix),
+                Value(0.0), output_field=FloatField()
+            ),
+            movement=Coalesce(
+                vouchers.signed_quantity(date_filter & ~opening, prefix),
+                Value(0.0), output_field=FloatField()
+            ),
+        ).annotate(
+            stock_status=Case(
+                When(closing_stock__gt=0, then=Value("✅ In Stock")),
+                When(closing_stock=0, then=Value("⚠️ Zero Stock")),
+                default=Value("❌ Negative Stock"),
+                output_field=CharField()
+            )
+        )
+
+
+    def with_snapshot_figures(self, start_date=None, end_date=None, snapshot=None):
+        """Evaluate the queryset with figures computed from a StockSnapshot
+
+        Gives the same figures as with_stock_figures without aggregating
+        in SQL. Returns a list, not a queryset. snapshot defaults to the
+        process-wide parameter.snapshot.current_snapshot().
+        """
+        from .snapshot import current_snapshot
+        snapshot = snapshot or current_snapshot()
+        rows = list(self)
+        figures = getattr(snapshot, self.snapshot_figures)([row.pk for row in rows], start_date, end_date)
+        for row in rows:
+            row.opening_stock, row.closing_stock, row.movement = figures[row.pk]
+            row.stock_status = stock_status(row.closing_stock)
+        return rows
+
+
+class ParameterSetStockQuerySet(StockReportQuerySet):
+    """StockReportQuerySet figures grouped by parameter set instead of item"""
+    rows_prefix = 'rows__'
+    snapshot_figures = 'parameter_set_figures'
+
 
 # Proxy models to create separate admin interfaces
 class StockReportView(Master1):
     """Proxy model for stock reporting"""
+    objects = StockReportQuerySet.as_manager()
+
     class Meta:
         proxy = True
         verbose_name = "Stock Report"
         verbose_name_plural = "Stock Reports"
         app_label = 'parameter'
 
-    def get_opening_stock(self, start_date=None, end_date=None):
-        """Calculate opening stock for this item (VchType = 1)
+    def get_opening_stock(self, start_date=None, end_date=None, use_ledger=False):
+        """Calculate opening stock for this item (opening balance vouchers)
         
         Args:
             start_date: Optional start date filter
             end_date: Optional end date filter
+            use_ledger: Read the figure from the materialized StockLedger
         """
+        if use_ledger:
+            return self.get_ledger_figures(start_date, end_date)[0]
         try:
-            query = ItemParamDet.objects.filter(ItemCode=self, VchType=1)
+            query = ItemParamDet.objects.filter(get_voucher_registry().opening_filter(), ItemCode=self)
             
             # Apply date filters if provided
             if start_date:
@@ -91,18 +260,21 @@ class StockReportView(Master1):
             if end_date:
                 query = query.filter(Date__lte=end_date)
                 
-            opening_stock = query.aggregate(Sum('Value1'))['Value1__sum'] or 0
+            opening_stock = query.aggregate(total=get_voucher_registry().signed_quantity())['total'] or 0
             return float(opening_stock)
         except (ValueError, TypeError):
             return 0.0
 
-    def get_closing_stock(self, start_date=None, end_date=None):
-        """Calculate closing stock for this item (all transactions)
+    def get_closing_stock(self, start_date=None, end_date=None, use_ledger=False):
+        """Calculate closing stock for this item (all transactions, signed by voucher type)
         
         Args:
             start_date: Optional start date filter
             end_date: Optional end date filter
+            use_ledger: Read the figure from the materialized StockLedger
         """
+        if use_ledger:
+            return self.get_ledger_figures(start_date, end_date)[1]
         try:
             query = ItemParamDet.objects.filter(ItemCode=self)
             
@@ -112,20 +284,23 @@ class StockReportView(Master1):
             if end_date:
                 query = query.filter(Date__lte=end_date)
                 
-            closing_stock = query.aggregate(Sum('Value1'))['Value1__sum'] or 0
+            closing_stock = query.aggregate(total=get_voucher_registry().signed_quantity())['total'] or 0
             return float(closing_stock)
         except (ValueError, TypeError):
             return 0.0
 
-    def get_movement(self, start_date=None, end_date=None):
+    def get_movement(self, start_date=None, end_date=None, use_ledger=False):
         """Calculate stock movement (excluding opening stock)
         
         Args:
             start_date: Optional start date filter
             end_date: Optional end date filter
+            use_ledger: Read the figure from the materialized StockLedger
         """
+        if use_ledger:
+            return self.get_ledger_figures(start_date, end_date)[2]
         try:
-            query = ItemParamDet.objects.filter(ItemCode=self).exclude(VchType=1)
+            query = ItemParamDet.objects.filter(ItemCode=self).exclude(get_voucher_registry().opening_filter())
             
             # Apply date filters if provided
             if start_date:
@@ -133,25 +308,50 @@ class StockReportView(Master1):
             if end_date:
                 query = query.filter(Date__lte=end_date)
                 
-            movement = query.aggregate(Sum('Value1'))['Value1__sum'] or 0
+            movement = query.aggregate(total=get_voucher_registry().signed_quantity())['total'] or 0
             return float(movement)
         except (ValueError, TypeError):
             return 0.0
 
-    def get_stock_status(self, start_date=None, end_date=None):
+    def get_ledger_figures(self, start_date=None, end_date=None):
+        """Get opening, closing and movement from the StockLedger
+
+        Each figure is the difference of the running balances at the two
+        ends of the date range, so the cost does not depend on history.
+
+        Args:
+            start_date: Optional start date filter
+            end_date: Optional end date filter
+        """
+        end_value, _, end_opening = StockLedger.totals(end_date, item=self)
+        start_value = start_opening = 0.0
+        if start_date:
+            start_value, _, start_opening = StockLedger.totals(start_date, inclusive=False, item=self)
+
+        opening = end_opening - start_opening
+        closing = end_value - start_value
+        return opening, closing, closing - opening
+
+    def get_stock_status(self, start_date=None, end_date=None, use_ledger=False):
         """Get stock status for display
         
         Args:
             start_date: Optional start date filter
             end_date: Optional end date filter
+            use_ledger: Read the figure from the materialized StockLedger
         """
-        closing = self.get_closing_stock(start_date, end_date)
-        if closing > 0:
-            return "✅ In Stock"
-        elif closing == 0:
-            return "⚠️ Zero Stock"
-        else:
-            return "❌ Negative Stock"
+        return stock_status(self.get_closing_stock(start_date, end_date, use_ledger))
+
+class ParameterSetStockView(ParameterSet):
+    """Proxy model for stock figures per parameter set"""
+    objects = ParameterSetStockQuerySet.as_manager()
+
+    class Meta:
+        proxy = True
+        verbose_name = "Parameter Set Stock"
+        verbose_name_plural = "Parameter Set Stock"
+        app_label = 'parameter'
+
 
 class ParameterStockView(ItemParamDet):
     """Proxy model for parameter-wise stock reporting"""
@@ -163,11 +363,9 @@ class ParameterStockView(ItemParamDet):
 
     def get_parameter_string(self):
         """Get formatted parameter string"""
-        params = []
-        for param in [self.C1, self.C2, self.C3, self.C4, self.C5]:
-            if param and str(param).strip():
-                params.append(str(param).strip())
-        return ' | '.join(params) if params else "No Parameters"
+        if self.ParamSet_id:
+            return self.ParamSet.label
+        return ParameterSet.make_label(self.parameter_values())
     
     def get_item_code_display(self):
         """Get item code safely"""
@@ -188,18 +386,7 @@ class ParameterStockView(ItemParamDet):
             query = query.filter(Date__lt=start_date)
         
         # Sum the Value1 field (positive for receipts, negative for issues)
-        result = query.aggregate(
-            opening_stock=Sum(models.Case(
-                models.When(VchType=1, then=models.F('Value1')),  # Opening Balance
-                models.When(VchType=2, then=models.F('Value1')),  # Purchase/Receipt
-                models.When(VchType=3, then=-models.F('Value1')),  # Sale/Issue
-                models.When(VchType=4, then=models.F('Value1')),  # Transfer In
-                models.When(VchType=5, then=-models.F('Value1')),  # Transfer Out
-                models.When(VchType=9, then=-models.F('Value1')),  # Sale
-                default=0,
-                output_field=models.FloatField()
-            ))
-        )
+        result = query.aggregate(opening_stock=get_voucher_registry().signed_quantity())
         
         return result['opening_stock'] or 0
     
@@ -213,18 +400,7 @@ class ParameterStockView(ItemParamDet):
             query = query.filter(Date__lte=end_date)
         
         # Sum the Value1 field (positive for receipts, negative for issues)
-        result = query.aggregate(
-            closing_stock=Sum(models.Case(
-                models.When(VchType=1, then=models.F('Value1')),  # Opening Balance
-                models.When(VchType=2, then=models.F('Value1')),  # Purchase/Receipt
-                models.When(VchType=3, then=-models.F('Value1')),  # Sale/Issue
-                models.When(VchType=4, then=models.F('Value1')),  # Transfer In
-                models.When(VchType=5, then=-models.F('Value1')),  # Transfer Out
-                models.When(VchType=9, then=-models.F('Value1')),  # Sale
-                default=0,
-                output_field=models.FloatField()
-            ))
-        )
+        result = query.aggregate(closing_stock=get_voucher_registry().signed_quantity())
         
         return result['closing_stock'] or 0
         
@@ -242,19 +418,235 @@ class ParameterStockView(ItemParamDet):
             query = query.filter(Date__lte=end_date)
             
         # Exclude opening entries for movement calculation
-        query = query.exclude(VchType=1)  # Exclude opening balance entries
+        query = query.exclude(get_voucher_registry().opening_filter())
         
         # Sum the Value1 field (positive for receipts, negative for issues)
+        result = query.aggregate(movement=get_voucher_registry().signed_quantity())
+        
+        return result['movement'] or 0
+
+class StockLedger(models.Model):
+    """Materialized daily stock ledger
+
+    One row per (item, BCN, date) holding the day's net quantity and the
+    running balances up to and including that day. Rows with a null BCN
+    hold the item-wide totals. Maintained incrementally by the signal
+    handlers in parameter.signals and rebuilt in full by the
+    rebuild_stock_ledger management command.
+    """
+    item = models.ForeignKey(Master1, on_delete=models.CASCADE, related_name='stock_ledger')
+    bcn = models.CharField(max_length=50, null=True, blank=True)
+    date = models.DateField()
+    net_quantity = models.FloatField(default=0)
+    balance = models.FloatField(default=0)
+    running_value = models.FloatField(default=0)
+    running_opening_value = models.FloatField(default=0)
+
+    class Meta:
+        app_label = 'parameter'
+        verbose_name = 'Stock Ledger Entry'
+        verbose_name_plural = 'Stock Ledger'
+        constraints = [
+            models.UniqueConstraint(fields=['item', 'bcn', 'date'], name='stock_ledger_item_bcn_date'),
+            # NULLs never collide in the constraint above, so the item-wide rows need their own
+            models.UniqueConstraint(fields=['item', 'date'], condition=models.Q(bcn__isnull=True),
+                                    name='stock_ledger_item_date'),
+        ]
+        indexes = [
+            models.Index(fields=['bcn', 'date'], name='stock_ledger_bcn_date'),
+        ]
+
+    def __str__(self):
+        return f"{self.item_id} - {self.bcn or 'ALL'} - {self.date}"
+
+    @classmethod
+    def latest_rows(cls, date=None, inclusive=True, by_bcn=False):
+        """Return the latest row of every series on or before a date
+
+        The date bound is exclusive when inclusive is False. by_bcn selects
+        the (item, BCN) series instead of the item-wide ones.
+        """
+        date_filter = Q()
+        if date:
+            date_filter = Q(date__lte=date) if inclusive else Q(date__lt=date)
+
+        later = cls.objects.filter(date_filter, item=OuterRef('item'), date__gt=OuterRef('date'))
+        if by_bcn:
+            query = cls.objects.filter(bcn__isnull=False)
+            later = later.filter(bcn=OuterRef('bcn'))
+        else:
+            query = cls.objects.filter(bcn__isnull=True)
+            later = later.filter(bcn__isnull=True)
+        return query.filter(date_filter).filter(~Exists(later))
+
+    @classmethod
+    def totals(cls, date=None, inclusive=True, item=None, bcn=None):
+        """Sum the running balances of each matching series as of a date
+
+        Each series contributes its latest row on or before the date
+        (strictly before it when inclusive is False). Pass item for the
+        item-wide series or bcn for the BCN series across items.
+
+        Returns:
+            Tuple of (balance, running_value, running_opening_value)
+        """
+        query = cls.latest_rows(date, inclusive, by_bcn=bcn is not None)
+        if bcn is not None:
+            query = query.filter(bcn=bcn)
+        if item is not None:
+            query = query.filter(item=item)
+
         result = query.aggregate(
-            movement=Sum(models.Case(
-                models.When(VchType=2, then=models.F('Value1')),  # Purchase/Receipt
-                models.When(VchType=3, then=-models.F('Value1')),  # Sale/Issue
-                models.When(VchType=4, then=models.F('Value1')),  # Transfer In
-                models.When(VchType=5, then=-models.F('Value1')),  # Transfer Out
-                models.When(VchType=9, then=-models.F('Value1')),  # Sale
-                default=0,
-                output_field=models.FloatField()
-            ))
+            balance=Coalesce(Sum('balance'), Value(0.0)),
+            running_value=Coalesce(Sum('running_value'), Value(0.0)),
+            running_opening_value=Coalesce(Sum('running_opening_value'), Value(0.0)),
         )
-        
-        return result['movement'] or 0
\ No newline at end of file
+        return result['balance'], result['running_value'], result['running_opening_value']
+
+
+class ParameterSearchToken(models.Model):
+    """One lowercase word of an ItemParamDet row's C1-C5, VchNo or BCN
+
+    Lets ParameterStockAdmin search by token prefix through an index
+    instead of scanning every column with icontains. Maintained by the
+    signal handlers in parameter.signals and rebuilt by the
+    rebuild_search_index management command.
+    """
+    row = models.ForeignKey(ItemParamDet, on_delete=models.CASCADE, related_name='search_tokens')
+    # NOCASE lets SQLite answer the istartswith prefix lookup from the index
+    token = models.CharField(max_length=50, db_collation='NOCASE')
+
+    class Meta:
+        app_label = 'parameter'
+        constraints = [
+            models.UniqueConstraint(fields=['row', 'token'], name='search_token_row_token'),
+        ]
+        indexes = [
+            models.Index(fields=['token', 'row'], name='search_token_token_row'),
+        ]
+
+    def __str__(self):
+        return f"{self.token} - {self.row_id}"
+
+
+class SearchIndexGap(models.Model):
+    """Part of ItemParamDet the token index is known to be missing
+
+    At most one row; none means the signal handlers have kept the index
+    complete. Loads that bypass the signals record the earliest date they
+    touched, or null when any date may be affected, and a rebuild_search_index
+    run covering that date removes the row again.
+    """
+    since = models.DateField(null=True, blank=True)
+
+    class Meta:
+        app_label = 'parameter'
+
+    def __str__(self):
+        return f"Missing from {self.since or 'any date'}"
+
+
+class ParameterFacet(models.Model):
+    """Number of ItemParamDet rows holding one value of a filterable field
+
+    Feeds the ParameterStockAdmin list filters without a SELECT DISTINCT
+    over ItemParamDet. Kept up to date by the signal handlers in
+    parameter.signals and rebuilt by the rebuild_facets management command.
+    """
+    field = models.CharField(max_length=30)
+    value = models.CharField(max_length=100)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        app_label = 'parameter'
+        ordering = ('field', 'value')
+        constraints = [
+            models.UniqueConstraint(fields=['field', 'value'], name='parameter_facet_field_value'),
+        ]
+
+    def __str__(self):
+        return f"{self.field}={self.value} ({self.count})"
+
+
+class ReportJob(models.Model):
+    """A report computed off-request by the run_report_worker command
+
+    Submitted through parameter.views.submit_report_job; the kinds of job
+    and how each is computed are defined in parameter.jobs.
+    """
+    QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    kind = models.CharField(max_length=50)
+    params = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    rows_done = models.IntegerField(default=0)
+    rows_total = models.IntegerField(null=True, blank=True)
+    result_file = models.CharField(max_length=255, blank=True, help_text="Path under REPORT_JOBS['RESULT_DIR']")
+    error = models.TextField(blank=True)
+    worker = models.CharField(max_length=100, blank=True)
+    created_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True,
+                                   related_name='report_jobs')
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        app_label = 'parameter'
+        ordering = ('-created_at',)
+        indexes = [
+            # Workers claim the oldest queued job
+            models.Index(fields=['status', 'created_at'], name='reportjob_status_created'),
+        ]
+
+    @property
+    def progress(self):
+        """Fraction of rows written, or None while the total is unknown"""
+        if self.status == self.DONE:
+            return 1.0
+        if not self.rows_total:
+            return None
+        return min(self.rows_done / self.rows_total, 1.0)
+
+    @classmethod
+    def claim_next(cls, worker=''):
+        """Mark the oldest queued job as running and return it (None if there is none)
+
+        The status check in the UPDATE lets several workers poll the queue
+        without running a job twice.
+        """
+        for pk in cls.objects.filter(status=cls.QUEUED).order_by('created_at', 'pk').values_list('pk', flat=True)[:10]:
+            claimed = cls.objects.filter(pk=pk, status=cls.QUEUED).update(
+                status=cls.RUNNING, started_at=timezone.now(), worker=worker
+            )
+            if claimed:
+                return cls.objects.get(pk=pk)
+        return None
+
+    @classmethod
+    def fail_abandoned(cls, started_before):
+        """Fail the jobs still running that started before started_before
+
+        Their worker is taken to have died without recording the outcome.
+
+        Returns:
+            List of the jobs failed
+        """
+        stale = list(cls.objects.filter(status=cls.RUNNING, started_at__lt=started_before))
+        failed = []
+        for job in stale:
+            # Only if still running; the worker may have finished it meanwhile
+            if cls.objects.filter(pk=job.pk, status=cls.RUNNING).update(
+                status=cls.FAILED, finished_at=timezone.now(),
+                error="Abandoned: the worker stopped without finishing the job",
+            ):
+                failed.append(job)
+        return failed
+
+    def __str__(self):
+        return f"{self.kind} #{self.pk} ({self.status})"
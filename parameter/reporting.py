@@ -0,0 +1,187 @@
+"""Reads of the stock report models from a reporting copy of the database
+
+ReportingRouter sends reads of the report proxies (StockReportView,
+ParameterStockView, ParameterSetStockView and BCNStockSummary) to the
+database named by settings.REPORTING_DATABASE['ALIAS'], so big reports do
+not contend with sync loads on 'default'. Writes and every other model
+stay on 'default'.
+
+The copy is refreshed by the refresh_reporting_database command, which
+records the ledger version it copied. While the ledger has moved on and
+the copy is more than MAX_LAG seconds old, reads fall back to 'default'.
+For a copy kept up to date by the database's own replication, run the
+command with --mark-only once the replica has caught up.
+
+Per-company databases (core.tenants) have no reporting copy; with them
+enabled the router does nothing.
+"""
+import hashlib
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.signals import setting_changed
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.dispatch import receiver
+
+from core import tenants
+from core.models import ItemParamDet
+
+# Defaults for settings.REPORTING_DATABASE
+REPORTING_DEFAULTS = {
+    'ALIAS': None,          # DATABASES alias of the reporting copy; None reads from 'default'
+    'MAX_LAG': 300,         # seconds the copy may trail 'default' before reads fall back
+    'CHECK_INTERVAL': 5,    # seconds each process trusts its last lag check
+}
+
+REPORTING_MODELS = frozenset({
+    'parameter.stockreportview', 'parameter.parameterstockview',
+    'parameter.parametersetstockview', 'parameter.bcnstocksummary',
+})
+
+
+def get_reporting_settings():
+    """Return the reporting settings merged over the defaults"""
+    options = dict(REPORTING_DEFAULTS)
+    options.update(getattr(settings, 'REPORTING_DATABASE', {}))
+    return options
+
+
+def configured_alias():
+    """Return the reporting alias, or None when there is no usable one configured"""
+    alias = get_reporting_settings()['ALIAS']
+    if alias is None or alias not in connections.settings or tenants.enabled():
+        return None
+    return alias
+
+
+def state_key(alias):
+    """Cache key of the refresh state of the database behind alias"""
+    name = str(connections.settings[alias]['NAME'])
+    return f"parameter:reporting:{alias}:{hashlib.sha1(name.encode()).hexdigest()[:12]}"
+
+
+def mark_refreshed(alias, version, refreshed_at=None):
+    """Record that alias holds every change up to ledger version, as of refreshed_at"""
+    state = {'version': version, 'refreshed_at': time.time() if refreshed_at is None else refreshed_at}
+    cache.set(state_key(alias), state, timeout=None)
+    replica_state.reset()
+    return state
+
+
+def get_refresh_state(alias):
+    return cache.get(state_key(alias))
+
+
+def replica_lag(alias, current=None):
+    """Return how many seconds the copy trails 'default' (0 when it is current; None if never refreshed)"""
+    state = get_refresh_state(alias)
+    if state is None:
+        return None
+    current = ItemParamDet.get_ledger_version() if current is None else current
+    if state['version'] >= current:
+        return 0.0
+    return max(time.time() - state['refreshed_at'], 0.0)
+
+
+class ReplicaState:
+    """Per-process record of whether the reporting copy is fresh enough to read
+
+    Looked up at most every CHECK_INTERVAL seconds, since the router asks
+    before every query.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._checked = None
+            self._alias = None
+            self._version = None
+
+    def current(self):
+        """Return (alias, ledger version) to read from, or (None, None) for 'default'"""
+        options = get_reporting_settings()
+        alias = configured_alias()
+        if alias is None:
+            return None, None
+        now = time.monotonic()
+        with self._lock:
+            if self._checked is not None and now - self._checked < options['CHECK_INTERVAL']:
+                return self._alias, self._version
+
+        lag = replica_lag(alias)
+        state = get_refresh_state(alias)
+        usable = lag is not None and lag <= options['MAX_LAG']
+        with self._lock:
+            self._checked = now
+            self._alias = alias if usable else None
+            self._version = state['version'] if usable else None
+            return self._alias, self._version
+
+
+replica_state = ReplicaState()
+
+
+@receiver(setting_changed)
+def reset_replica_state(setting, **kwargs):
+    if setting in ('REPORTING_DATABASE', 'DATABASES', 'REPORT_TENANTS'):
+        replica_state.reset()
+
+
+def read_version(current=None):
+    """Return the ledger version of the data report reads see
+
+    That of the reporting copy while reads go there, else the current one
+    (current, if given). Results and ETags derived from report reads are
+    stamped with it, so they go stale once the copy is refreshed.
+    """
+    current = ItemParamDet.get_ledger_version() if current is None else current
+    alias, version = replica_state.current()
+    return min(version, current) if alias is not None else current
+
+
+class ReportingRouter:
+    """Route reads of the report proxies to the reporting copy"""
+
+    def db_for_read(self, model, **hints):
+        if model._meta.label_lower not in REPORTING_MODELS:
+            return None
+        return replica_state.current()[0]
+
+    def db_for_write(self, model, **hints):
+        # Rows read from the copy would otherwise be saved back to it
+        if model._meta.label_lower in REPORTING_MODELS and configured_alias() is not None:
+            return DEFAULT_DB_ALIAS
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The copy holds the same rows as 'default'
+        alias = configured_alias()
+        if alias is not None and {obj1._state.db, obj2._state.db} <= {DEFAULT_DB_ALIAS, alias}:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # The copy takes its schema from 'default'
+        if db == get_reporting_settings()['ALIAS']:
+            return False
+        return None
+
+
+def copy_sqlite(source_alias, target_alias):
+    """Copy one SQLite database over another with the online backup API
+
+    The pages are written into the target in one transaction, so readers
+    see either the old copy or the complete new one. Writing in place
+    rather than swapping files keeps a WAL-mode target consistent with
+    its -wal file while other processes hold it open.
+    """
+    source = connections[source_alias]
+    target = connections[target_alias]
+    source.ensure_connection()
+    target.ensure_connection()
+    source.connection.backup(target.connection)
@@ -0,0 +1,133 @@
+"""Token index used by ParameterStockAdmin search
+
+Every ItemParamDet row is split into lowercase words taken from C1-C5,
+VchNo and BCN, stored as ParameterSearchToken rows. A search word then
+matches rows holding a token that starts with it, looked up on the
+indexed token column, or rows whose item code or name contains it
+(Master1 is small enough to search directly). Words are ANDed, like the
+admin's own search.
+
+Loads that bypass the signals leave a SearchIndexGap behind; until
+rebuild_search_index covers it, searches fall back to icontains.
+"""
+import re
+
+from django.conf import settings
+from django.db import router, transaction
+from django.db.models import Q
+from django.utils.text import smart_split, unescape_string_literal
+
+from core.models import Master1, ItemParamDet
+from .models import ParameterSearchToken, SearchIndexGap
+
+INDEXED_FIELDS = ('C1', 'C2', 'C3', 'C4', 'C5', 'VchNo', 'BCN')
+TOKEN_MAX_LENGTH = ParameterSearchToken._meta.get_field('token').max_length
+_WORDS = re.compile(r'\w+')
+
+
+def tokenize(value):
+    """Return the distinct lowercase words of a value"""
+    return {word[:TOKEN_MAX_LENGTH] for word in _WORDS.findall(str(value or '').lower())}
+
+
+def row_tokens(row):
+    tokens = set()
+    for field in INDEXED_FIELDS:
+        tokens |= tokenize(getattr(row, field))
+    return tokens
+
+
+def index_rows(rows, batch_size=5000):
+    """Replace the tokens of rows (ItemParamDet instances)
+
+    Returns:
+        Number of tokens written
+    """
+    rows = list(rows)
+    tokens = [
+        ParameterSearchToken(row_id=row.pk, token=token)
+        for row in rows for token in row_tokens(row)
+    ]
+    with transaction.atomic(using=router.db_for_write(ParameterSearchToken)):
+        ParameterSearchToken.objects.filter(row_id__in=[row.pk for row in rows]).delete()
+        ParameterSearchToken.objects.bulk_create(tokens, batch_size=batch_size)
+    return len(tokens)
+
+
+def rebuild(batch_size=5000, since=None):
+    """Rebuild the token index, or only for rows dated on or after since
+
+    Clears the recorded gap in the index when the rebuild covers it.
+
+    Returns:
+        Number of tokens written
+    """
+    gap = SearchIndexGap.objects.first()
+    rows = ItemParamDet.objects.only('pk', *INDEXED_FIELDS).order_by('pk')
+    if since:
+        rows = rows.filter(Date__gte=since)
+    else:
+        ParameterSearchToken.objects.all().delete()
+
+    written = 0
+    batch = []
+    for row in rows.iterator(chunk_size=batch_size):
+        batch.append(row)
+        if len(batch) >= batch_size:
+            written += index_rows(batch, batch_size)
+            batch = []
+    written += index_rows(batch, batch_size)
+    if gap is not None and (not since or (gap.since is not None and since <= gap.since)):
+        # Only the gap seen at the start; a load during the rebuild leaves its own
+        SearchIndexGap.objects.filter(pk=gap.pk, since=gap.since).delete()
+    return written
+
+
+def mark_gap(since=None):
+    """Record that rows dated since onwards (None: any) may be missing from the index"""
+    with transaction.atomic(using=router.db_for_write(SearchIndexGap)):
+        gap = SearchIndexGap.objects.select_for_update().first()
+        if gap is None:
+            SearchIndexGap.objects.create(since=since)
+        elif gap.since is not None and (since is None or since < gap.since):
+            gap.since = since
+            gap.save(update_fields=['since'])
+
+
+def index_ready():
+    """Whether searches can use the index
+
+    False when settings.PARAMETER_SEARCH_INDEX is off, or while rows
+    loaded without signals are missing from the index (see mark_gap()).
+    """
+    if not getattr(settings, 'PARAMETER_SEARCH_INDEX', True):
+        return False
+    return not SearchIndexGap.objects.exists()
+
+
+def search_words(search_term):
+    for bit in smart_split(search_term):
+        if bit.startswith(('"', "'")) and bit[0] == bit[-1]:
+            bit = unescape_string_literal(bit)
+        yield bit
+
+
+def prefix_matches(token):
+    """Rows holding a token that starts with token"""
+    return ParameterSearchToken.objects.filter(token__istartswith=token).values('row')
+
+
+def search(queryset, search_term):
+    """Filter an ItemParamDet queryset to rows matching every word of search_term"""
+    for word in search_words(search_term):
+        tokens = tokenize(word)
+        if not tokens:
+            continue
+        by_token = Q()
+        for token in tokens:
+            by_token &= Q(pk__in=prefix_matches(token))
+        by_item = Q(ItemCode__in=Master1.objects.filter(
+            Q(Code__icontains=word) | Q(Name__icontains=word)
+        ).values('pk'))
+        queryset = queryset.filter(by_token | by_item)
+    return queryset
@@ -0,0 +1,66 @@
+"""Signal handlers keeping the stock ledger, search index and list filter
+facets in step with ItemParamDet
+
+Only per-instance save() and delete() send signals; bulk_create(),
+QuerySet.update() and raw SQL loads must be followed by the
+rebuild_stock_ledger, rebuild_search_index and rebuild_facets management
+commands.
+"""
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+
+from core.models import ItemParamDet
+from core.signals import param_details_bulk_changed
+from . import facets, ledger, search
+
+
+@receiver(pre_save, sender=ItemParamDet)
+def remember_previous_row(sender, instance, raw=False, **kwargs):
+    """Keep the stored version of a row so an update can be reversed"""
+    instance._ledger_previous = instance._facets_previous = None
+    if raw or instance.pk is None:
+        return
+    previous = ItemParamDet.objects.filter(pk=instance.pk).first()
+    if previous is not None:
+        instance._ledger_previous = ledger.row_key(previous)
+        instance._facets_previous = facets.row_facets(previous)
+
+
+@receiver(post_save, sender=ItemParamDet)
+def update_ledger_on_save(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    previous = getattr(instance, '_ledger_previous', None)
+    if previous is not None:
+        ledger.apply_change(*previous, sign=-1)
+    ledger.apply_change(*ledger.row_key(instance))
+
+
+@receiver(post_delete, sender=ItemParamDet)
+def update_ledger_on_delete(sender, instance, **kwargs):
+    ledger.apply_change(*ledger.row_key(instance), sign=-1)
+
+
+@receiver(post_save, sender=ItemParamDet)
+def update_search_tokens(sender, instance, raw=False, **kwargs):
+    # Deleted rows lose their tokens through the foreign key cascade
+    if not raw:
+        search.index_rows([instance])
+
+
+@receiver(post_save, sender=ItemParamDet)
+def update_facets_on_save(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    facets.row_changed(getattr(instance, '_facets_previous', None), facets.row_facets(instance))
+
+
+@receiver(post_delete, sender=ItemParamDet)
+def update_facets_on_delete(sender, instance, **kwargs):
+    facets.row_changed(facets.row_facets(instance), None)
+
+
+@receiver(param_details_bulk_changed)
+def note_search_index_gap(sender, since=None, **kwargs):
+    # Searches fall back to icontains until rebuild_search_index catches up
+    search.mark_gap(since)
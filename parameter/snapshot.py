@@ -0,0 +1,244 @@
+"""Columnar in-memory snapshot of ItemParamDet for bulk stock figures
+
+StockSnapshot.load() reads (item, BCN, parameter set, date, voucher type,
+Value1) once into NumPy arrays. Rows are grouped per item, per BCN and per
+parameter set, sorted by date,
+and prefix sums of the signed quantity and of the opening balance
+quantity are precomputed. Any figure for any date range then costs two
+searchsorted lookups and a subtraction, vectorized over all requested
+items or BCNs at once.
+
+Used through StockReportQuerySet.with_snapshot_figures() (and its
+ParameterSetStockQuerySet subclass) and
+BCNStockSummaryQuerySet.with_snapshot_figures(); current_snapshot()
+returns a per-process snapshot of the current company's database. When
+the ledger version moves, only the rows dated on or after the earliest
+changed date are read again.
+"""
+import threading
+
+from django.db import router
+
+from core.models import ItemParamDet
+from core.vouchers import get_voucher_registry
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - only needed for the snapshot backend
+    np = None
+
+
+# Positions combine a group number and a date ordinal into one sortable int64
+DATE_SPAN = 1 << 22
+LOAD_CHUNK_SIZE = 20000
+
+
+def date_ordinal(value, default):
+    if not value:
+        return default
+    return ItemParamDet._meta.get_field('Date').to_python(value).toordinal()
+
+
+class StockSeries:
+    """Rows grouped by one key (item, BCN or parameter set), sorted by date, with prefix sums"""
+    __slots__ = ('groups', 'positions', 'signed', 'opening')
+
+    def __init__(self, keys, dates, signed, opening):
+        unique, inverse = np.unique(keys, return_inverse=True)
+        order = np.lexsort((dates, inverse))
+        self.groups = {key: number for number, key in enumerate(unique.tolist())}
+        self.positions = inverse[order].astype(np.int64) * DATE_SPAN + dates[order]
+        self.signed = np.concatenate(([0.0], np.cumsum(signed[order])))
+        self.opening = np.concatenate(([0.0], np.cumsum(opening[order])))
+
+    def _bounds(self, keys, start, end):
+        """Prefix-sum indexes of each key's rows dated start..end (ordinals, inclusive)"""
+        groups = np.array([self.groups.get(key, -1) for key in keys], dtype=np.int64)
+        base = np.maximum(groups, 0) * DATE_SPAN
+        low = np.searchsorted(self.positions, base + start, side='left')
+        high = np.searchsorted(self.positions, base + end, side='right')
+        # Unknown keys get an empty range
+        high = np.where(groups < 0, low, high)
+        return low, high
+
+    def sums(self, keys, start=None, end=None, before=False):
+        """Signed and opening quantity per key over a date range
+
+        With before, the range is every row dated strictly before start.
+
+        Returns:
+            Tuple of (signed, opening) float arrays parallel to keys
+        """
+        if before:
+            start, end = 0, date_ordinal(start, DATE_SPAN) - 1
+        else:
+            start, end = date_ordinal(start, 0), date_ordinal(end, DATE_SPAN - 1)
+        low, high = self._bounds(keys, start, end)
+        return self.signed[high] - self.signed[low], self.opening[high] - self.opening[low]
+
+
+def read_columns(queryset, chunk_size=LOAD_CHUNK_SIZE):
+    """Read the snapshot's columns of the dated rows of an ItemParamDet queryset
+
+    Returns:
+        Dict of parallel NumPy arrays: item_ids, bcns, set_ids, dates, codes
+        and values. Rows without a parameter set get set id -1.
+    """
+    item_ids, bcns, set_ids, dates, codes, values = [], [], [], [], [], []
+    for item_id, bcn, set_id, date, vch_type, value in queryset.values_list(
+        'ItemCode_id', 'BCN', 'ParamSet_id', 'Date', 'VchType', 'Value1'
+    ).iterator(chunk_size=chunk_size):
+        if not date:
+            continue
+        item_ids.append(item_id)
+        bcns.append(bcn or '')
+        set_ids.append(set_id if set_id is not None else -1)
+        dates.append(date_ordinal(date, 0))
+        codes.append(vch_type if vch_type is not None else -1)
+        values.append(value or 0.0)
+    return {
+        'item_ids': np.array(item_ids, dtype=np.int64),
+        'bcns': np.array(bcns, dtype=object),
+        'set_ids': np.array(set_ids, dtype=np.int64),
+        'dates': np.array(dates, dtype=np.int64),
+        'codes': np.array(codes, dtype=np.int64),
+        'values': np.array(values, dtype=np.float64),
+    }
+
+
+class StockSnapshot:
+    """Per-item, per-BCN and per-parameter set series loaded from ItemParamDet
+
+    columns keeps the rows the series were built from, so refresh() can
+    replace the changed dates without reading the rest again.
+    """
+    __slots__ = ('items', 'bcns', 'sets', 'row_count', 'version', 'vouchers', 'columns')
+
+    def __init__(self, items, bcns, sets, row_count, version=None, vouchers=None, columns=None):
+        self.items = items
+        self.bcns = bcns
+        self.sets = sets
+        self.row_count = row_count
+        self.version = version
+        self.vouchers = vouchers
+        self.columns = columns
+
+    @classmethod
+    def build(cls, columns, version, vouchers):
+        """Group read_columns() output into series, signed by vouchers"""
+        codes, dates = columns['codes'], columns['dates']
+        bcns, set_ids = columns['bcns'], columns['set_ids']
+        signed = vouchers.signed_values(codes, columns['values'])
+        opening = np.where(np.isin(codes, vouchers.opening_codes), signed, 0.0)
+
+        with_bcn = bcns != ''
+        with_set = set_ids >= 0
+        return cls(
+            items=StockSeries(columns['item_ids'], dates, signed, opening),
+            bcns=StockSeries(bcns[with_bcn].astype(str), dates[with_bcn],
+                             signed[with_bcn], opening[with_bcn]),
+            sets=StockSeries(set_ids[with_set], dates[with_set], signed[with_set], opening[with_set]),
+            row_count=len(dates),
+            version=version,
+            vouchers=vouchers,
+            columns=columns,
+        )
+
+    @classmethod
+    def load(cls, queryset=None, vouchers=None, chunk_size=LOAD_CHUNK_SIZE):
+        """Read ItemParamDet rows (default: all) into a snapshot"""
+        if np is None:
+            raise ImportError("numpy is required for the stock snapshot")
+        vouchers = vouchers or get_voucher_registry()
+        version = ItemParamDet.get_ledger_version()
+        queryset = ItemParamDet.objects.all() if queryset is None else queryset
+        return cls.build(read_columns(queryset, chunk_size), version, vouchers)
+
+    def refresh(self, since, version, queryset=None, vouchers=None, chunk_size=LOAD_CHUNK_SIZE):
+        """Return a snapshot at version that rereads only the rows dated on or after since
+
+        queryset must be the one this snapshot was loaded from (default: all
+        rows); rows before since are taken over as they are.
+        """
+        queryset = ItemParamDet.objects.all() if queryset is None else queryset
+        kept = self.columns['dates'] < date_ordinal(since, 0)
+        fresh = read_columns(queryset.filter(Date__gte=since), chunk_size)
+        columns = {name: np.concatenate((column[kept], fresh[name])) for name, column in self.columns.items()}
+        return self.build(columns, version, vouchers or self.vouchers)
+
+    def item_figures(self, item_ids, start_date=None, end_date=None):
+        """Opening, closing and movement per item, as StockReportView computes them
+
+        Returns:
+            Dict mapping item id to (opening, closing, movement)
+        """
+        return self._range_figures(self.items, item_ids, start_date, end_date)
+
+    def parameter_set_figures(self, set_ids, start_date=None, end_date=None):
+        """Opening, closing and movement per parameter set, as ParameterSetStockView has them
+
+        Returns:
+            Dict mapping parameter set id to (opening, closing, movement)
+        """
+        return self._range_figures(self.sets, set_ids, start_date, end_date)
+
+    @staticmethod
+    def _range_figures(series, keys, start_date, end_date):
+        """Figures over the rows dated start_date..end_date, opening included"""
+        keys = list(keys)
+        closing, opening = series.sums(keys, start_date, end_date)
+        return {
+            key: (float(o), float(c), float(c - o))
+            for key, o, c in zip(keys, opening, closing)
+        }
+
+    def bcn_figures(self, bcns, start_date=None, end_date=None):
+        """Opening, closing and movement per BCN, as BCNStockSummary computes them
+
+        Returns:
+            Dict mapping BCN to (opening, closing, movement)
+        """
+        bcns = list(bcns)
+        if start_date:
+            opening, _ = self.bcns.sums(bcns, start_date, before=True)
+        else:
+            opening, _ = self.bcns.sums(bcns)
+        closing, _ = self.bcns.sums(bcns, end=end_date)
+        in_range, opening_in_range = self.bcns.sums(bcns, start_date, end_date)
+        movement = in_range - opening_in_range
+        return {
+            bcn: (float(o), float(c), float(m))
+            for bcn, o, c, m in zip(bcns, opening, closing, movement)
+        }
+
+
+# This process's snapshot of each database, by alias
+_current = {}
+_current_lock = threading.Lock()
+
+
+def current_snapshot():
+    """Return this process's snapshot of the current database, brought up to date
+
+    After ItemParamDet changes the rows from the earliest changed date on
+    are read again; the whole table only when that date is unknown.
+    """
+    alias = router.db_for_read(ItemParamDet)
+    queryset = ItemParamDet.objects.using(alias)
+    version = ItemParamDet.get_ledger_version()
+    vouchers = get_voucher_registry()
+    with _current_lock:
+        snapshot = _current.get(alias)
+        if snapshot is None:
+            snapshot = StockSnapshot.load(queryset, vouchers)
+        elif snapshot.version != version:
+            changes = ItemParamDet.get_ledger_changes(snapshot.version)
+            if not changes or None in changes:
+                snapshot = StockSnapshot.load(queryset, vouchers)
+            else:
+                snapshot = snapshot.refresh(min(changes), version, queryset, vouchers)
+        elif snapshot.vouchers is not vouchers:
+            # Only the signs changed; no need to read the rows again
+            snapshot = StockSnapshot.build(snapshot.columns, version, vouchers)
+        _current[alias] = snapshot
+        return snapshot
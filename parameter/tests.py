@@ -1,3 +1,996 @@
-from django.test import TestCase
+import datetime
+import io
+import json
+import shutil
+import tempfile
+import time
+import unittest
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Value
+from django.db.models.functions import Concat
+from django.contrib import admin
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from core.models import Master1, ItemParamDet, UserProfile
+from core.sync import bulk_changed, record_item_sync
+from reports.instrumentation import fingerprint, metrics, profile_queries
+from .admin import ParameterStockAdmin
+from . import benchmarks, facets, jobs, ledger, reporting, search
+from .cache import StockResultCache, stock_cache
+from .snapshot import StockSnapshot, current_snapshot
+from .models import BCNStockSummary, ParameterSetStockView, ParameterStockView, StockReportView, StockLedger, ParameterSearchToken, ParameterFacet, ReportJob
+
+
+def create_bcn_rows(count, item):
+    """Create an opening, purchase and sale row for count BCNs"""
+    rows = []
+    for i in range(count):
+        bcn = f"BCN{i:05d}"
+        rows.extend([
+            ItemParamDet(ItemCode=item, BCN=bcn, VchType=1, Value1=10,
+                         Date=datetime.date(2024, 1, 1), VchNo='1', C1='Red', C2='M'),
+            ItemParamDet(ItemCode=item, BCN=bcn, VchType=2, Value1=5,
+                         Date=datetime.date(2024, 2, 1), VchNo='2', C1='Red', C2='M'),
+            ItemParamDet(ItemCode=item, BCN=bcn, VchType=9, Value1=3,
+                         Date=datetime.date(2024, 3, 1), VchNo='3', C1='Red', C2='M'),
+        ])
+    ItemParamDet.objects.bulk_create(rows)
+    # Bulk loads send no signals; they invalidate cached results explicitly
+    ItemParamDet.bump_ledger_version(datetime.date(2024, 1, 1))
+
+
+class BCNStockSummaryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.item = Master1.objects.create(Code='I001', Name='Shirt', MasterType='6')
+
+    def test_matches_per_bcn_calculations(self):
+        create_bcn_rows(3, self.item)
+        start, end = datetime.date(2024, 2, 1), datetime.date(2024, 2, 28)
+
+        summaries = BCNStockSummary.get_queryset(start, end)
+
+        self.assertEqual([s.bcn for s in summaries], ['BCN00000', 'BCN00001', 'BCN00002'])
+        for summary in summaries:
+            self.assertEqual(summary.item_code, 'I001')
+            self.assertEqual(summary.item_name, 'Shirt')
+            self.assertEqual(summary.parameters, 'Red | M')
+            self.assertEqual(summary.opening_stock,
+                             ParameterStockView.get_opening_stock_by_bcn(summary.bcn, start, end))
+            self.assertEqual(summary.closing_stock,
+                             ParameterStockView.get_closing_stock_by_bcn(summary.bcn, start, end))
+            self.assertEqual(summary.movement,
+                             ParameterStockView.get_movement_by_bcn(summary.bcn, start, end))
+        self.assertEqual((summaries[0].opening_stock, summaries[0].closing_stock,
+                          summaries[0].movement), (10, 15, 5))
+
+    def test_query_count_is_flat(self):
+        """Benchmark: queries stay constant as the number of BCNs grows"""
+        counts = []
+        for size in (10, 200):
+            ItemParamDet.objects.all().delete()
+            create_bcn_rows(size, self.item)
+            with CaptureQueriesContext(connection) as ctx:
+                summaries = BCNStockSummary.get_queryset()
+            self.assertEqual(len(summaries), size)
+            counts.append(len(ctx.captured_queries))
+        self.assertEqual(counts[0], counts[1])
+        self.assertLessEqual(counts[1], 2)
+
+
+class StockReportFiguresTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        for i in range(5):
+            item = Master1.objects.create(Code=f'I{i:03d}', Name=f'Item {i}', MasterType='6')
+            ItemParamDet.objects.bulk_create([
+                ItemParamDet(ItemCode=item, VchType=1, Value1=10 * i,
+                             Date=datetime.date(2024, 1, 1), VchNo='1'),
+                ItemParamDet(ItemCode=item, VchType=2, Value1=4,
+                             Date=datetime.date(2024, 2, 10), VchNo='2'),
+                ItemParamDet(ItemCode=item, VchType=9, Value1=-2,
+                             Date=datetime.date(2024, 3, 5), VchNo='3'),
+            ])
+        Master1.objects.create(Code='EMPTY', Name='No transactions', MasterType='6')
+
+    def test_annotations_match_per_item_methods(self):
+        for start, end in [(None, None), (datetime.date(2024, 2, 1), datetime.date(2024, 2, 28))]:
+            for item in StockReportView.objects.with_stock_figures(start, end):
+                self.assertEqual(item.opening_stock, item.get_opening_stock(start, end))
+                self.assertEqual(item.closing_stock, item.get_closing_stock(start, end))
+                self.assertEqual(item.movement, item.get_movement(start, end))
+                self.assertEqual(item.stock_status, item.get_stock_status(start, end))
+
+    def test_figures_are_signed_by_voucher_type(self):
+        item = StockReportView.objects.with_stock_figures().get(Code='I002')
+        self.assertEqual((item.opening_stock, item.closing_stock, item.movement), (20, 26, 6))
+
+    def test_single_query_for_all_items(self):
+        with self.assertNumQueries(1):
+            items = list(StockReportView.objects.filter(MasterType=6).with_stock_figures())
+        self.assertEqual(len(items), 6)
+
+    def test_rows_without_voucher_type_keep_stored_signs(self):
+        # Rows loaded before VchType existed carry 0 and already signed values
+        item = StockReportView.objects.create(Code='1288', Name='Legacy', MasterType='6')
+        for value, date in [(15, datetime.date(2024, 1, 1)), (-2, datetime.date(2024, 2, 1)),
+                            (-1, datetime.date(2024, 3, 1))]:
+            ItemParamDet.objects.create(ItemCode=item, Value1=value, VchNo='1', BCN='L1', Date=date)
+        self.assertEqual(ItemParamDet.objects.filter(ItemCode=item, VchType=0).count(), 3)
+
+        figures = StockReportView.objects.with_stock_figures().get(pk=item.pk)
+        self.assertEqual((figures.opening_stock, figures.closing_stock, figures.movement), (0, 12, 12))
+        self.assertEqual(item.get_closing_stock(), 12)
+        self.assertEqual(item.get_closing_stock(use_ledger=True), 12)
+        self.assertEqual(StockSnapshot.load().item_figures([item.pk])[item.pk], (0.0, 12.0, 12.0))
+        self.assertEqual(BCNStockSummary.get_queryset().get(bcn='L1').closing_stock, 12)
+
+
+class StockLedgerTests(TestCase):
+    RANGES = [
+        (None, None),
+        (datetime.date(2024, 2, 1), datetime.date(2024, 2, 28)),
+        (datetime.date(2024, 1, 15), None),
+        (None, datetime.date(2024, 2, 15)),
+    ]
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.item = StockReportView.objects.create(Code='I001', Name='Shirt', MasterType='6')
+
+    def create_row(self, **kwargs):
+        values = dict(ItemCode=self.item, VchNo='1', BCN='B1', VchType=2, Value1=1,
+                      Date=datetime.date(2024, 1, 1))
+        values.update(kwargs)
+        return ItemParamDet.objects.create(**values)
+
+    def assertLedgerMatchesLive(self):
+        for start, end in self.RANGES:
+            self.assertEqual(self.item.get_ledger_figures(start, end), (
+                self.item.get_opening_stock(start, end),
+                self.item.get_closing_stock(start, end),
+                self.item.get_movement(start, end),
+            ))
+            live = [(s.bcn, s.opening_stock, s.closing_stock, s.movement)
+                    for s in BCNStockSummary.get_queryset(start, end)]
+            from_ledger = [(s.bcn, s.opening_stock, s.closing_stock, s.movement)
+                           for s in BCNStockSummary.get_queryset(start, end, use_ledger=True)]
+            self.assertEqual(live, from_ledger)
+
+    def test_incremental_maintenance(self):
+        self.create_row(VchType=1, Value1=10)
+        purchase = self.create_row(VchType=2, Value1=5, Date=datetime.date(2024, 2, 10))
+        sale = self.create_row(VchType=9, Value1=3, Date=datetime.date(2024, 3, 5), BCN='B2')
+        self.assertLedgerMatchesLive()
+
+        purchase.Value1 = 7
+        purchase.Date = datetime.date(2024, 1, 20)
+        purchase.save()
+        self.assertLedgerMatchesLive()
+
+        sale.delete()
+        self.assertLedgerMatchesLive()
+
+    def test_rebuild_matches_incremental(self):
+        self.create_row(VchType=1, Value1=10)
+        self.create_row(VchType=2, Value1=5, Date=datetime.date(2024, 2, 10), BCN='')
+        self.create_row(VchType=9, Value1=3, Date=datetime.date(2024, 3, 5), BCN='B2')
+        incremental = list(StockLedger.objects.order_by('item', 'bcn', 'date').values_list(
+            'bcn', 'date', 'net_quantity', 'balance', 'running_value', 'running_opening_value'))
+
+        ledger.rebuild()
+        rebuilt = list(StockLedger.objects.order_by('item', 'bcn', 'date').values_list(
+            'bcn', 'date', 'net_quantity', 'balance', 'running_value', 'running_opening_value'))
+        self.assertEqual(incremental, rebuilt)
+        self.assertLedgerMatchesLive()
+
+        ledger.rebuild(since=datetime.date(2024, 2, 1))
+        partial = list(StockLedger.objects.order_by('item', 'bcn', 'date').values_list(
+            'bcn', 'date', 'net_quantity', 'balance', 'running_value', 'running_opening_value'))
+        self.assertEqual(partial, rebuilt)
+
+    def test_concurrently_created_day_is_reused(self):
+        # Another save created the day's rows between this one's lookup and insert
+        StockLedger.objects.create(item=self.item, bcn=None, date=datetime.date(2024, 1, 1))
+        StockLedger.objects.create(item=self.item, bcn='B1', date=datetime.date(2024, 1, 1))
+        self.create_row(VchType=1, Value1=10)
+        self.assertEqual(StockLedger.objects.count(), 2)
+        self.assertLedgerMatchesLive()
+
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            StockLedger.objects.create(item=self.item, bcn=None, date=datetime.date(2024, 1, 1))
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', "EXPLAIN QUERY PLAN is SQLite specific")
+class StockQueryPlanTests(TestCase):
+    """The per-item and per-BCN stock aggregates must not scan ItemParamDet"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.item = StockReportView.objects.create(Code='I001', Name='Shirt', MasterType='6')
+        create_bcn_rows(20, cls.item)
+
+    def assertUsesIndex(self, func, *args):
+        with CaptureQueriesContext(connection) as ctx:
+            func(*args)
+        for query in ctx.captured_queries:
+            with connection.cursor() as cursor:
+                cursor.execute('EXPLAIN QUERY PLAN ' + query['sql'])
+                plan = [row[-1] for row in cursor.fetchall()]
+            self.assertTrue(any('INDEX' in line for line in plan), plan)
+            for line in plan:
+                self.assertNotRegex(line, r'^SCAN core_itemparamdet$')
+
+    def test_item_aggregates_use_indexes(self):
+        start, end = datetime.date(2024, 1, 1), datetime.date(2024, 12, 31)
+        for method in (self.item.get_opening_stock, self.item.get_closing_stock, self.item.get_movement):
+            self.assertUsesIndex(method, start, end)
+
+    def test_bcn_aggregates_use_indexes(self):
+        start, end = datetime.date(2024, 1, 1), datetime.date(2024, 12, 31)
+        for method in (ParameterStockView.get_opening_stock_by_bcn,
+                       ParameterStockView.get_closing_stock_by_bcn,
+                       ParameterStockView.get_movement_by_bcn):
+            self.assertUsesIndex(method, 'BCN00001', start, end)
+
+
+class StockExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        cls.items = []
+        for i in range(3):
+            item = StockReportView.objects.create(Code=f'I{i:03d}', Name=f'Item {i}', MasterType='6')
+            ItemParamDet.objects.create(ItemCode=item, VchType=1, Value1=5, VchNo='1',
+                                        Date=datetime.date(2024, 1, 1), C1='Red')
+            cls.items.append(item)
+
+    def setUp(self):
+        stock_cache.clear()
+        # Load the active profile up front so it is not counted as a report query
+        UserProfile.get_active_config()
+        self.client.force_login(self.user)
+
+    def export(self, url, action, ids):
+        response = self.client.post(url, {'action': action, '_selected_action': ids})
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode().splitlines()
+
+    def test_stock_export_streams_annotated_figures(self):
+        lines = self.export('/admin/parameter/stockreportview/', 'export_stock_csv',
+                            [item.pk for item in self.items])
+        self.assertEqual(lines[0], 'Item Code,Item Name,Opening Stock,Closing Stock,Movement,Status')
+        self.assertEqual(lines[1], 'I000,Item 0,5.00,5.00,0.00,✅ In Stock')
+        self.assertEqual(len(lines), 4)
+
+    def test_parameter_export_streams_rows(self):
+        ids = list(ItemParamDet.objects.values_list('pk', flat=True))
+        lines = self.export('/admin/parameter/parameterstockview/', 'export_parameter_stock_csv', ids)
+        self.assertEqual(len(lines), 4)
+        self.assertIn('I000,Item 0,Red,,5.00,2024-01-01,1,Opening', lines)
+
+
+class StockReportChangelistTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+
+    def setUp(self):
+        stock_cache.clear()
+        # Load the active profile up front so it is not counted as a report query
+        UserProfile.get_active_config()
+        self.client.force_login(self.user)
+
+    def create_items(self, count, value):
+        for i in range(count):
+            item = StockReportView.objects.create(Code=f'{value}-{i:03d}', Name='Item', MasterType='6')
+            ItemParamDet.objects.create(ItemCode=item, VchType=1, Value1=value, VchNo='1',
+                                        Date=datetime.date(2024, 1, 1))
+
+    def get_changelist(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/admin/parameter/stockreportview/')
+        return response, len(ctx.captured_queries)
+
+    def test_summary_stats_use_constant_queries(self):
+        self.create_items(2, 5)
+        self.create_items(1, 0)
+        self.create_items(1, -3)
+        response, few = self.get_changelist()
+        self.assertEqual(response.context['summary_stats'], {
+            'total_items': 4, 'positive_stock': 2, 'zero_stock': 1, 'negative_stock': 1,
+        })
+
+        self.create_items(40, 7)
+        response, many = self.get_changelist()
+        self.assertEqual(response.context['summary_stats']['positive_stock'], 42)
+        self.assertEqual(few, many)
+
+
+class BCNStockSummaryChangelistTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        cls.item = Master1.objects.create(Code='I001', Name='Shirt', MasterType='6')
+
+    def setUp(self):
+        stock_cache.clear()
+        # Load the active profile up front so it is not counted as a report query
+        UserProfile.get_active_config()
+        self.client.force_login(self.user)
+
+    def get_changelist(self, **params):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/admin/parameter/bcnstocksummary/', params)
+        return response, len(ctx.captured_queries)
+
+    def test_pages_searches_and_orders_in_sql(self):
+        create_bcn_rows(10, self.item)
+        response, few = self.get_changelist()
+        self.assertEqual(response.context['cl'].result_count, 10)
+
+        ItemParamDet.objects.update(BCN=Concat(Value('A'), 'BCN'))
+        ItemParamDet.bump_ledger_version()
+        create_bcn_rows(120, self.item)
+        response, many = self.get_changelist()
+        cl = response.context['cl']
+        self.assertEqual(cl.result_count, 130)
+        self.assertEqual(len(cl.result_list), 50)
+        self.assertEqual(few, many)
+        self.assertEqual(response.context['summary']['positive_stock'], 130)
+
+        response, _ = self.get_changelist(q='ABCN00007')
+        self.assertEqual([row.bcn for row in response.context['cl'].result_list], ['ABCN00007'])
+
+        response, _ = self.get_changelist(o='-1')
+        self.assertEqual(response.context['cl'].result_list[0].bcn, 'BCN00119')
+
+
+class StockSnapshotTests(TestCase):
+    RANGES = StockLedgerTests.RANGES + [
+        (datetime.date(2024, 3, 5), datetime.date(2024, 3, 5)),
+        (datetime.date(2025, 1, 1), None),
+    ]
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.items = [StockReportView.objects.create(Code=f'I{i:03d}', Name='Item', MasterType='6')
+                     for i in range(3)]
+        create_bcn_rows(4, cls.items[0])
+        for i, item in enumerate(cls.items[1:], start=1):
+            for vch_type, value, date in [(1, 7 * i, datetime.date(2024, 1, 1)),
+                                          (4, 2, datetime.date(2024, 2, 10)),
+                                          (3, 5, datetime.date(2024, 3, 5)),
+                                          (6, 9, datetime.date(2024, 3, 6))]:
+                ItemParamDet.objects.create(ItemCode=item, VchType=vch_type, Value1=value, VchNo='1',
+                                            BCN=f'X{i}', Date=date)
+        StockReportView.objects.create(Code='EMPTY', Name='No rows', MasterType='6')
+
+    def test_item_figures_match_sql(self):
+        snapshot = StockSnapshot.load()
+        for start, end in self.RANGES:
+            expected = [(i.pk, i.opening_stock, i.closing_stock, i.movement, i.stock_status)
+                        for i in StockReportView.objects.order_by('pk').with_stock_figures(start, end)]
+            with self.assertNumQueries(1):
+                rows = StockReportView.objects.order_by('pk').with_snapshot_figures(start, end, snapshot)
+            self.assertEqual(
+                [(i.pk, i.opening_stock, i.closing_stock, i.movement, i.stock_status) for i in rows],
+                expected,
+            )
+
+    def test_bcn_figures_match_sql(self):
+        snapshot = StockSnapshot.load()
+        for start, end in self.RANGES:
+            expected = [(s.bcn, s.opening_stock, s.closing_stock, s.movement)
+                        for s in BCNStockSummary.get_queryset(start, end)]
+            rows = BCNStockSummary.objects.with_snapshot_figures(start, end, snapshot)
+            self.assertEqual([(s.bcn, s.opening_stock, s.closing_stock, s.movement) for s in rows],
+                             expected)
+        self.assertEqual(snapshot.bcn_figures(['MISSING'])['MISSING'], (0.0, 0.0, 0.0))
+
+    def test_parameter_set_figures_match_sql(self):
+        # create_bcn_rows() bulk loads its rows without a parameter set
+        rows = list(ItemParamDet.objects.filter(ParamSet__isnull=True))
+        ItemParamDet.assign_parameter_sets(rows)
+        ItemParamDet.objects.bulk_update(rows, ['ParamSet'])
+        snapshot = StockSnapshot.load()
+        for start, end in self.RANGES:
+            expected = [(s.pk, s.opening_stock, s.closing_stock, s.movement, s.stock_status)
+                        for s in ParameterSetStockView.objects.order_by('pk').with_stock_figures(start, end)]
+            rows = ParameterSetStockView.objects.order_by('pk').with_snapshot_figures(start, end, snapshot)
+            self.assertEqual(
+                [(s.pk, s.opening_stock, s.closing_stock, s.movement, s.stock_status) for s in rows],
+                expected,
+            )
+        self.assertEqual(len(expected), 2)
+
+    def test_refresh_rereads_only_changed_dates(self):
+        snapshot = StockSnapshot.load()
+        item = self.items[1]
+        # Changed behind the snapshot's back, before the refreshed dates: not read again
+        ItemParamDet.objects.filter(ItemCode=item, Date=datetime.date(2024, 1, 1)).update(Value1=100)
+        ItemParamDet.objects.create(ItemCode=item, VchType=2, Value1=4, VchNo='2', BCN='X1',
+                                    Date=datetime.date(2024, 3, 10))
+        ItemParamDet.objects.filter(ItemCode=item, Date=datetime.date(2024, 3, 6)).delete()
+
+        refreshed = snapshot.refresh(datetime.date(2024, 3, 6), ItemParamDet.get_ledger_version())
+        self.assertEqual(refreshed.row_count, snapshot.row_count)
+        self.assertEqual(refreshed.item_figures([item.pk])[item.pk], (7.0, 7 + 2 - 5 + 4, 2 - 5 + 4))
+        self.assertEqual(StockSnapshot.load().item_figures([item.pk])[item.pk], (100.0, 101.0, 1.0))
+
+    def test_current_snapshot_follows_ledger_changes(self):
+        first = current_snapshot()
+        self.assertIs(current_snapshot(), first)
+        ItemParamDet.objects.create(ItemCode=self.items[2], VchType=2, Value1=4, VchNo='2',
+                                    Date=datetime.date(2024, 3, 10))
+        with CaptureQueriesContext(connection) as ctx:
+            second = current_snapshot()
+        self.assertEqual(second.row_count, first.row_count + 1)
+        loads = [q['sql'] for q in ctx.captured_queries if 'core_itemparamdet' in q['sql']]
+        self.assertEqual(len(loads), 1)
+        self.assertIn('>=', loads[0])
+
+
+class StockResultCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.item = Master1.objects.create(Code='I001', Name='Shirt', MasterType='6')
+
+    def setUp(self):
+        self.cache = StockResultCache(max_entries=3, timeout=300)
+        self.calls = 0
+
+    def compute(self):
+        self.calls += 1
+        return self.calls
+
+    def lookup(self, start, end, scope='figures', items=('I001',)):
+        return self.cache.get_or_compute(scope, items, start, end, self.compute)
+
+    def add_row(self, date):
+        return ItemParamDet.objects.create(ItemCode=self.item, VchType=2, Value1=1, VchNo='1', Date=date)
+
+    def test_repeated_lookup_is_a_hit(self):
+        self.assertEqual(self.lookup(datetime.date(2024, 1, 1), datetime.date(2024, 1, 31)), 1)
+        self.assertEqual(self.lookup(datetime.date(2024, 1, 1), datetime.date(2024, 1, 31)), 1)
+        self.assertEqual(self.lookup(datetime.date(2024, 1, 1), datetime.date(2024, 1, 31), items=('I002',)), 2)
+        stats = self.cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['size']), (1, 2, 2))
+
+    def test_write_inside_period_evicts_and_later_write_does_not(self):
+        january = (datetime.date(2024, 1, 1), datetime.date(2024, 1, 31))
+        self.lookup(*january)
+        self.add_row(datetime.date(2024, 3, 1))
+        self.assertEqual(self.lookup(*january), 1)
+
+        row = self.add_row(datetime.date(2024, 3, 2))
+        row = ItemParamDet.objects.get(pk=row.pk)
+        row.Date = datetime.date(2024, 1, 15)
+        row.save()
+        self.assertEqual(self.lookup(*january), 2)
+        self.assertEqual(self.cache.stats()['stale'], 1)
+
+        row.delete()
+        self.assertEqual(self.lookup(*january), 3)
+
+    def test_ledger_queries_run_without_the_lock(self):
+        january = (datetime.date(2024, 1, 1), datetime.date(2024, 1, 31))
+        self.lookup(*january)
+        self.add_row(datetime.date(2024, 3, 1))
+        locked = []
+
+        def record_lock(execute, sql, params, many, context):
+            locked.append(self.cache._lock.locked())
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(record_lock):
+            self.assertEqual(self.lookup(*january), 1)
+        self.assertTrue(locked)
+        self.assertNotIn(True, locked)
+
+    def test_open_periods_expire_and_closed_periods_do_not(self):
+        self.cache.timeout = 0
+        self.lookup(datetime.date(2024, 1, 1), datetime.date(2024, 1, 31))
+        self.lookup(None, None)
+        self.assertEqual(self.lookup(datetime.date(2024, 1, 1), datetime.date(2024, 1, 31)), 1)
+        self.assertEqual(self.lookup(None, None), 3)
+        self.assertEqual(self.cache.stats()['expired'], 1)
+
+    def test_least_recently_used_entry_is_evicted(self):
+        for month in (1, 2, 3):
+            self.lookup(datetime.date(2024, month, 1), datetime.date(2024, month, 28))
+        self.lookup(datetime.date(2024, 1, 1), datetime.date(2024, 1, 28))
+        self.lookup(datetime.date(2024, 4, 1), datetime.date(2024, 4, 28))
+        self.assertEqual(self.cache.stats()['evictions'], 1)
+        self.assertEqual(self.lookup(datetime.date(2024, 1, 1), datetime.date(2024, 1, 28)), 1)
+        self.assertEqual(self.lookup(datetime.date(2024, 2, 1), datetime.date(2024, 2, 28)), 5)
+
+    def test_changelist_is_served_from_cache(self):
+        user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(user)
+        stock_cache.clear()
+        last_month = datetime.date.today().replace(day=1) - datetime.timedelta(days=1)
+        self.add_row(last_month)
+        params = {'date_range': 'last_month'}
+
+        with CaptureQueriesContext(connection) as cold:
+            response = self.client.get('/admin/parameter/stockreportview/', params)
+        with CaptureQueriesContext(connection) as warm:
+            response = self.client.get('/admin/parameter/stockreportview/', params)
+        self.assertLess(len(warm.captured_queries), len(cold.captured_queries))
+        self.assertEqual(response.context['cl'].result_list[0].closing_stock, 1)
+        self.assertEqual(response.context['summary_stats']['positive_stock'], 1)
+
+
+class BenchmarkTests(TestCase):
+    def test_run_records_every_scenario(self):
+        results = benchmarks.run(sizes=(200,))
+        self.assertEqual(ItemParamDet.objects.count(), 200)
+        self.assertEqual(set(results['200']), set(benchmarks.SCENARIOS))
+        for measurement in results['200'].values():
+            self.assertEqual(set(measurement), {'seconds', 'queries', 'peak_kb'})
+            self.assertGreater(measurement['queries'], 0)
+
+    def test_reseeding_skips_per_row_signals(self):
+        benchmarks.seed(200)
+        tables = {model._meta.db_table for model in benchmarks.SEEDED_TABLES}
+        deletes = []
+
+        def record(execute, sql, params, many, context):
+            if sql.startswith('DELETE') and any(f'"{table}"' in sql for table in tables):
+                deletes.append(sql)
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(record):
+            benchmarks.seed(100)
+        self.assertEqual(len(deletes), len(benchmarks.SEEDED_TABLES))
+        self.assertEqual(ItemParamDet.objects.count(), 100)
+
+    def test_compare_flags_regressions(self):
+        baseline = {'1000': {'page': {'seconds': 1.0, 'queries': 5, 'peak_kb': 4000}}}
+        self.assertEqual(benchmarks.compare(
+            {'1000': {'page': {'seconds': 1.2, 'queries': 5, 'peak_kb': 4100}}}, baseline), [])
+        self.assertEqual(benchmarks.compare(
+            {'1000': {'page': {'seconds': 2.0, 'queries': 6, 'peak_kb': 4000}},
+             '5000': {'page': {'seconds': 9.0, 'queries': 9, 'peak_kb': 9000}}}, baseline),
+            ['1000 page: queries 5 -> 6', '1000 page: seconds 1.0 -> 2.0'])
+
+    def test_compare_flags_throughput_drops(self):
+        baseline = {'1000': {'concurrent_reads_tuned': {'seconds': 2.0, 'reads_per_second': 400.0}}}
+        self.assertEqual(benchmarks.compare(
+            {'1000': {'concurrent_reads_tuned': {'seconds': 2.5, 'reads_per_second': 380.0}}}, baseline), [])
+        self.assertEqual(benchmarks.compare(
+            {'1000': {'concurrent_reads_tuned': {'seconds': 2.0, 'reads_per_second': 100.0}}}, baseline),
+            ['1000 concurrent_reads_tuned: reads_per_second 400.0 -> 100.0'])
+
+
+
+class ConcurrentReadsBenchmarkTests(TransactionTestCase):
+    # SQLite cannot back up the test database from inside TestCase's transaction
+    def setUp(self):
+        # The benchmark threads connect to databases of their own
+        databases = ConcurrentReadsBenchmarkTests.databases
+        ConcurrentReadsBenchmarkTests.databases = databases | {
+            f'benchmark_{name}' for name in benchmarks.CONCURRENCY_PROFILES}
+        self.addCleanup(setattr, ConcurrentReadsBenchmarkTests, 'databases', databases)
+
+    def test_concurrent_reads_under_each_profile(self):
+        for code in ('A1', 'A2'):
+            Master1.objects.create(Code=code, MasterType='6', Name='Shirt')
+        results = benchmarks.concurrent_reads(readers=2, rows=50)
+        self.assertEqual(set(results), {f'concurrent_reads_{name}' for name in benchmarks.CONCURRENCY_PROFILES})
+        for measurement in results.values():
+            self.assertEqual(measurement['errors'], 0)
+            self.assertGreater(measurement['inserted_rows_per_second'], 0)
+        # The inserts went to the copies only
+        self.assertFalse(ItemParamDet.objects.exists())
+
+class InstrumentationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        cls.item = Master1.objects.create(Code='I001', Name='Shirt', MasterType='6')
+        create_bcn_rows(3, cls.item)
+
+    def setUp(self):
+        metrics.clear()
+        self.client.force_login(self.user)
+
+    def test_queries_are_attributed_to_admin_methods(self):
+        model_admin = ParameterStockAdmin(ParameterStockView, admin.site)
+        rows = list(ParameterStockView.objects.order_by('pk')[:3])
+        with profile_queries('columns') as profile:
+            for row in rows:
+                model_admin.get_item_code(row)
+        summary = profile.summary()
+        self.assertEqual(summary['queries'], 3)
+        self.assertEqual(summary['by_origin']['ParameterStockAdmin.get_item_code']['queries'], 3)
+        self.assertEqual(list(summary['duplicates'].values()), [3])
+        self.assertEqual(len(summary['slowest']), 3)
+
+    def test_fingerprint_ignores_literals_and_list_lengths(self):
+        self.assertEqual(fingerprint("SELECT * FROM t WHERE id IN (%s, %s) AND name = 'a'"),
+                         fingerprint("SELECT * FROM t WHERE id IN (%s, %s, %s) AND name = 'b'"))
+
+    @override_settings(REPORT_INSTRUMENTATION={'SAMPLE_RATE': 1.0})
+    def test_sampled_requests_reach_logs_and_metrics(self):
+        with self.assertLogs('reports.instrumentation', 'INFO') as logs:
+            self.client.get('/admin/parameter/stockreportview/')
+            response = self.client.post('/admin/parameter/parameterstockview/',
+                                        {'action': 'export_parameter_stock_csv', 'select_across': '1', 'index': '0', '_selected_action': '0'})
+            self.assertEqual(len(logs.records), 1)
+            b''.join(response.streaming_content)
+        self.assertEqual(len(logs.records), 2)
+        self.assertIn('"queries"', logs.records[0].getMessage())
+
+        text = self.client.get('/metrics').content.decode()
+        self.assertIn('report_requests_total{view="admin:parameter_stockreportview_changelist"} 1', text)
+        self.assertIn('report_origin_queries_total{origin="ParameterStockAdmin.', text)
+        self.assertIn('stock_result_cache_hits_total', text)
+
+    @override_settings(REPORT_INSTRUMENTATION={'SAMPLE_RATE': 0.0, 'METRICS_TOKEN': 'secret'})
+    def test_metrics_token_and_unsampled_requests(self):
+        self.client.get('/admin/parameter/stockreportview/')
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        response = self.client.get('/metrics', headers={'Authorization': 'Bearer secret'})
+        self.assertNotIn('report_requests_total', response.content.decode())
+
+    @override_settings(REPORT_INSTRUMENTATION={'SAMPLE_RATE': 1.0, 'PATH_PREFIXES': ('/api/stock/',)},
+                       STOCK_API={'TOKENS': ['secret']})
+    async def test_async_streaming_responses_are_profiled(self):
+        with self.assertLogs('reports.instrumentation', 'INFO') as logs:
+            response = await self.async_client.get('/api/stock/items/', headers={'Authorization': 'Bearer secret'})
+            body = b''.join([chunk async for chunk in response.streaming_content])
+        self.assertEqual(json.loads(body)['results'][0]['code'], 'I001')
+        self.assertEqual(len(logs.records), 1)
+        self.assertIn('"view": "stock_figures"', logs.records[0].getMessage())
+
+    def test_metrics_require_staff_without_token(self):
+        self.client.logout()
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        staff = User.objects.create_user('viewer', password='password', is_staff=True)
+        self.client.force_login(staff)
+        self.assertEqual(self.client.get('/metrics').status_code, 200)
+        staff.is_staff = False
+        staff.save()
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+
+
+class ParameterSearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        shirt = Master1.objects.create(Code='SH01', Name='Cotton Shirt', MasterType='6')
+        jeans = Master1.objects.create(Code='JN01', Name='Denim Jeans', MasterType='6')
+        for item, c1, c2, bcn in [(shirt, 'Red', 'XL', 'B-100'), (shirt, 'Blue', 'M', 'B-101'),
+                                  (jeans, 'Blue', 'XL', 'B-200'), (jeans, 'Black', '32', 'C-300')]:
+            ItemParamDet.objects.create(ItemCode=item, C1=c1, C2=c2, BCN=bcn, VchNo='7', VchType=2,
+                                        Value1=1, Date=datetime.date(2024, 1, 1))
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def search(self, term):
+        response = self.client.get('/admin/parameter/parameterstockview/', {'q': term})
+        return sorted(row.BCN for row in response.context['cl'].result_list)
+
+    def test_tokens_follow_saves_and_deletes(self):
+        row = ItemParamDet.objects.get(BCN='C-300')
+        self.assertEqual(set(row.search_tokens.values_list('token', flat=True)), {'black', '32', 'c', '300', '7'})
+        row.C1 = 'Grey'
+        row.save()
+        self.assertIn('grey', row.search_tokens.values_list('token', flat=True))
+        row.delete()
+        self.assertFalse(ParameterSearchToken.objects.filter(token='grey').exists())
+
+    def test_searches_by_token_prefix_and_item(self):
+        self.assertEqual(self.search('blue'), ['B-101', 'B-200'])
+        self.assertEqual(self.search('bl'), ['B-101', 'B-200', 'C-300'])
+        self.assertEqual(self.search('blue xl'), ['B-200'])
+        self.assertEqual(self.search('denim'), ['B-200', 'C-300'])
+        self.assertEqual(self.search('b-10'), ['B-100', 'B-101'])
+        self.assertEqual(self.search('"cotton shirt" red'), ['B-100'])
+
+    def test_falls_back_to_column_search_without_index(self):
+        # A bulk load that skipped the index, leaving a partial one behind
+        ParameterSearchToken.objects.filter(token='blue').delete()
+        bulk_changed(None)
+        self.assertFalse(search.index_ready())
+        # icontains matches inside words, which the token index does not
+        self.assertEqual(self.search('lue'), ['B-101', 'B-200'])
+
+        search.rebuild()
+        self.assertTrue(search.index_ready())
+        self.assertEqual(self.search('lue'), [])
+        self.assertEqual(self.search('blue'), ['B-101', 'B-200'])
+        self.assertEqual(ParameterSearchToken.objects.filter(token='xl').count(), 2)
+
+    def test_partial_rebuild_clears_only_a_covered_gap(self):
+        bulk_changed(datetime.date(2024, 1, 1))
+        bulk_changed(datetime.date(2024, 3, 1))
+        search.rebuild(since=datetime.date(2024, 2, 1))
+        self.assertFalse(search.index_ready())
+        search.rebuild(since=datetime.date(2024, 1, 1))
+        self.assertTrue(search.index_ready())
+
+    @unittest.skipUnless(connection.vendor == 'sqlite', "EXPLAIN QUERY PLAN is SQLite specific")
+    def test_token_lookup_uses_index(self):
+        sql, params = search.prefix_matches('blue').query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            plan = ' '.join(row[-1] for row in cursor.fetchall())
+        self.assertIn('SEARCH', plan)
+        self.assertIn('search_token_token_row', plan)
+
+
+
+class ParameterFacetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        cls.shirt = Master1.objects.create(Code='SH01', Name='Cotton Shirt', MasterType='6')
+        for c1, bcn, vch_type in [('Red', 'B-100', 2), ('Blue', 'B-101', 2), ('Blue', 'B-102', 9)]:
+            ItemParamDet.objects.create(ItemCode=cls.shirt, C1=c1, BCN=bcn, VchNo='7', VchType=vch_type,
+                                        Value1=1, Date=datetime.date(2024, 1, 1))
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def counts(self, field):
+        return dict(ParameterFacet.objects.filter(field=field).values_list('value', 'count'))
+
+    def test_counts_follow_saves_and_deletes(self):
+        self.assertEqual(self.counts('C1'), {'Red': 1, 'Blue': 2})
+        self.assertEqual(self.counts('VchType'), {'2': 2, '9': 1})
+        self.assertEqual(self.counts('ItemCode__Code'), {'SH01': 3})
+
+        row = ItemParamDet.objects.get(BCN='B-100')
+        row.C1 = 'Blue'
+        row.save()
+        self.assertEqual(self.counts('C1'), {'Blue': 3})
+        row.delete()
+        self.assertEqual(self.counts('C1'), {'Blue': 2})
+        self.assertEqual(self.counts('BCN'), {'B-101': 1, 'B-102': 1})
+
+    def test_rebuild_matches_incremental_counts(self):
+        expected = list(ParameterFacet.objects.values_list('field', 'value', 'count'))
+        ParameterFacet.objects.all().delete()
+        self.assertEqual(facets.choices('C1'), [('Blue', 2), ('Red', 1)])
+        facets.rebuild()
+        self.assertCountEqual(ParameterFacet.objects.values_list('field', 'value', 'count'), expected)
+
+    def test_changelist_filters_do_not_scan_rows(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/admin/parameter/parameterstockview/', {'C1': 'Blue'})
+        self.assertEqual(len(response.context['cl'].result_list), 2)
+        # Only date_hierarchy still selects distinct values (of Date)
+        distinct = [q['sql'] for q in ctx.captured_queries if 'DISTINCT' in q['sql'].upper()]
+        self.assertFalse([sql for sql in distinct if '"datefield"' not in sql])
+        self.assertContains(response, 'Blue (2)')
+        # Autocomplete filters only render the selected value
+        self.assertNotContains(response, 'B-100')
+        self.assertContains(response, 'facets/BCN/')
+
+    def test_autocomplete_suggestions(self):
+        response = self.client.get('/admin/parameter/parameterstockview/facets/BCN/', {'term': 'b-10'})
+        self.assertEqual([result['value'] for result in response.json()['results']],
+                         ['B-100', 'B-101', 'B-102'])
+        response = self.client.get('/admin/parameter/parameterstockview/facets/VchNo/')
+        self.assertEqual(response.status_code, 404)
+
+
+class ReportJobTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        cls.item = Master1.objects.create(Code='I001', Name='Shirt', MasterType='6')
+        create_bcn_rows(3, cls.item)
+
+    def setUp(self):
+        result_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, result_dir)
+        settings_override = override_settings(REPORT_JOBS={'RESULT_DIR': result_dir})
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.client.force_login(self.user)
+
+    def run_worker(self):
+        out = io.StringIO()
+        call_command('run_report_worker', processes=0, once=True, stdout=out)
+        return out.getvalue()
+
+    def test_submit_run_and_download(self):
+        response = self.client.post('/reports/jobs/', {'kind': 'bcn_summary_csv', 'end_date': '2024-02-15'})
+        self.assertEqual(response.status_code, 202)
+        status_url = response['Location']
+        self.assertEqual(self.client.get(status_url).json()['status'], 'queued')
+
+        self.assertIn('done', self.run_worker())
+        status = self.client.get(status_url).json()
+        self.assertEqual((status['status'], status['progress'], status['rows_total']), ('done', 1.0, 3))
+        # The header row is not counted
+        self.assertEqual(ReportJob.objects.get().rows_done, 3)
+
+        response = self.client.get(status['download_url'])
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0].split(',')[0], 'BCN')
+        # Opening 10 plus the February receipt of 5
+        self.assertEqual(lines[1].split(',')[5], '15.00')
+        self.assertEqual(len(lines), 4)
+
+    def test_rejects_bad_requests(self):
+        self.assertEqual(self.client.post('/reports/jobs/', {'kind': 'bogus'}).status_code, 400)
+        self.assertEqual(self.client.post('/reports/jobs/', {
+            'kind': 'stock_report_csv', 'start_date': '15/02/2024'}).status_code, 400)
+        job = jobs.submit('stock_report_csv', user=self.user)
+        self.assertEqual(self.client.get(f'/reports/jobs/{job.pk}/download/').status_code, 409)
+
+        clerk = User.objects.create_user('clerk', password='password', is_staff=True)
+        self.client.force_login(clerk)
+        self.assertEqual(self.client.get(f'/reports/jobs/{job.pk}/').status_code, 404)
+        self.client.force_login(User.objects.create_user('guest', password='password'))
+        self.assertEqual(self.client.post('/reports/jobs/', {'kind': 'stock_report_csv'}).status_code, 403)
+
+    def test_admin_action_queues_selected_rows(self):
+        response = self.client.post('/admin/parameter/stockreportview/', {
+            'action': 'queue_stock_csv', 'index': '0', '_selected_action': [str(self.item.pk)],
+        })
+        self.assertEqual(response.status_code, 302)
+        job = ReportJob.objects.get()
+        self.assertEqual((job.kind, job.params['ids'], job.created_by), ('stock_report_csv', [str(self.item.pk)], self.user))
+
+        self.run_worker()
+        job.refresh_from_db()
+        with open(jobs.result_path(job)) as result:
+            self.assertIn('I001,Shirt,30.00,36.00,6.00', result.read())
+
+    def test_abandoned_jobs_are_failed(self):
+        stale = jobs.submit('bcn_summary_csv')
+        ReportJob.objects.filter(pk=stale.pk).update(
+            status=ReportJob.RUNNING, worker='gone:1', started_at=timezone.now() - datetime.timedelta(days=1))
+        jobs.partial_path(stale).parent.mkdir(parents=True, exist_ok=True)
+        jobs.partial_path(stale).touch()
+        running = jobs.submit('bcn_summary_csv')
+        ReportJob.objects.filter(pk=running.pk).update(status=ReportJob.RUNNING, started_at=timezone.now())
+
+        with self.assertLogs('parameter.jobs', 'ERROR'):
+            self.assertIsNone(jobs.claim_next('worker:2'))
+        stale.refresh_from_db()
+        self.assertEqual(stale.status, ReportJob.FAILED)
+        self.assertIn('Abandoned', stale.error)
+        self.assertFalse(jobs.partial_path(stale).exists())
+        self.assertEqual(ReportJob.objects.get(pk=running.pk).status, ReportJob.RUNNING)
+
+    def test_failures_are_recorded(self):
+        job = ReportJob.objects.create(kind='retired_kind')
+        with self.assertLogs('parameter.jobs', 'ERROR'):
+            self.assertIn('failed', self.run_worker())
+        job.refresh_from_db()
+        self.assertEqual(job.status, ReportJob.FAILED)
+        self.assertIn('KeyError', job.error)
+        self.assertEqual(jobs.purge_expired(keep_days=-1), 1)
+
+
+@override_settings(STOCK_API={'TOKENS': ['secret'], 'CHUNK_SIZE': 2})
+class StockApiTests(TestCase):
+    auth = {'Authorization': 'Bearer secret'}
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.item = Master1.objects.create(Code='I001', Name='Shirt', MasterType='6')
+        create_bcn_rows(3, cls.item)
+        rows = list(ItemParamDet.objects.all())
+        ItemParamDet.assign_parameter_sets(rows)
+        ItemParamDet.objects.bulk_update(rows, ['ParamSet'])
+
+    async def get(self, url, **headers):
+        response = await self.async_client.get(url, headers=dict(self.auth, **headers))
+        if response.status_code == 200:
+            response.body = b''.join([chunk async for chunk in response.streaming_content]).decode()
+        return response
+
+    async def test_figures_by_dimension(self):
+        response = await self.get('/api/stock/items/')
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.body)
+        self.assertEqual(data['results'], [
+            {'code': 'I001', 'name': 'Shirt', 'opening': 30.0, 'closing': 36.0, 'movement': 6.0},
+        ])
+
+        data = json.loads((await self.get('/api/stock/bcns/?end_date=2024-02-15&key=BCN00001')).body)
+        self.assertEqual(data['end_date'], '2024-02-15')
+        self.assertEqual([(row['bcn'], row['closing']) for row in data['results']], [('BCN00001', 15.0)])
+
+        data = json.loads((await self.get('/api/stock/parameter-sets/')).body)
+        self.assertEqual([(row['label'], row['closing']) for row in data['results']], [('Red | M', 36.0)])
+
+    async def test_ndjson_streams_one_row_per_line(self):
+        response = await self.get('/api/stock/bcns/', Accept='application/x-ndjson')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in response.body.splitlines()]
+        self.assertEqual([row['bcn'] for row in rows], ['BCN00000', 'BCN00001', 'BCN00002'])
+        self.assertEqual(rows[0]['closing'], 12.0)
+
+    async def test_etag_follows_ledger_version(self):
+        response = await self.get('/api/stock/items/?format=ndjson')
+        etag = response['ETag']
+        self.assertEqual((await self.get('/api/stock/items/?format=ndjson', If_None_Match=etag)).status_code, 304)
+        self.assertNotEqual((await self.get('/api/stock/items/'))['ETag'], etag)
+
+        await ItemParamDet.objects.filter(BCN='BCN00000', VchType=9).adelete()
+        response = await self.get('/api/stock/items/?format=ndjson', If_None_Match=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.body)['closing'], 39.0)
+
+    async def test_etag_follows_item_sync(self):
+        profile = await UserProfile.objects.acreate(
+            sql_host='http://localhost', server='HOST', sql_username='sa', sql_password='secret',
+            sql_database='Busy', company_name='Demo', is_active=True)
+        etag = (await self.get('/api/stock/items/'))['ETag']
+        self.assertEqual((await self.get('/api/stock/items/', If_None_Match=etag)).status_code, 304)
+
+        # sync_items renames masters with bulk_create, leaving the ledger version alone
+        await Master1.objects.filter(pk=self.item.pk).aupdate(Name='Linen Shirt')
+        await sync_to_async(record_item_sync)(profile)
+        response = await self.get('/api/stock/items/', If_None_Match=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.body)['results'][0]['name'], 'Linen Shirt')
+
+    async def test_rejects_bad_requests(self):
+        self.assertEqual((await self.async_client.get('/api/stock/items/')).status_code, 403)
+        self.assertEqual((await self.get('/api/stock/items/', Authorization='Bearer secrets')).status_code, 403)
+        self.assertEqual((await self.get('/api/stock/colours/')).status_code, 404)
+        self.assertEqual((await self.get('/api/stock/items/?start_date=15/02/2024')).status_code, 400)
+        self.assertEqual((await self.get('/api/stock/parameter-sets/?key=abc')).status_code, 400)
+        set_id = await ParameterSetStockView.objects.values_list('pk', flat=True).afirst()
+        data = json.loads((await self.get(f'/api/stock/parameter-sets/?key={set_id}')).body)
+        self.assertEqual([row['id'] for row in data['results']], [set_id])
+
+        staff = await User.objects.acreate(username='clerk', is_staff=True)
+        await self.async_client.aforce_login(staff)
+        self.assertEqual((await self.async_client.get('/api/stock/items/')).status_code, 200)
+
+
+class ReportingRouterTests(TestCase):
+    def setUp(self):
+        self.router = reporting.ReportingRouter()
+        self.addCleanup(reporting.replica_state.reset)
+        self.addCleanup(cache.delete, reporting.state_key('reporting'))
+        cache.delete(reporting.state_key('reporting'))
+
+    def test_reads_follow_refresh_state(self):
+        # Never refreshed: everything reads from default
+        self.assertIsNone(self.router.db_for_read(StockReportView))
+
+        version = ItemParamDet.get_ledger_version()
+        call_command('refresh_reporting_database', mark_only=True, stdout=io.StringIO())
+        self.assertEqual(self.router.db_for_read(StockReportView), 'reporting')
+        self.assertEqual(self.router.db_for_read(BCNStockSummary), 'reporting')
+        self.assertIsNone(self.router.db_for_read(Master1))
+        self.assertIsNone(self.router.db_for_read(UserProfile))
+        self.assertEqual(self.router.db_for_write(ParameterStockView), 'default')
+
+        # A change within MAX_LAG of the refresh still reads the copy, stamped with its version
+        new_version = ItemParamDet.bump_ledger_version()
+        reporting.replica_state.reset()
+        self.assertEqual(self.router.db_for_read(StockReportView), 'reporting')
+        self.assertEqual(reporting.read_version(), version)
+
+        reporting.mark_refreshed('reporting', version, time.time() - 600)
+        self.assertIsNone(self.router.db_for_read(StockReportView))
+        self.assertEqual(reporting.read_version(), new_version)
+
+    @override_settings(REPORTING_DATABASE={'ALIAS': None})
+    def test_unconfigured_alias_reads_default(self):
+        with self.assertRaises(CommandError):
+            call_command('refresh_reporting_database', stdout=io.StringIO())
+        self.assertIsNone(self.router.db_for_read(StockReportView))
+        self.assertIsNone(self.router.db_for_write(StockReportView))
@@ -1,3 +1,87 @@
-from django.shortcuts import render
+"""Submit, status and download endpoints of the background report jobs"""
+import functools
 
-# Create your views here.
+from django.http import FileResponse, Http404, JsonResponse
+from django.urls import reverse
+from django.views.decorators.http import require_GET, require_POST
+
+from . import jobs
+from .models import ReportJob
+
+
+def staff_required(view):
+    """Answer JSON 403 instead of the admin login redirect for non-staff users"""
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not (request.user.is_active and request.user.is_staff):
+            return JsonResponse({'error': "Staff login required"}, status=403)
+        return view(request, *args, **kwargs)
+    return wrapper
+
+
+def get_job(request, job_id):
+    """Return a job the user may see: their own, or any for superusers"""
+    queryset = ReportJob.objects.all()
+    if not request.user.is_superuser:
+        queryset = queryset.filter(created_by=request.user)
+    try:
+        return queryset.get(pk=job_id)
+    except ReportJob.DoesNotExist:
+        raise Http404("No such report job")
+
+
+def job_status(job):
+    status = {
+        'id': job.pk,
+        'kind': job.kind,
+        'params': job.params,
+        'status': job.status,
+        'progress': job.progress,
+        'rows_done': job.rows_done,
+        'rows_total': job.rows_total,
+        'created_at': job.created_at,
+        'started_at': job.started_at,
+        'finished_at': job.finished_at,
+        'status_url': reverse('report_job_status', args=[job.pk]),
+    }
+    if job.status == ReportJob.DONE:
+        status['download_url'] = reverse('report_job_download', args=[job.pk])
+    if job.status == ReportJob.FAILED:
+        status['error'] = job.error.strip().splitlines()[-1] if job.error.strip() else ''
+    return status
+
+
+@require_POST
+@staff_required
+def submit_report_job(request):
+    """Queue a job: POST kind plus optional start_date, end_date (YYYY-MM-DD) and ids"""
+    kind = request.POST.get('kind')
+    params = {name: request.POST[name] for name in ('start_date', 'end_date') if request.POST.get(name)}
+    if request.POST.getlist('ids'):
+        params['ids'] = request.POST.getlist('ids')
+    try:
+        job = jobs.submit(kind, params, request.user)
+    except ValueError as exc:
+        return JsonResponse({'error': str(exc), 'kinds': sorted(jobs.JOB_KINDS)}, status=400)
+    response = JsonResponse(job_status(job), status=202)
+    response['Location'] = reverse('report_job_status', args=[job.pk])
+    return response
+
+
+@require_GET
+@staff_required
+def report_job_status(request, job_id):
+    return JsonResponse(job_status(get_job(request, job_id)))
+
+
+@require_GET
+@staff_required
+def download_report_job(request, job_id):
+    job = get_job(request, job_id)
+    if job.status != ReportJob.DONE:
+        return JsonResponse(dict(job_status(job), error="Report is not ready"), status=409)
+    path = jobs.result_path(job)
+    if not path.exists():
+        raise Http404("Report file has been purged")
+    return FileResponse(open(path, 'rb'), as_attachment=True,
+                        filename=jobs.JOB_KINDS[job.kind].filename, content_type='text/csv')
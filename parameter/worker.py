@@ -0,0 +1,20 @@
+"""Entry points of run_report_worker's pool processes
+
+Pool processes are spawned, so they import this module before Django is
+set up; it must not import models at module level.
+"""
+
+
+def init_worker():
+    import django
+    django.setup()
+
+
+def run_job(job_id):
+    from django.db import connections
+    from .jobs import run_job
+
+    try:
+        return run_job(job_id)
+    finally:
+        connections.close_all()
@@ -0,0 +1,321 @@
+"""Per-request SQL instrumentation for the admin reports
+
+QueryProfile hooks into every database connection through
+execute_wrappers and records, for each statement, its duration, a
+fingerprint of its SQL and the ModelAdmin method that issued it (for
+example StockReportAdmin.display_closing_stock). Use it directly:
+
+    with profile_queries('month end export') as profile:
+        ...
+    profile.summary()
+
+or through QueryInstrumentationMiddleware, which profiles a sample of
+requests, writes one JSON log line per profiled request to the
+'reports.instrumentation' logger and feeds the counters served in
+Prometheus text format by metrics_view at /metrics.
+"""
+import hashlib
+import heapq
+import hmac
+import json
+import logging
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.contrib.admin import ModelAdmin
+from django.db import connections
+from django.http import HttpResponse, HttpResponseForbidden
+
+logger = logging.getLogger('reports.instrumentation')
+
+# Defaults for settings.REPORT_INSTRUMENTATION
+INSTRUMENTATION_DEFAULTS = {
+    'SAMPLE_RATE': 0.05,              # fraction of requests profiled
+    'PATH_PREFIXES': ('/admin/',),    # only requests under these paths
+    'TOP_N': 5,                       # slowest statements kept per request
+    'METRICS_TOKEN': None,            # bearer token for /metrics; staff login when None
+}
+
+
+def get_instrumentation_settings():
+    """Return the instrumentation settings merged over the defaults"""
+    options = dict(INSTRUMENTATION_DEFAULTS)
+    options.update(getattr(settings, 'REPORT_INSTRUMENTATION', {}))
+    return options
+
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER_LISTS = re.compile(r"\((?:\s*(?:%s|\?)\s*,)+\s*(?:%s|\?)\s*\)")
+
+
+def fingerprint(sql):
+    """Short hash of a statement with literals and IN lists normalized"""
+    normalized = _PLACEHOLDER_LISTS.sub('(?)', _LITERALS.sub('?', sql))
+    return hashlib.sha1(normalized.encode()).hexdigest()[:12]
+
+
+# Modules of execute wrappers, which sit between every statement and its caller
+PASSTHROUGH_MODULES = frozenset({'core.sqlite'})
+
+
+def attribute(frame):
+    """Name the ModelAdmin method (or project function) a query came from
+
+    A method defined in the project wins over one inherited from Django
+    (such as changelist_view), which wins over any other project function.
+    """
+    inherited = project = None
+    base_dir = str(settings.BASE_DIR)
+    while frame is not None:
+        code = frame.f_code
+        filename = code.co_filename
+        if filename != __file__:
+            in_project = filename.startswith(base_dir) and 'site-packages' not in filename
+            # type() rather than isinstance(): lazy objects would evaluate themselves
+            owner = type(frame.f_locals.get('self'))
+            if issubclass(owner, ModelAdmin):
+                if in_project:
+                    return f"{owner.__name__}.{code.co_name}"
+                inherited = inherited or f"{owner.__name__}.{code.co_name}"
+            elif in_project and project is None:
+                module = frame.f_globals.get('__name__', '?')
+                if module not in PASSTHROUGH_MODULES:
+                    project = f"{module}.{code.co_name}"
+        frame = frame.f_back
+    return inherited or project or 'unattributed'
+
+
+class QueryProfile:
+    """Statements run on any connection between start() and stop()"""
+
+    def __init__(self, label='', top_n=None):
+        self.label = label
+        self.top_n = top_n or get_instrumentation_settings()['TOP_N']
+        self.count = 0
+        self.db_seconds = 0.0
+        self.fingerprints = Counter()
+        self.by_origin = {}
+        self.slowest = []
+        self.started = self.elapsed = None
+        self._connections = []
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.record(sql, time.perf_counter() - started, attribute(sys._getframe(1)))
+
+    def record(self, sql, seconds, origin):
+        with self._lock:
+            self.count += 1
+            self.db_seconds += seconds
+            self.fingerprints[fingerprint(sql)] += 1
+            count, total = self.by_origin.get(origin, (0, 0.0))
+            self.by_origin[origin] = (count + 1, total + seconds)
+            entry = (seconds, self.count, sql[:500], origin)
+            if len(self.slowest) < self.top_n:
+                heapq.heappush(self.slowest, entry)
+            else:
+                heapq.heappushpop(self.slowest, entry)
+
+    def start(self):
+        self.started = time.perf_counter()
+        for connection in connections.all():
+            connection.execute_wrappers.append(self)
+            self._connections.append(connection)
+        return self
+
+    def stop(self):
+        for connection in self._connections:
+            if self in connection.execute_wrappers:
+                connection.execute_wrappers.remove(self)
+        self._connections = []
+        if self.started is not None and self.elapsed is None:
+            self.elapsed = time.perf_counter() - self.started
+        return self
+
+    @property
+    def duplicates(self):
+        """Fingerprints run more than once, with their counts"""
+        return {key: count for key, count in self.fingerprints.items() if count > 1}
+
+    def summary(self):
+        return {
+            'label': self.label,
+            'seconds': round(self.elapsed or 0.0, 4),
+            'queries': self.count,
+            'db_seconds': round(self.db_seconds, 4),
+            'duplicates': self.duplicates,
+            'by_origin': {origin: {'queries': count, 'db_seconds': round(total, 4)}
+                          for origin, (count, total) in self.by_origin.items()},
+            'slowest': [{'seconds': round(seconds, 4), 'sql': sql, 'origin': origin}
+                        for seconds, _, sql, origin in sorted(self.slowest, reverse=True)],
+        }
+
+
+@contextmanager
+def profile_queries(label='', top_n=None):
+    """Context manager profiling the statements run inside the block"""
+    profile = QueryProfile(label, top_n).start()
+    try:
+        yield profile
+    finally:
+        profile.stop()
+
+
+class MetricsRegistry:
+    """Process-local counters rendered in Prometheus text format"""
+
+    HELP = {
+        'report_requests_total': 'Profiled report requests',
+        'report_request_seconds_total': 'Wall time of profiled report requests',
+        'report_db_queries_total': 'SQL statements run by profiled report requests',
+        'report_db_seconds_total': 'Database time of profiled report requests',
+        'report_duplicate_queries_total': 'Statements repeating an earlier fingerprint in the same request',
+        'report_origin_queries_total': 'SQL statements by issuing ModelAdmin method',
+        'report_origin_db_seconds_total': 'Database time by issuing ModelAdmin method',
+    }
+
+    def __init__(self):
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name, labels, amount=1):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def observe(self, view, profile):
+        labels = {'view': view}
+        self.inc('report_requests_total', labels)
+        self.inc('report_request_seconds_total', labels, profile.elapsed or 0.0)
+        self.inc('report_db_queries_total', labels, profile.count)
+        self.inc('report_db_seconds_total', labels, profile.db_seconds)
+        self.inc('report_duplicate_queries_total', labels,
+                 sum(count - 1 for count in profile.duplicates.values()))
+        for origin, (count, seconds) in profile.by_origin.items():
+            self.inc('report_origin_queries_total', {'origin': origin}, count)
+            self.inc('report_origin_db_seconds_total', {'origin': origin}, seconds)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def render(self, extra=()):
+        """Prometheus text exposition of the counters plus extra (name, type, help, value) rows"""
+        with self._lock:
+            values = sorted(self._values.items())
+        lines = []
+        seen = set()
+        for (name, labels), value in values:
+            if name not in seen:
+                seen.add(name)
+                lines.append(f"# HELP {name} {self.HELP.get(name, name)}")
+                lines.append(f"# TYPE {name} counter")
+            label_text = ','.join(f'{key}="{escape_label(val)}"' for key, val in labels)
+            lines.append(f"{name}{{{label_text}}} {value}")
+        for name, kind, help_text, value in extra:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.append(f"{name} {value}")
+        return '\n'.join(lines) + '\n'
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+metrics = MetricsRegistry()
+
+
+def stock_cache_metrics():
+    """Counters of the stock report result cache, as render() extra rows"""
+    from parameter.cache import stock_cache
+    stats = stock_cache.stats()
+    rows = [
+        (f'stock_result_cache_{name}_total', 'counter', f'Stock result cache {name}', stats[name])
+        for name in ('hits', 'misses', 'stale', 'expired', 'evictions')
+    ]
+    rows.append(('stock_result_cache_entries', 'gauge', 'Entries in the stock result cache', stats['size']))
+    return rows
+
+
+class QueryInstrumentationMiddleware:
+    """Profile a sample of report requests and publish the results"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.options = get_instrumentation_settings()
+
+    def should_profile(self, request):
+        if not request.path.startswith(tuple(self.options['PATH_PREFIXES'])):
+            return False
+        return random.random() < self.options['SAMPLE_RATE']
+
+    def __call__(self, request):
+        if not self.should_profile(request):
+            return self.get_response(request)
+
+        profile = QueryProfile(request.path, self.options['TOP_N']).start()
+        try:
+            response = self.get_response(request)
+        except Exception:
+            self.finish(request, profile)
+            raise
+
+        if response.streaming:
+            # Exports run their queries while the body is streamed
+            stream = self.astream if response.is_async else self.stream
+            response.streaming_content = stream(request, profile, response.streaming_content)
+        else:
+            self.finish(request, profile)
+        return response
+
+    def stream(self, request, profile, content):
+        try:
+            yield from content
+        finally:
+            self.finish(request, profile)
+
+    async def astream(self, request, profile, content):
+        """stream() for the async iterators of async views such as /api/stock/"""
+        try:
+            async for chunk in content:
+                yield chunk
+        finally:
+            self.finish(request, profile)
+
+    def finish(self, request, profile):
+        profile.stop()
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else 'unresolved'
+        metrics.observe(view, profile)
+        summary = dict(profile.summary(), view=view, method=request.method)
+        logger.info(json.dumps(summary, default=str))
+
+
+def metrics_view(request):
+    """Serve the counters in Prometheus text format
+
+    With METRICS_TOKEN set the scraper must send it as a bearer token,
+    otherwise only an active staff user may read the counters.
+    """
+    token = get_instrumentation_settings()['METRICS_TOKEN']
+    if token:
+        supplied = request.headers.get('Authorization', '')
+        allowed = hmac.compare_digest(supplied.encode(), f'Bearer {token}'.encode())
+    else:
+        user = request.user
+        allowed = user.is_active and user.is_staff
+    if not allowed:
+        return HttpResponseForbidden()
+    return HttpResponse(metrics.render(stock_cache_metrics()),
+                        content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -43,10 +43,12 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'reports.instrumentation.QueryInstrumentationMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'core.tenants.TenantMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -78,9 +80,66 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Take the write lock when a transaction starts (waits follow SQLITE_TUNING)
+        'OPTIONS': {'transaction_mode': 'IMMEDIATE'},
+    },
+    # Copy of 'default' read by the stock reports; refreshed by the
+    # refresh_reporting_database command. Tests read 'default' through it.
+    'reporting': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'reporting.sqlite3',
+        'OPTIONS': {'transaction_mode': 'IMMEDIATE'},
+        'TEST': {'MIRROR': 'default'},
+    },
+}
+
+DATABASE_ROUTERS = ['parameter.reporting.ReportingRouter', 'core.tenants.TenantRouter']
+
+# Report reads fall back to 'default' while the copy trails it by more than MAX_LAG seconds
+# See parameter.reporting.REPORTING_DEFAULTS for the available keys
+
+REPORTING_DATABASE = {
+    'ALIAS': 'reporting',
+    'MAX_LAG': 300,
+}
+
+# Pragmas applied to every SQLite connection (WAL journaling, mmap, cache size)
+# See core.sqlite.SQLITE_DEFAULTS for the available keys
+
+SQLITE_TUNING = {
+    'JOURNAL_MODE': 'WAL',
+    'SYNCHRONOUS': 'NORMAL',
+    'BUSY_TIMEOUT': 5000,
+}
+
+# Per-company databases for the item and parameter tables, registered at
+# runtime as 'company_<pk>'; None keeps every company in 'default'.
+# See core.tenants for the available keys. To enable:
+#     'DATABASE': {'ENGINE': 'django.db.backends.sqlite3',
+#                  'NAME': BASE_DIR / 'companies' / 'company_{pk}.sqlite3',
+#                  'OPTIONS': {'transaction_mode': 'IMMEDIATE'}},
+# then run `manage.py migrate_companies`.
+
+REPORT_TENANTS = {
+    'DATABASE': None,
+}
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# Must be shared by all worker processes: it carries the version key that
+# invalidates each process's cached active UserProfile.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache',
     }
 }
 
+# Runs the tests on a local-memory cache instead of the one above
+TEST_RUNNER = 'reports.testing.ReportsTestRunner'
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -122,3 +181,62 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Pooled connections to the accounting SQL Server configured in UserProfile
+# See reports.utils.POOL_DEFAULTS for the available keys
+
+SQL_SERVER_POOL = {
+    'DRIVER': 'ODBC Driver 17 for SQL Server',
+    'MAX_SIZE': 5,
+    'IDLE_TIMEOUT': 300,
+    'MAX_LIFETIME': 1800,
+}
+
+
+# Per-process cache of computed stock report results
+# See parameter.cache.CACHE_DEFAULTS for the available keys
+
+STOCK_REPORT_CACHE = {
+    'MAX_ENTRIES': 256,
+    'TIMEOUT': 300,
+}
+
+
+# Sampled SQL profiling of the admin reports, served at /metrics
+# See reports.instrumentation.INSTRUMENTATION_DEFAULTS for the available keys
+
+REPORT_INSTRUMENTATION = {
+    'SAMPLE_RATE': 0.05,
+    'TOP_N': 5,
+}
+
+# Reports computed off-request by the run_report_worker command
+# See parameter.jobs.JOB_DEFAULTS for the available keys
+
+REPORT_JOBS = {
+    'RESULT_DIR': BASE_DIR / 'report_jobs',
+    'PROCESSES': 2,
+    'KEEP_DAYS': 7,
+}
+
+# Async stock figure endpoints under /api/stock/
+# See parameter.api.API_DEFAULTS for the available keys
+
+STOCK_API = {
+    'TOKENS': [],
+    'CHUNK_SIZE': 2000,
+}
+
+# Sampled request profiles are logged at INFO to 'reports.instrumentation'.
+# No handler is attached by default; to keep them, add for example
+#
+#     LOGGING = {
+#         'version': 1,
+#         'disable_existing_loggers': False,
+#         'handlers': {'console': {'class': 'logging.StreamHandler'}},
+#         'loggers': {'reports.instrumentation': {'handlers': ['console'], 'level': 'INFO'}},
+#     }
+
+# Search ParameterStockAdmin through the token index (see parameter.search)
+PARAMETER_SEARCH_INDEX = True
@@ -17,6 +17,17 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path
 
+from core.views import select_company
+from parameter.api import stock_figures
+from parameter.views import download_report_job, report_job_status, submit_report_job
+from .instrumentation import metrics_view
+
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('metrics', metrics_view, name='metrics'),
+    path('company/', select_company, name='select_company'),
+    path('reports/jobs/', submit_report_job, name='report_job_submit'),
+    path('reports/jobs/<int:job_id>/', report_job_status, name='report_job_status'),
+    path('reports/jobs/<int:job_id>/download/', download_report_job, name='report_job_download'),
+    path('api/stock/<str:dimension>/', stock_figures, name='stock_figures'),
 ]
@@ -1,10 +1,284 @@
-import pyodbc
-def get_sql_server_connection():
-    conn = pyodbc.connect(
-        'DRIVER={ODBC Driver 17 for SQL Server};'
-        'SERVER=YOUR_SERVER_NAME;'
-        'DATABASE=YOUR_DB_NAME;'
-        'UID=your_username;'
-        'PWD=your_password'
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+try:
+    import pyodbc
+except ImportError:  # pragma: no cover - only needed when talking to SQL Server
+    pyodbc = None
+
+
+# Defaults for settings.SQL_SERVER_POOL
+POOL_DEFAULTS = {
+    'DRIVER': 'ODBC Driver 17 for SQL Server',
+    'MAX_SIZE': 5,             # connections per profile, in use or idle
+    'ACQUIRE_TIMEOUT': 30,     # seconds to wait for a free connection
+    'IDLE_TIMEOUT': 300,       # close connections idle for longer than this
+    'MAX_LIFETIME': 1800,      # recycle connections older than this
+    'HEALTH_CHECK_AFTER': 30,  # ping connections idle for longer than this
+    'LOGIN_TIMEOUT': 15,
+}
+
+
+def get_pool_settings():
+    """Return the pool settings merged over the defaults"""
+    options = dict(POOL_DEFAULTS)
+    options.update(getattr(settings, 'SQL_SERVER_POOL', {}))
+    return options
+
+
+def build_connection_string(profile, driver=None):
+    """Build an ODBC connection string from a UserProfile"""
+    server = profile.server
+    if profile.sql_port:
+        server = f"{server},{profile.sql_port}"
+    return (
+        f"DRIVER={{{driver or get_pool_settings()['DRIVER']}}};"
+        f"SERVER={server};"
+        f"DATABASE={profile.sql_database};"
+        f"UID={profile.sql_username};"
+        f"PWD={profile.sql_password}"
     )
-    return conn
\ No newline at end of file
+
+
+class PoolExhausted(Exception):
+    """Raised when no connection becomes free within ACQUIRE_TIMEOUT"""
+
+
+class PooledConnection:
+    """A raw DB-API connection with the timestamps the pool needs"""
+    __slots__ = ('raw', 'created_at', 'last_used')
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.created_at = self.last_used = time.monotonic()
+
+    def close(self):
+        try:
+            self.raw.close()
+        except Exception:
+            pass
+
+
+class ConnectionPool:
+    """Bounded, thread-safe pool of connections to one data source
+
+    Idle connections are evicted after IDLE_TIMEOUT, connections older
+    than MAX_LIFETIME are recycled, and a connection that has been idle
+    for more than HEALTH_CHECK_AFTER is pinged before it is handed out.
+    """
+
+    def __init__(self, connection_string, connect=None, **options):
+        self.connection_string = connection_string
+        self.options = get_pool_settings()
+        self.options.update(options)
+        self._connect = connect or self._odbc_connect
+        self._idle = []
+        self._size = 0
+        self._closed = False
+        self._condition = threading.Condition()
+
+    def _odbc_connect(self, connection_string):
+        if pyodbc is None:
+            raise ImportError("pyodbc is required to connect to SQL Server")
+        return pyodbc.connect(connection_string, timeout=self.options['LOGIN_TIMEOUT'])
+
+    def _expired(self, conn, now):
+        return (
+            now - conn.created_at > self.options['MAX_LIFETIME']
+            or now - conn.last_used > self.options['IDLE_TIMEOUT']
+        )
+
+    def _is_healthy(self, conn, now):
+        if now - conn.last_used <= self.options['HEALTH_CHECK_AFTER']:
+            return True
+        try:
+            cursor = conn.raw.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchall()
+            cursor.close()
+            return True
+        except Exception:
+            return False
+
+    def _discard(self, conn):
+        """Close a connection and free its slot (caller holds the lock)"""
+        conn.close()
+        self._size -= 1
+        self._condition.notify()
+
+    def evict_idle(self):
+        """Close idle connections past their idle timeout or lifetime"""
+        now = time.monotonic()
+        with self._condition:
+            for conn in [conn for conn in self._idle if self._expired(conn, now)]:
+                self._idle.remove(conn)
+                self._discard(conn)
+
+    def _checkout(self, deadline):
+        """Take an idle connection, or reserve a slot and return None (caller holds the lock)"""
+        while True:
+            if self._closed:
+                raise PoolExhausted("Connection pool has been closed")
+            now = time.monotonic()
+            while self._idle:
+                conn = self._idle.pop()
+                if self._expired(conn, now):
+                    self._discard(conn)
+                    continue
+                return conn
+            if self._size < self.options['MAX_SIZE']:
+                self._size += 1
+                return None
+            remaining = deadline - now
+            if remaining <= 0:
+                raise PoolExhausted(
+                    f"No connection available after {self.options['ACQUIRE_TIMEOUT']} seconds"
+                )
+            self._condition.wait(remaining)
+
+    def acquire(self):
+        """Take a connection from the pool, opening one if a slot is free"""
+        deadline = time.monotonic() + self.options['ACQUIRE_TIMEOUT']
+        while True:
+            with self._condition:
+                conn = self._checkout(deadline)
+            if conn is None:
+                break
+            # Ping outside the lock so a slow server does not hold up other borrowers
+            now = time.monotonic()
+            if self._is_healthy(conn, now):
+                conn.last_used = now
+                return conn
+            with self._condition:
+                self._discard(conn)
+
+        # Open the connection outside the lock; setup can take a while
+        try:
+            return PooledConnection(self._connect(self.connection_string))
+        except Exception:
+            with self._condition:
+                self._size -= 1
+                self._condition.notify()
+            raise
+
+    def release(self, conn, discard=False):
+        """Return a connection to the pool, closing it if discard is set"""
+        now = time.monotonic()
+        with self._condition:
+            if discard or self._closed or now - conn.created_at > self.options['MAX_LIFETIME']:
+                self._discard(conn)
+                return
+            conn.last_used = now
+            self._idle.append(conn)
+            self._condition.notify()
+        self.evict_idle()
+
+    @contextmanager
+    def connection(self):
+        """Context manager yielding a raw connection from the pool
+
+        The connection is rolled back and returned on exit; it is closed
+        instead when the block raised a database error.
+        """
+        conn = self.acquire()
+        discard = False
+        try:
+            yield conn.raw
+        except Exception as exc:
+            discard = pyodbc is not None and isinstance(exc, pyodbc.Error)
+            raise
+        finally:
+            if not discard:
+                try:
+                    conn.raw.rollback()
+                except Exception:
+                    discard = True
+            self.release(conn, discard=discard)
+
+    def close(self):
+        """Close idle connections; in-use ones are closed on release"""
+        with self._condition:
+            self._closed = True
+            while self._idle:
+                self._discard(self._idle.pop())
+            self._condition.notify_all()
+
+    @property
+    def size(self):
+        return self._size
+
+    @property
+    def idle_count(self):
+        return len(self._idle)
+
+
+class ConnectionManager:
+    """Hands out pooled SQL Server connections per UserProfile
+
+    Keeps one pool per profile, so work switching between companies (see
+    core.tenants) reuses each company's connections. A profile's pool is
+    closed once its connection details change, and the other profiles'
+    pools once a different profile becomes the active one.
+    """
+
+    def __init__(self, connect=None):
+        self._connect = connect
+        self._lock = threading.Lock()
+        self._pools = {}
+        self._active_pk = None
+
+    def get_pool(self, profile=None):
+        """Return the pool for profile (default: the active profile)"""
+        if profile is None:
+            from core.models import UserProfile
+            profile = UserProfile.get_active_config()
+            if profile is None:
+                raise LookupError("No active UserProfile is configured")
+            # Another process may have switched the active profile
+            if profile.pk != self._active_pk:
+                self.flush(keep=profile.pk)
+
+        connection_string = build_connection_string(profile)
+        key = (profile.pk, connection_string)
+        with self._lock:
+            pool = self._pools.get(key)
+            if pool is None:
+                for stale in [other for other in self._pools if other[0] == profile.pk]:
+                    self._pools.pop(stale).close()
+                pool = self._pools[key] = ConnectionPool(connection_string, connect=self._connect)
+            others = [other for other in self._pools.values() if other is not pool]
+        # Pools nobody borrows from never release, so sweep them here
+        for other in others:
+            other.evict_idle()
+        return pool
+
+    def connection(self, profile=None):
+        """Context manager yielding a pooled connection"""
+        return self.get_pool(profile).connection()
+
+    def flush(self, keep=None):
+        """Close every pool but those of the profile with pk keep
+
+        The next request opens fresh ones. Called with the new active
+        profile's pk when the active profile changes.
+        """
+        with self._lock:
+            self._active_pk = keep
+            for key in [key for key in self._pools if key[0] != keep]:
+                self._pools.pop(key).close()
+
+
+connection_manager = ConnectionManager()
+
+
+def get_sql_server_connection(profile=None):
+    """Return a context manager yielding a pooled SQL Server connection
+
+    Usage:
+        with get_sql_server_connection() as conn:
+            cursor = conn.cursor()
+    """
+    return connection_manager.connection(profile)